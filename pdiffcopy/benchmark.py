@@ -0,0 +1,434 @@
+# Synthetic benchmark suite for pdiffcopy.
+#
+# Author: Peter Odding <peter@peterodding.com>
+# Last Change: October 18, 2026
+# URL: https://pdiffcopy.readthedocs.io
+
+"""
+Usage: python -m pdiffcopy.benchmark [OPTIONS]
+
+Evaluate the performance of pdiffcopy using synthetic data files and realistic
+mutation patterns, without needing existing data files, an rsync daemon or any
+interaction. For each combination of mutation pattern and mode a random data
+file is generated, a mutated copy is created and the original is synchronized
+to match the copy, after which the result is verified. The results (including
+the performance report of each run) are emitted as JSON so that they can be
+compared across versions of pdiffcopy.
+
+Supported options:
+
+  -s, --size=BYTES
+
+    The size of the generated data files (defaults to 64 MiB). Can be a plain
+    integer number (bytes) or an expression like 512M, 1GiB, etc.
+
+  -p, --pattern=NAME
+
+    The mutation pattern to benchmark (can be repeated, defaults to all
+    patterns). Supported patterns are 'scattered' (random small writes),
+    'append' (data is appended), 'truncate' (the file is truncated),
+    'insert' (data is inserted, shifting the remainder of the file) and
+    'sparse' (regions of the file are zeroed).
+
+  -P, --percentage=NUMBER
+
+    The percentage of the file that's affected by each mutation
+    pattern (defaults to 10).
+
+  -M, --mode=NAME
+
+    Run the benchmark in the given mode (can be repeated, defaults to both).
+    Supported modes are 'local' (source and target are local files) and
+    'server' (the target is accessed through a pdiffcopy server that's
+    started on the loopback interface).
+
+  -b, --block-size=BYTES
+
+    Customize the block size used by pdiffcopy.
+
+  -c, --concurrency=COUNT
+
+    Customize the concurrency used by pdiffcopy.
+
+  -d, --directory=PATH
+
+    The directory where data files are generated (defaults to
+    a temporary directory that's removed afterwards).
+
+  -S, --seed=NUMBER
+
+    The seed of the random number generator that selects which parts of the
+    data files are mutated (defaults to 42, so that runs are comparable).
+
+  -o, --output=FILE
+
+    Save the JSON results to FILE instead of printing them to standard output.
+
+  -h, --help
+
+    Show this message and exit.
+"""
+
+# Standard library modules.
+import filecmp
+import getopt
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+# External dependencies.
+import coloredlogs
+from humanfriendly import Timer, format_size, parse_size
+from humanfriendly.terminal import usage, warning
+from property_manager import PropertyManager, lazy_property, mutable_property
+
+# Modules included in our package.
+from pdiffcopy import __version__
+from pdiffcopy.client import Client
+
+# Public identifiers that require documentation.
+__all__ = (
+    "BenchmarkSuite",
+    "LoopbackServer",
+    "MODES",
+    "PATTERNS",
+    "apply_pattern",
+    "generate_file",
+    "logger",
+    "main",
+    "write_random_data",
+)
+
+# Initialize a logger for this module.
+logger = logging.getLogger(__name__)
+
+PATTERNS = ("scattered", "append", "truncate", "insert", "sparse")
+"""The names of the supported mutation patterns (a tuple of strings)."""
+
+MODES = ("local", "server")
+"""The names of the supported benchmark modes (a tuple of strings)."""
+
+
+def main():
+    """Command line interface for the benchmark suite."""
+    coloredlogs.install()
+    try:
+        options, arguments = getopt.gnu_getopt(
+            sys.argv[1:],
+            "s:p:P:M:b:c:d:S:o:h",
+            [
+                "size=",
+                "pattern=",
+                "percentage=",
+                "mode=",
+                "block-size=",
+                "concurrency=",
+                "directory=",
+                "seed=",
+                "output=",
+                "help",
+            ],
+        )
+    except Exception as e:
+        warning("Error: %s", e)
+        sys.exit(1)
+    suite_opts = {}
+    client_opts = {}
+    output_file = None
+    for option, value in options:
+        if option in ("-s", "--size"):
+            suite_opts["file_size"] = parse_size(value)
+        elif option in ("-p", "--pattern"):
+            suite_opts.setdefault("patterns", []).append(value)
+        elif option in ("-P", "--percentage"):
+            suite_opts["percentage"] = float(value)
+        elif option in ("-M", "--mode"):
+            suite_opts.setdefault("modes", []).append(value)
+        elif option in ("-b", "--block-size"):
+            client_opts["block_size"] = parse_size(value)
+        elif option in ("-c", "--concurrency"):
+            client_opts["concurrency"] = int(value)
+        elif option in ("-d", "--directory"):
+            suite_opts["directory"] = value
+        elif option in ("-S", "--seed"):
+            suite_opts["seed"] = int(value)
+        elif option in ("-o", "--output"):
+            output_file = value
+        elif option in ("-h", "--help"):
+            usage(__doc__)
+            sys.exit(0)
+    try:
+        suite = BenchmarkSuite(client_options=client_opts, **suite_opts)
+        results = suite.run()
+        encoded = json.dumps(results, indent=2, sort_keys=True)
+        if output_file:
+            with open(output_file, "w") as handle:
+                handle.write(encoded + "\n")
+        else:
+            sys.stdout.write(encoded + "\n")
+    except Exception:
+        logger.exception("Benchmark suite terminating due to exception!")
+        sys.exit(1)
+
+
+class BenchmarkSuite(PropertyManager):
+
+    """Run pdiffcopy against synthetic data files and collect the results."""
+
+    @mutable_property
+    def client_options(self):
+        """Keyword arguments for :class:`~pdiffcopy.client.Client` (a dictionary, defaults to an empty dictionary)."""
+        return {}
+
+    @mutable_property
+    def directory(self):
+        """The directory where data files are generated (a string or :data:`None` to use a temporary directory)."""
+
+    @mutable_property
+    def file_size(self):
+        """The size of the generated data files in bytes (an integer, defaults to 64 MiB)."""
+        return 1024 * 1024 * 64
+
+    @mutable_property
+    def modes(self):
+        """The modes to run (a list of strings, defaults to :data:`MODES`)."""
+        return list(MODES)
+
+    @mutable_property
+    def patterns(self):
+        """The mutation patterns to run (a list of strings, defaults to :data:`PATTERNS`)."""
+        return list(PATTERNS)
+
+    @mutable_property
+    def percentage(self):
+        """The percentage of the file affected by each mutation pattern (a number, defaults to 10)."""
+        return 10
+
+    @mutable_property
+    def seed(self):
+        """The seed of the random number generator used to select mutations (an integer, defaults to 42)."""
+        return 42
+
+    @lazy_property
+    def environment(self):
+        """A dictionary with information about the environment the benchmark is run in."""
+        return dict(
+            cpu_count=os.cpu_count() if hasattr(os, "cpu_count") else None,
+            platform=platform.platform(),
+            python=platform.python_version(),
+            version=__version__,
+        )
+
+    def run(self):
+        """
+        Run the benchmark suite.
+
+        :returns: A JSON serializable dictionary with the results.
+        :raises: :exc:`~exceptions.ValueError` when an unknown pattern or mode is given.
+        """
+        for name in self.patterns:
+            if name not in PATTERNS:
+                raise ValueError("Unknown mutation pattern %r! (supported: %s)" % (name, ", ".join(PATTERNS)))
+        for name in self.modes:
+            if name not in MODES:
+                raise ValueError("Unknown mode %r! (supported: %s)" % (name, ", ".join(MODES)))
+        directory = self.directory or tempfile.mkdtemp(prefix="pdiffcopy-benchmark-")
+        server = None
+        try:
+            baseline = os.path.join(directory, "baseline.bin")
+            logger.info("Generating %s data file %s ..", format_size(self.file_size, binary=True), baseline)
+            generate_file(baseline, self.file_size)
+            if "server" in self.modes:
+                server = LoopbackServer()
+                server.start()
+            results = []
+            for pattern in self.patterns:
+                for mode in self.modes:
+                    results.append(self.run_once(baseline, directory, pattern, mode, server))
+            return dict(
+                environment=self.environment,
+                parameters=dict(
+                    client_options=self.client_options,
+                    file_size=self.file_size,
+                    percentage=self.percentage,
+                    seed=self.seed,
+                ),
+                results=results,
+            )
+        finally:
+            if server:
+                server.stop()
+            if not self.directory:
+                shutil.rmtree(directory)
+
+    def run_once(self, baseline, directory, pattern, mode, server=None):
+        """
+        Benchmark a single combination of mutation pattern and mode.
+
+        :param baseline: The pathname of the generated data file (a string).
+        :param directory: The directory where data files are created (a string).
+        :param pattern: The name of the mutation pattern (a string).
+        :param mode: The name of the mode (a string).
+        :param server: A :class:`LoopbackServer` object (required in server mode).
+        :returns: A dictionary with the results.
+        """
+        logger.info("Running benchmark of %r pattern in %s mode ..", pattern, mode)
+        source = os.path.join(directory, "source.bin")
+        target = os.path.join(directory, "target.bin")
+        shutil.copyfile(baseline, source)
+        shutil.copyfile(baseline, target)
+        rng = random.Random("%s-%s" % (self.seed, pattern))
+        apply_pattern(pattern, source, self.percentage, rng)
+        target_expression = server.get_location(target) if mode == "server" else target
+        client = Client(source=source, target=target_expression, **self.client_options)
+        timer = Timer()
+        report = client.synchronize()
+        elapsed_time = timer.elapsed_time
+        verified = filecmp.cmp(source, target, shallow=False)
+        if not verified:
+            logger.error("Verification of %r pattern in %s mode failed!", pattern, mode)
+        return dict(
+            elapsed_time=elapsed_time,
+            mode=mode,
+            pattern=pattern,
+            report=report.as_dict(),
+            source_size=os.path.getsize(source),
+            verified=verified,
+        )
+
+
+class LoopbackServer(PropertyManager):
+
+    """A ``pdiffcopy`` server that listens on the loopback interface (started as a subprocess)."""
+
+    @lazy_property
+    def port_number(self):
+        """A free port number on the loopback interface (an integer)."""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            sock.bind(("127.0.0.1", 0))
+            return sock.getsockname()[1]
+        finally:
+            sock.close()
+
+    @mutable_property
+    def process(self):
+        """The :class:`subprocess.Popen` object of the server (or :data:`None`)."""
+
+    @mutable_property
+    def timeout(self):
+        """The number of seconds to wait for the server to start (a number, defaults to 30)."""
+        return 30
+
+    def get_location(self, pathname):
+        """Get the location expression for accessing a local file through the server (a string)."""
+        return "http://127.0.0.1:%i%s" % (self.port_number, pathname)
+
+    def start(self):
+        """Start the server and wait for it to accept connections."""
+        address = "127.0.0.1:%i" % self.port_number
+        logger.info("Starting pdiffcopy server on %s ..", address)
+        self.process = subprocess.Popen([sys.executable, "-m", "pdiffcopy", "--quiet", "--listen", address])
+        timer = Timer()
+        while timer.elapsed_time < self.timeout:
+            if self.process.poll() is not None:
+                raise Exception("The pdiffcopy server exited unexpectedly!")
+            try:
+                socket.create_connection(("127.0.0.1", self.port_number), timeout=1).close()
+                return
+            except socket.error:
+                time.sleep(0.1)
+        self.stop()
+        raise Exception("Timeout waiting for pdiffcopy server to start!")
+
+    def stop(self):
+        """Stop the server."""
+        if self.process and self.process.poll() is None:
+            logger.info("Stopping pdiffcopy server ..")
+            self.process.terminate()
+            self.process.wait()
+
+
+def generate_file(pathname, size, chunk_size=1024 * 1024):
+    """
+    Generate a file with random contents.
+
+    :param pathname: The pathname of the file (a string).
+    :param size: The size of the file in bytes (an integer).
+    :param chunk_size: The number of bytes to write at once (an integer).
+    """
+    with open(pathname, "wb") as handle:
+        write_random_data(handle, size, chunk_size)
+
+
+def write_random_data(handle, size, chunk_size=1024 * 1024):
+    """
+    Write random data to a file handle.
+
+    :param handle: A file object opened for writing in binary mode.
+    :param size: The number of bytes to write (an integer).
+    :param chunk_size: The number of bytes to write at once (an integer).
+    """
+    remaining = size
+    while remaining > 0:
+        chunk = os.urandom(min(chunk_size, remaining))
+        handle.write(chunk)
+        remaining -= len(chunk)
+
+
+def apply_pattern(pattern, pathname, percentage, rng):
+    """
+    Mutate a file according to a mutation pattern.
+
+    :param pattern: The name of the mutation pattern (one of the strings in :data:`PATTERNS`).
+    :param pathname: The pathname of the file to mutate (a string).
+    :param percentage: The percentage of the file that should be affected (a number).
+    :param rng: A :class:`random.Random` object (used to select the affected regions).
+    """
+    file_size = os.path.getsize(pathname)
+    num_bytes = int(file_size / 100.0 * percentage)
+    logger.debug("Applying %r mutation pattern to %s (%i bytes) ..", pattern, pathname, num_bytes)
+    if pattern in ("scattered", "sparse"):
+        # Scattered mutations are small (database page sized) random writes,
+        # sparse mutations zero out larger regions (like deallocated extents).
+        region_size = 1024 * 4 if pattern == "scattered" else 1024 * 256
+        with open(pathname, "r+b") as handle:
+            for i in range(max(1, num_bytes // region_size)):
+                offset = rng.randrange(0, max(1, file_size - region_size))
+                handle.seek(offset)
+                if pattern == "scattered":
+                    handle.write(os.urandom(min(region_size, file_size - offset)))
+                else:
+                    handle.write(b"\0" * min(region_size, file_size - offset))
+    elif pattern == "append":
+        with open(pathname, "ab") as handle:
+            write_random_data(handle, num_bytes)
+    elif pattern == "truncate":
+        with open(pathname, "r+b") as handle:
+            handle.truncate(file_size - num_bytes)
+    elif pattern == "insert":
+        offset = rng.randrange(0, max(1, file_size))
+        temporary_file = pathname + ".tmp"
+        with open(pathname, "rb") as source, open(temporary_file, "wb") as target:
+            remaining = offset
+            while remaining > 0:
+                chunk = source.read(min(1024 * 1024, remaining))
+                target.write(chunk)
+                remaining -= len(chunk)
+            write_random_data(target, num_bytes)
+            shutil.copyfileobj(source, target)
+        os.rename(temporary_file, pathname)
+    else:
+        raise ValueError("Unknown mutation pattern %r!" % pattern)
+
+
+if __name__ == "__main__":
+    main()
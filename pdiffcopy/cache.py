@@ -0,0 +1,270 @@
+# Fast large file synchronization inspired by rsync.
+#
+# Author: Peter Odding <peter@peterodding.com>
+# Last Change: October 18, 2026
+# URL: https://pdiffcopy.readthedocs.io
+
+"""
+A block cache that's shared by the worker processes of the server.
+
+When many clients synchronize the same file from one server (for example
+when a new version of an image is rolled out to a fleet of hosts) the same
+blocks are read over and over again, by all of the :pypi:`gunicorn` worker
+processes. The page cache of the operating system helps, but each read still
+costs a system call and a copy, and under memory pressure (or when clients
+use the 'nocache' and 'direct' I/O modes) the blocks are read from disk
+again. :class:`BlockCache` keeps recently read blocks in shared memory so
+that all worker processes benefit from a block that was read once.
+
+Like :mod:`pdiffcopy.metrics` the shared memory is allocated up front (see
+:func:`BlockCache.allocate()`) so this needs to happen before the worker
+processes are forked. The cache is divided into fixed size slots which are
+grouped into sets of :attr:`~BlockCache.ways` slots: Each block can only be
+stored in the set selected by its key and the least recently used slot in
+that set is evicted to make room for it (this is how CPU caches work). This
+means lookups only need to look at a handful of slots and different sets can
+be used concurrently.
+
+Blocks are identified by the device and inode number, last modification time
+and size of the file together with the offset and size of the block, so
+changes to a file make its cached blocks unreachable (stale entries are
+evicted as usual). Because the last modification time has a limited
+resolution writes made by the server also invalidate the cached blocks of
+the file explicitly (see :func:`BlockCache.invalidate()`). This increments a
+generation counter that's included in the keys of the blocks of the file, so
+it takes constant time, and blocks read before the invalidation can't be
+served afterwards (even when they're added to the cache after the
+invalidation).
+"""
+
+# Standard library modules.
+import ctypes
+import multiprocessing
+import os
+
+# External dependencies.
+from property_manager import PropertyManager, lazy_property, mutable_property
+
+# Modules included in our package.
+from pdiffcopy import BLOCK_SIZE
+
+# Public identifiers that require documentation.
+__all__ = ("BlockCache", "DEFAULT_WAYS", "GENERATION_COUNT", "MAX_LOCKS", "get_file_identity")
+
+DEFAULT_WAYS = 8
+"""The default number of slots in each set of the cache (an integer)."""
+
+GENERATION_COUNT = 4096
+"""
+The number of generation counters (an integer).
+
+Files are mapped to generation counters based on their device and inode
+number, so files that share a counter invalidate each other's blocks.
+"""
+
+MAX_LOCKS = 64
+"""The maximum number of locks used to protect the sets of the cache (an integer)."""
+
+# The layout of the metadata of each slot: The seven fields of the key followed
+# by the length of the cached data and the value of the clock of the set when
+# the slot was last used (zero means the slot is empty).
+KEY_FIELDS = 7
+GENERATION_FIELD = 4
+LENGTH_FIELD = 7
+USED_FIELD = 8
+FIELD_COUNT = 9
+
+
+class BlockCache(PropertyManager):
+
+    """A bounded cache of blocks in shared memory with least recently used eviction."""
+
+    @mutable_property
+    def capacity(self):
+        """The number of bytes available for cached blocks (an integer, defaults to zero which disables the cache)."""
+        return 0
+
+    @mutable_property
+    def slot_size(self):
+        """
+        The size of each slot in bytes (an integer, defaults to :data:`~pdiffcopy.BLOCK_SIZE`).
+
+        Larger blocks aren't cached while smaller blocks waste the remainder of their slot.
+        """
+        return BLOCK_SIZE
+
+    @mutable_property
+    def ways(self):
+        """The number of slots in each set (an integer, defaults to :data:`DEFAULT_WAYS`)."""
+        return DEFAULT_WAYS
+
+    @property
+    def enabled(self):
+        """:data:`True` when the cache has at least one slot, :data:`False` otherwise."""
+        return self.set_count > 0
+
+    @property
+    def set_count(self):
+        """The number of sets in the cache (an integer)."""
+        return self.slot_count // self.set_size if self.set_size else 0
+
+    @property
+    def set_size(self):
+        """The number of slots in each set (:attr:`ways` limited to :attr:`slot_count`, an integer)."""
+        return min(self.ways, self.slot_count)
+
+    @property
+    def slot_count(self):
+        """The number of slots that fit in :attr:`capacity` (an integer)."""
+        return self.capacity // self.slot_size
+
+    @lazy_property(repr=False)
+    def clocks(self):
+        """The logical clock of each set, used to find the least recently used slot (a shared array of integers)."""
+        return multiprocessing.RawArray("q", self.set_count)
+
+    @lazy_property(repr=False)
+    def data(self):
+        """The cached blocks (a shared array of bytes)."""
+        return multiprocessing.RawArray("c", self.set_count * self.set_size * self.slot_size)
+
+    @lazy_property(repr=False)
+    def generations(self):
+        """The generation counters used by :func:`invalidate()` (a shared array of integers)."""
+        return multiprocessing.RawArray("q", GENERATION_COUNT)
+
+    @lazy_property(repr=False)
+    def locks(self):
+        """A tuple of :class:`multiprocessing.Lock` objects (each protects a subset of the sets)."""
+        return tuple(multiprocessing.Lock() for i in range(min(self.set_count, MAX_LOCKS)))
+
+    @lazy_property(repr=False)
+    def metadata(self):
+        """The keys, lengths and last use of the slots (a shared array of integers)."""
+        return multiprocessing.RawArray("q", self.set_count * self.set_size * FIELD_COUNT)
+
+    def allocate(self):
+        """
+        Allocate the shared memory of the cache.
+
+        This needs to be called before any processes are forked, after
+        :attr:`capacity`, :attr:`slot_size` and :attr:`ways` have been set.
+        """
+        self.clocks
+        self.data
+        self.generations
+        self.locks
+        self.metadata
+
+    def get_key(self, filename, offset, size):
+        """
+        Get the key of a block.
+
+        :param filename: The pathname of the file (a string).
+        :param offset: The byte offset of the block (an integer).
+        :param size: The size of the block in bytes (an integer).
+        :returns: A tuple of integers (the result of :func:`get_file_identity()`
+                  followed by the generation of the file, `offset` and `size`).
+        :raises: :exc:`~exceptions.OSError` when the file doesn't exist.
+        """
+        identity = get_file_identity(filename)
+        return identity + (self.generations[self.find_generation(identity)], offset, size)
+
+    def get(self, key):
+        """
+        Get a block from the cache.
+
+        :param key: The result of :func:`get_key()`.
+        :returns: The data of the block (a byte string) or :data:`None` when the block isn't cached.
+        """
+        if not self.enabled:
+            return None
+        index = self.find_set(key)
+        with self.locks[index % len(self.locks)]:
+            for slot in self.find_slots(index):
+                base = slot * FIELD_COUNT
+                if self.metadata[base + USED_FIELD] and tuple(self.metadata[base:base + KEY_FIELDS]) == key:
+                    self.clocks[index] += 1
+                    self.metadata[base + USED_FIELD] = self.clocks[index]
+                    address = ctypes.addressof(self.data) + slot * self.slot_size
+                    return ctypes.string_at(address, self.metadata[base + LENGTH_FIELD])
+
+    def put(self, key, data):
+        """
+        Add a block to the cache.
+
+        :param key: The result of :func:`get_key()`.
+        :param data: The data of the block (a byte string).
+        :returns: :data:`True` when another block was evicted to make room, :data:`False` otherwise.
+        """
+        if not self.enabled or len(data) > self.slot_size:
+            return False
+        index = self.find_set(key)
+        with self.locks[index % len(self.locks)]:
+            if key[GENERATION_FIELD] != self.generations[self.find_generation(key)]:
+                # The file was invalidated while the block was being read.
+                return False
+            victim = None
+            for slot in self.find_slots(index):
+                base = slot * FIELD_COUNT
+                used = self.metadata[base + USED_FIELD]
+                if not used or tuple(self.metadata[base:base + KEY_FIELDS]) == key:
+                    # Use an empty slot or replace the same block (added by another process).
+                    victim = slot
+                    break
+                if victim is None or used < self.metadata[victim * FIELD_COUNT + USED_FIELD]:
+                    victim = slot
+            base = victim * FIELD_COUNT
+            evicted = bool(self.metadata[base + USED_FIELD]) and tuple(self.metadata[base:base + KEY_FIELDS]) != key
+            ctypes.memmove(ctypes.addressof(self.data) + victim * self.slot_size, data, len(data))
+            self.metadata[base:base + KEY_FIELDS] = key
+            self.metadata[base + LENGTH_FIELD] = len(data)
+            self.clocks[index] += 1
+            self.metadata[base + USED_FIELD] = self.clocks[index]
+            return evicted
+
+    def invalidate(self, filename):
+        """
+        Make the cached blocks of a file unreachable.
+
+        :param filename: The pathname of the file (a string).
+
+        This increments the generation of the file, so it takes constant time
+        (the blocks are evicted as usual). It needs to be called after the
+        file has been written to, so that blocks read concurrently with the
+        write aren't added to the cache (see :func:`put()`).
+        """
+        if self.enabled:
+            try:
+                identity = get_file_identity(filename)
+            except OSError:
+                return
+            index = self.find_generation(identity)
+            with self.locks[index % len(self.locks)]:
+                self.generations[index] += 1
+
+    def find_generation(self, identity):
+        """Get the index of the generation counter of a file (an integer, `identity` can also be a key)."""
+        return hash(tuple(identity[:2])) % GENERATION_COUNT
+
+    def find_set(self, key):
+        """Get the index of the set in which the block with the given key can be stored (an integer)."""
+        # The hash values of tuples of integers are the same in all processes.
+        return hash(key) % self.set_count
+
+    def find_slots(self, index):
+        """Get the indexes of the slots in the set with the given index (a :class:`range` object)."""
+        return range(index * self.set_size, (index + 1) * self.set_size)
+
+
+def get_file_identity(filename):
+    """
+    Get the identity of a file.
+
+    :param filename: The pathname of the file (a string).
+    :returns: A tuple with four integers (the device number, inode number,
+              last modification time in nanoseconds and size of the file).
+    :raises: :exc:`~exceptions.OSError` when the file doesn't exist.
+    """
+    info = os.stat(filename)
+    return info.st_dev, info.st_ino, int(info.st_mtime * 1e9), info.st_size
@@ -1,11 +1,11 @@
 # Command line interface for pdiffcopy.
 #
 # Author: Peter Odding <peter@peterodding.com>
-# Last Change: March 6, 2020
+# Last Change: October 18, 2026
 # URL: https://pdiffcopy.readthedocs.io
 
 """
-Usage: pdiffcopy [OPTIONS] [SOURCE, TARGET]
+Usage: pdiffcopy [OPTIONS] [SOURCE, TARGET...]
 
 Synchronize large binary data files between Linux servers at blazing speeds
 by performing delta transfers and spreading the work over many CPU cores.
@@ -15,6 +15,24 @@ local file and the other argument is expected to be a URL that provides the
 location of a remote pdiffcopy server and a remote filename. File data will be
 read from SOURCE and written to TARGET.
 
+When SOURCE and TARGET are both URLs the target server pulls the changed
+blocks directly from the source server, so file data doesn't pass through
+the client (the host name in SOURCE needs to resolve on the target server).
+
+When more than one TARGET is given the SOURCE file is hashed only once and
+each changed block is read only once and written to every TARGET that needs
+it (this can't be combined with --append-only, --recursive, --benchmark,
+--journal or --verify).
+
+SOURCE can also be the URL of a file on a generic HTTP server that supports
+range requests (for example a static file server or a caching proxy), by
+prefixing the URL with 'static+' (as in static+https://example.com/image.bin).
+Because such servers can't compute hashes a whole file copy is done (unless
+--append-only is given) and blocks are downloaded using multi-range requests.
+
+When the --recursive option is given SOURCE and TARGET are expected to be
+directories and all files in the SOURCE directory tree are synchronized.
+
 If no positional arguments are given the server is started.
 
 Supported options:
@@ -22,7 +40,16 @@ Supported options:
   -b, --block-size=BYTES
 
     Customize the block size of the delta transfer. Can be a plain
-    integer number (bytes) or an expression like 5K, 1MiB, etc.
+    integer number (bytes) or an expression like 5K, 1MiB, etc. The
+    value 'auto' selects a block size based on the size of SOURCE.
+
+  -f, --fine-block-size=BYTES
+
+    Enable two level comparison: First the hashes of blocks of the size given
+    by --block-size are compared, then the mismatching blocks are rehashed (on
+    both sides) in smaller blocks of the size given by this option, and only
+    the mismatching smaller blocks are transferred. The fine block size must
+    evenly divide the block size.
 
   -m, --hash-method=NAME
 
@@ -34,10 +61,150 @@ Supported options:
     Disable the delta transfer algorithm (skips computing
     of hashing and downloads all blocks unconditionally).
 
+  --append-only
+
+    Assume that SOURCE is only ever appended to (like a log file). A sample of
+    blocks in the part of SOURCE that TARGET already contains is compared and
+    when those blocks match only the data after the end of TARGET is
+    transferred (otherwise a regular delta transfer is done). This makes the
+    synchronization of a growing file proportional to the amount of new data.
+
+  --append-samples=COUNT
+
+    The number of blocks compared by --append-only (defaults to 32). When
+    10% of the blocks were modified, 32 samples notice with a confidence of
+    about 97%. Increase this to notice smaller modifications.
+
+  --local-comparison
+
+    Download the hashes of the remote file and compare them locally. By
+    default the hashes of the local file are uploaded to the server, which
+    compares them and only responds with the offsets of the changed blocks.
+
+  --no-deduplicate
+
+    Transfer every changed block. By default changed blocks with identical
+    contents (for example blocks of zeros) are transferred only once and then
+    copied to the other offsets within the target file.
+
+  --no-move-detection
+
+    Transfer every changed block. By default changed blocks whose contents
+    exist at another offset in the target file (because data moved around
+    within the file) are copied within the target file instead.
+
+  --range-requests
+
+    Read blocks from a remote SOURCE using standard HTTP range requests on the
+    /files endpoint of the server (instead of the /blocks endpoint), so that
+    a caching reverse proxy in front of the server can serve repeated reads.
+
+  -r, --recursive
+
+    Synchronize a directory tree instead of a single file. Files whose size
+    and last modification time match are skipped, the remaining files share
+    a single pool of worker processes for hashing and copying blocks.
+
   -c, --concurrency=COUNT
 
     Change the number of parallel block hash / copy operations.
 
+  --hash-concurrency=COUNT
+
+    Change the number of parallel block hash operations (overrides --concurrency).
+
+  --transfer-concurrency=COUNT
+
+    Change the number of parallel block copy operations (overrides --concurrency).
+
+  --hash-schedule=MODE
+
+    Change how hashing work is distributed over worker processes. In the
+    default mode 'blocks' each block is a separate unit of work, so workers
+    read interleaved blocks. In the mode 'stripes' each worker hashes large
+    contiguous stripes of the file (which shrink towards the end to keep all
+    workers busy), so every worker reads sequentially. This avoids seek storms
+    on spinning disks. Applies to the server as well.
+
+  -D, --durability=POLICY
+
+    Change how written data is made durable on the target. The default policy
+    'none' leaves this to the operating system. The policy 'end' synchronizes
+    the target file to disk after all blocks have been written. The policy
+    'periodic' does the same but also starts write-back of written data each
+    time a worker process has written --sync-interval bytes, so that the final
+    synchronization is quick. The policy 'block' synchronizes each block to
+    disk before it's acknowledged (slow but every written block is durable).
+
+  --sync-interval=BYTES
+
+    The number of bytes written by each worker process between write-backs
+    when --durability=periodic is used (defaults to 64 MiB).
+
+  --io-mode=MODE
+
+    Change how blocks are read while hashing and transferring. The default
+    mode 'buffered' reads through the page cache. The mode 'nocache' tells the
+    kernel to drop blocks from the page cache after they've been read, so that
+    synchronizing large files doesn't evict the working set of other programs.
+    The mode 'direct' bypasses the page cache using O_DIRECT (when supported by
+    the filesystem, otherwise 'nocache' is used). The mode also applies to the
+    server when it reads blocks on behalf of the client.
+
+  -a, --autotune
+
+    Tune the number of active worker processes based on measured throughput,
+    separately for hashing and copying. The concurrency options define the
+    maximum number of processes. The values that were converged on are logged
+    so that they can be reused with --hash-concurrency and --transfer-concurrency.
+
+  -j, --journal=FILE
+
+    Record the progress of the transfer in the given journal file. When an
+    interrupted transfer is restarted with the same journal file (and the
+    source file hasn't changed) the remaining blocks are transferred without
+    recomputing any hashes. The journal is removed when the transfer is done.
+
+  -R, --report=FILE
+
+    Save a machine readable performance report in JSON format to FILE (use '-'
+    for standard output). The report includes the time spent in each phase of
+    the synchronization, the number of bytes hashed and transferred, block
+    transfer latency percentiles and worker utilization.
+
+  -p, --profile=DIRECTORY
+
+    Profile the client or server (including all of their child processes) and
+    save the statistics of each process to DIRECTORY. The client merges the
+    statistics when it's done, saves them to DIRECTORY/merged.pstats and prints
+    the most expensive functions. The server profiles each request separately.
+
+  -t, --trace=FILE
+
+    Record a timeline of what the client or server (including all of their
+    child processes) is doing and save it to FILE in the Chrome trace event
+    format, which can be loaded in chrome://tracing or https://ui.perfetto.dev.
+    The server saves the trace when it's shut down.
+
+  --verify
+
+    Verify that TARGET matches SOURCE after the changes have been transferred.
+    The hashes computed to find the changes are reused, so only the
+    transferred blocks of TARGET are hashed again and combined with the
+    hashes of the other blocks into a digest of the whole file (which is
+    compared with the digest of SOURCE). Blocks that differ are transferred
+    again.
+
+  -w, --watch=SECONDS
+
+    Keep running and synchronize changes to SOURCE (which must be a local
+    file) at most once every SECONDS (a number or an expression like 30s or
+    5m). SOURCE is watched using inotify (or polled on systems without
+    inotify) and the hashes of SOURCE are remembered between
+    synchronizations, so after the first synchronization only SOURCE is
+    hashed. Both files are compared again when SOURCE is replaced or change
+    notifications were lost. Press Control-C to stop.
+
   -n, --dry-run
 
     Scan for differences between the source and target file and report the
@@ -54,6 +221,13 @@ Supported options:
 
     Listen on the specified IP:PORT or PORT.
 
+  --cache-size=BYTES
+
+    Keep recently read blocks in a cache of the given size (an expression like
+    256MiB) that's shared by the worker processes of the server, so that
+    blocks requested by many clients are read from disk only once. Disabled
+    by default. Blocks larger than 1 MiB aren't cached.
+
   -v, --verbose
 
     Increase logging verbosity (can be repeated).
@@ -70,15 +244,23 @@ Supported options:
 # Standard library modules.
 import getopt
 import logging
+import os
+import shutil
 import sys
+import tempfile
+import time
 
 # External dependencies.
 import coloredlogs
-from humanfriendly import parse_size
-from humanfriendly.terminal import warning, usage
+from humanfriendly import parse_size, parse_timespan
+from humanfriendly.terminal import output, warning, usage
 
 # Modules included in our package.
 from pdiffcopy.exceptions import DependencyError
+from pdiffcopy.hashing import SCHEDULES
+from pdiffcopy.operations import DURABILITY_POLICIES, IO_MODES
+from pdiffcopy.profiling import enable_profiling, format_profile, merge_profiles, profile_process
+from pdiffcopy.tracing import enable_tracing, merge_traces, set_process_name
 
 # Initialize a logger for this module.
 logger = logging.getLogger(__name__)
@@ -92,14 +274,36 @@ def main():
     try:
         options, arguments = getopt.gnu_getopt(
             sys.argv[1:],
-            "b:m:Wc:B:l:nvqh",
+            "b:f:m:Wrc:aD:B:l:j:R:p:t:w:nvqh",
             [
                 "block-size=",
+                "fine-block-size=",
                 "hash-method=",
                 "whole-file",
+                "append-only",
+                "append-samples=",
+                "local-comparison",
+                "no-deduplicate",
+                "no-move-detection",
+                "range-requests",
+                "recursive",
                 "concurrency=",
+                "hash-concurrency=",
+                "transfer-concurrency=",
+                "hash-schedule=",
+                "io-mode=",
+                "durability=",
+                "sync-interval=",
+                "autotune",
                 "benchmark=",
                 "listen=",
+                "cache-size=",
+                "journal=",
+                "report=",
+                "profile=",
+                "trace=",
+                "verify",
+                "watch=",
                 "dry-run",
                 "verbose",
                 "quiet",
@@ -112,21 +316,80 @@ def main():
     # Command line option defaults.
     client_opts = {}
     server_opts = {}
+    profile_directory = None
+    trace_file = None
     # Map parsed options to variables.
     for option, value in options:
         if option in ("-b", "--block-size"):
-            client_opts["block_size"] = parse_size(value)
+            if value.lower() == "auto":
+                client_opts["adaptive_block_size"] = True
+            else:
+                client_opts["block_size"] = parse_size(value)
+        elif option in ("-f", "--fine-block-size"):
+            client_opts["fine_block_size"] = parse_size(value)
         elif option in ("-m", "--hash-method"):
             client_opts["hash_method"] = value
         elif option in ("-W", "--whole-file"):
             client_opts["delta_transfer"] = False
+        elif option == "--append-only":
+            client_opts["append_only"] = True
+        elif option == "--append-samples":
+            client_opts["append_samples"] = int(value)
+        elif option == "--local-comparison":
+            client_opts["server_comparison"] = False
+        elif option == "--no-deduplicate":
+            client_opts["deduplicate"] = False
+        elif option == "--no-move-detection":
+            client_opts["detect_moves"] = False
+        elif option == "--range-requests":
+            client_opts["range_requests"] = True
+        elif option in ("-r", "--recursive"):
+            client_opts["recursive"] = True
         elif option in ("-c", "--concurrency"):
             client_opts["concurrency"] = int(value)
             server_opts["concurrency"] = int(value)
+        elif option == "--hash-concurrency":
+            client_opts["hash_concurrency"] = int(value)
+        elif option == "--transfer-concurrency":
+            client_opts["transfer_concurrency"] = int(value)
+        elif option == "--hash-schedule":
+            if value not in SCHEDULES:
+                warning("Error: Unsupported hash schedule %r! (supported: %s)", value, ", ".join(SCHEDULES))
+                sys.exit(1)
+            client_opts["hash_schedule"] = value
+        elif option == "--io-mode":
+            if value not in IO_MODES:
+                warning("Error: Unsupported I/O mode %r! (supported: %s)", value, ", ".join(IO_MODES))
+                sys.exit(1)
+            client_opts["io_mode"] = value
+        elif option in ("-D", "--durability"):
+            if value not in DURABILITY_POLICIES:
+                msg = "Error: Unsupported durability policy %r! (supported: %s)"
+                warning(msg, value, ", ".join(DURABILITY_POLICIES))
+                sys.exit(1)
+            client_opts["durability"] = value
+        elif option == "--sync-interval":
+            client_opts["sync_interval"] = parse_size(value)
+        elif option in ("-a", "--autotune"):
+            client_opts["autotune"] = True
         elif option in ("-B", "--benchmark"):
             client_opts["benchmark"] = int(value)
         elif option in ("-l", "--listen"):
             server_opts["address"] = value
+        elif option == "--cache-size":
+            server_opts["cache_size"] = parse_size(value)
+        elif option in ("-j", "--journal"):
+            client_opts["journal_file"] = os.path.abspath(value)
+        elif option in ("-R", "--report"):
+            client_opts["report_file"] = value if value == "-" else os.path.abspath(value)
+        elif option in ("-p", "--profile"):
+            profile_directory = value
+        elif option in ("-t", "--trace"):
+            trace_file = os.path.abspath(value)
+        elif option == "--verify":
+            client_opts["verify"] = True
+        elif option in ("-w", "--watch"):
+            client_opts["watch_interval"] = parse_timespan(value)
         elif option in ("-n", "--dry-run"):
             client_opts["dry_run"] = True
         elif option in ("-v", "--verbose"):
@@ -137,19 +400,39 @@ def main():
             usage(__doc__)
             sys.exit(0)
     # Execute the requested action.
+    main_pid = os.getpid()
+    trace_directory = None
     try:
+        if profile_directory:
+            enable_profiling(profile_directory)
+        if trace_file:
+            trace_directory = tempfile.mkdtemp(prefix="pdiffcopy-trace-")
+            enable_tracing(trace_directory)
+            set_process_name("Client" if arguments else "Server")
         if arguments:
-            if len(arguments) != 2:
-                warning("Error: Two positional arguments expected!")
+            if len(arguments) < 2:
+                warning("Error: At least two positional arguments expected!")
                 sys.exit(1)
             client_opts['source'] = arguments[0]
-            client_opts['target'] = arguments[1]
-            run_client(**client_opts)
+            if len(arguments) > 2:
+                client_opts['targets'] = arguments[1:]
+            else:
+                client_opts['target'] = arguments[1]
+            if profile_directory:
+                run_profiled_client(profile_directory, **client_opts)
+            else:
+                run_client(**client_opts)
         else:
             run_server(**server_opts)
     except Exception:
         logger.exception("Program terminating due to exception!")
         sys.exit(1)
+    finally:
+        # Forked gunicorn workers also end up here when they exit, but only
+        # the process that enabled tracing should merge the trace.
+        if trace_directory and os.getpid() == main_pid:
+            merge_traces(trace_directory, trace_file)
+            shutil.rmtree(trace_directory)
 
 
 def run_client(**options):
@@ -166,6 +449,19 @@ def run_client(**options):
         )
 
 
+def run_profiled_client(directory, **options):
+    """Run the client program with profiling enabled and report the merged statistics."""
+    start_time = time.time()
+    with profile_process("client"):
+        run_client(**options)
+    stats = merge_profiles(directory, since=start_time)
+    if stats:
+        filename = os.path.join(directory, "merged.pstats")
+        logger.info("Saving merged profile statistics to %s ..", filename)
+        stats.dump_stats(filename)
+        output(format_profile(stats))
+
+
 def run_server(**options):
     """Run the server program."""
     try:
@@ -1,15 +1,19 @@
 # Fast large file synchronization inspired by rsync.
 #
 # Author: Peter Odding <peter@peterodding.com>
-# Last Change: March 6, 2020
+# Last Change: October 18, 2026
 # URL: https://pdiffcopy.readthedocs.io
 
 """Parallel, differential file copy client."""
 
 # Standard library modules.
+import email.utils
 import functools
+import hashlib
+import json
 import os
 import pipes
+import random
 import subprocess
 
 # External dependencies.
@@ -19,29 +23,134 @@ from humanfriendly.prompts import prompt_for_confirmation
 from humanfriendly.tables import format_pretty_table
 from humanfriendly.terminal import output
 from humanfriendly.terminal.spinners import Spinner
-from humanfriendly.text import compact, format, pluralize
-from property_manager import PropertyManager, cached_property, mutable_property, set_property
-from six.moves.urllib.parse import urlencode, urlparse, urlunparse
+from humanfriendly.text import compact, concatenate, format, pluralize
+from property_manager import PropertyManager, cached_property, lazy_property, mutable_property, set_property
+from six.moves.urllib.parse import quote, unquote, urlencode, urlparse, urlunparse
 from verboselogs import VerboseLogger
 
 # Modules included in our package.
 from pdiffcopy import BLOCK_SIZE, DEFAULT_CONCURRENCY, DEFAULT_PORT
-from pdiffcopy.exceptions import BenchmarkAbortedError
-from pdiffcopy.hashing import compute_hashes
+from pdiffcopy.digests import DigestArray, compare_digests, find_moves, tree_digest
+from pdiffcopy.exceptions import BenchmarkAbortedError, TransferError, VerificationError
+from pdiffcopy.hashing import compute_hashes, compute_tree_hashes, decode_hash, generate_range_offsets, pack_hash
+from pdiffcopy.journal import Journal
 from pdiffcopy.mp import Promise, WorkerPool
-from pdiffcopy.operations import get_file_info, read_block, resize_file, write_block
+from pdiffcopy.operations import (
+    DEFAULT_SYNC_INTERVAL,
+    clone_file,
+    copy_block,
+    copy_blocks,
+    get_file_info,
+    list_files,
+    read_block,
+    resize_file,
+    set_mtime,
+    sync_file,
+    write_block,
+)
+from pdiffcopy.ranges import format_range_header, merge_ranges, parse_content_range, parse_multipart_byteranges
+from pdiffcopy.report import PerformanceReport
+from pdiffcopy.tracing import span
+from pdiffcopy.watch import REPLACED, FileWatcher
 
 # Public identifiers that require documentation.
-__all__ = ("Client", "get_hashes_fn", "Location", "logger", "transfer_block_fn")
+__all__ = (
+    "COPY_BATCH_SIZE",
+    "Client",
+    "PULL_BATCH_SIZE",
+    "RANGE_BATCH_SIZE",
+    "STATIC_SCHEMES",
+    "compare_hashes",
+    "fanout_block_fn",
+    "generate_batches",
+    "get_hashes_fn",
+    "get_tree_hashes_fn",
+    "Location",
+    "logger",
+    "offsets_to_ranges",
+    "pull_blocks_fn",
+    "read_blocks_fn",
+    "select_block_size",
+    "select_samples",
+    "transfer_block_fn",
+    "transfer_duplicates_fn",
+    "transfer_tree_block_fn",
+)
 
 # Initialize a logger for this module.
 logger = VerboseLogger(__name__)
 
+COPY_BATCH_SIZE = 1024
+"""The maximum number of copies within the target that are requested at once (an integer)."""
+
+PULL_BATCH_SIZE = 16
+"""The number of blocks that a server is asked to pull from another server in a single request (an integer)."""
+
+RANGE_BATCH_SIZE = 16
+"""The maximum number of blocks that are requested at once using a multi-range request (an integer)."""
+
+STATIC_SCHEMES = ("static+http", "static+https")
+"""The URL schemes of location expressions that refer to generic HTTP servers (a tuple of strings)."""
+
 
 class Client(PropertyManager):
 
     """Python API for the client side of the ``pdiffcopy`` program."""
 
+    @mutable_property
+    def adaptive_block_size(self):
+        """
+        Whether to select the block size based on the size of the :attr:`source` file.
+
+        A boolean, defaults to :data:`False`. When this is :data:`True` the
+        default value of :attr:`block_size` is computed by
+        :func:`select_block_size()` (this only applies to single file
+        synchronization, not to :attr:`recursive` mode).
+        """
+        return False
+
+    @mutable_property
+    def append_only(self):
+        """
+        Whether to assume that :attr:`source` only grows (a boolean, defaults to :data:`False`).
+
+        Log files and write-ahead logs are only ever appended to, in which
+        case hashing both files completely to find that only the tail of the
+        source is new is wasted effort. When this is :data:`True` and the
+        target isn't larger than the source, :func:`find_appended_blocks()`
+        hashes a sample of :attr:`append_samples` blocks of the common prefix
+        on both sides and when those match only the data after the end of the
+        target is transferred. Otherwise a regular delta transfer is done.
+        """
+        return False
+
+    @mutable_property
+    def append_samples(self):
+        """
+        The number of blocks used to verify the common prefix when :attr:`append_only` is set (an integer).
+
+        Defaults to 32. The first and last blocks of the prefix are always
+        included. When a fraction `p` of the blocks in the prefix was modified
+        the probability that none of `n` random samples notices is ``(1 - p) ** n``,
+        so the default catches a modification of 10% of the prefix with a
+        confidence of about 97% (increase this to detect smaller modifications).
+        """
+        return 32
+
+    @mutable_property
+    def autotune(self):
+        """
+        Whether to tune concurrency based on measured throughput (a boolean, defaults to :data:`False`).
+
+        When this is :data:`True` the number of active worker processes is
+        ramped up and down separately for the hashing and transfer phases
+        (see :class:`~pdiffcopy.mp.ConcurrencyTuner`) and the values that
+        were converged on are logged, so that they can be reused via
+        :attr:`hash_concurrency` and :attr:`transfer_concurrency`. In this
+        case those properties define the maximum concurrency.
+        """
+        return False
+
     @mutable_property
     def benchmark(self):
         """How many times the benchmark should be run (an integer, defaults to 0)."""
@@ -49,29 +158,210 @@ class Client(PropertyManager):
 
     @mutable_property
     def block_size(self):
-        """The block size used by the client."""
+        """
+        The block size used by the client (an integer).
+
+        Defaults to :data:`~pdiffcopy.BLOCK_SIZE` unless
+        :attr:`adaptive_block_size` is enabled.
+        """
+        if self.adaptive_block_size and not self.recursive and self.source.file_size:
+            return select_block_size(self.source.file_size)
         return BLOCK_SIZE
 
+    @mutable_property
+    def changed_hashes(self):
+        """
+        The source hashes of the blocks that differ (a :class:`~pdiffcopy.digests.DigestArray` or :data:`None`).
+
+        This is set by :func:`compare_blocks()` and used by
+        :func:`transfer_changes()` when :attr:`deduplicate` is enabled.
+        """
+
     @mutable_property
     def concurrency(self):
         """The number of parallel processes that the client is allowed to start."""
         return DEFAULT_CONCURRENCY
 
+    @mutable_property
+    def deduplicate(self):
+        """
+        Whether identical changed blocks are transferred only once (a boolean, defaults to :data:`True`).
+
+        Disk images and backups often contain many identical blocks (for
+        example blocks of zeros). When several changed blocks have the same
+        hash in the :attr:`source`, one of them is transferred and the target
+        copies it to the other offsets itself (see :func:`Location.copy_blocks()`).
+        This relies on the hashes computed by :func:`find_changes()` so it
+        doesn't apply to whole file copies or resumed transfers.
+        """
+        return True
+
     @mutable_property
     def delta_transfer(self):
         """Whether delta transfer is enabled (a boolean, defaults to :data:`True`)."""
         return True
 
+    @mutable_property
+    def detect_moves(self):
+        """
+        Whether to look for changed blocks that exist elsewhere in the target (a boolean, defaults to :data:`True`).
+
+        When data moves around within a file (for example because a database
+        reorganized its pages) the contents of a changed block often exist at
+        another offset in the :attr:`target`. Such blocks are copied within
+        the target (see :func:`Location.copy_blocks()`) before any other
+        changes are transferred, so that only data that doesn't exist
+        anywhere in the target is sent over the network. Like
+        :attr:`deduplicate` this doesn't apply to whole file copies or
+        resumed transfers.
+        """
+        return True
+
     @mutable_property
     def dry_run(self):
         """Whether the client is allowed to make changes."""
         return False
 
+    @mutable_property
+    def durability(self):
+        """
+        The durability policy for writes to the :attr:`target` (a string, defaults to 'none').
+
+        See :data:`~pdiffcopy.operations.DURABILITY_POLICIES` for the
+        supported values. For the policies 'end' and 'periodic' the target is
+        synchronized to disk after all changed blocks have been transferred.
+        """
+        return "none"
+
+    @mutable_property
+    def fine_block_size(self):
+        """
+        The block size of the second level of comparison (an integer or :data:`None`).
+
+        When this is set :func:`find_changes()` first compares the hashes of
+        large blocks (based on :attr:`block_size`) and then rehashes only the
+        mismatching large blocks in smaller blocks of :attr:`fine_block_size`,
+        on both sides. This combines the hashing cost of large blocks with the
+        transfer precision of small blocks. The value must evenly divide
+        :attr:`block_size`.
+        """
+
+    @mutable_property
+    def hash_concurrency(self):
+        """The number of parallel processes used for hashing (an integer, defaults to :attr:`concurrency`)."""
+        return self.concurrency
+
+    @mutable_property
+    def hash_schedule(self):
+        """
+        How hashing work is distributed over worker processes (a string, defaults to 'blocks').
+
+        See :data:`~pdiffcopy.hashing.SCHEDULES` for the supported values.
+        This only applies to single file synchronization, not to
+        :attr:`recursive` mode.
+        """
+        return "blocks"
+
     @mutable_property
     def hash_method(self):
         """The block hash method (a string, defaults to 'sha1')."""
         return "sha1"
 
+    @mutable_property
+    def io_mode(self):
+        """
+        How blocks are read while hashing and transferring (a string, defaults to 'buffered').
+
+        See :data:`~pdiffcopy.operations.IO_MODES` for the supported values.
+        The 'nocache' and 'direct' modes avoid evicting the page cache, which
+        matters when synchronizing large files on hosts that run other
+        workloads.
+        """
+        return "buffered"
+
+    @cached_property
+    def journal(self):
+        """A :class:`~pdiffcopy.journal.Journal` based on :attr:`journal_file` (or :data:`None`)."""
+        return Journal(filename=self.journal_file) if self.journal_file else None
+
+    @mutable_property
+    def journal_file(self):
+        """
+        The pathname of a progress journal (a string or :data:`None`).
+
+        When this is set the client records which blocks have been
+        transferred, so that an interrupted transfer can be resumed
+        without having to recompute the hashes of both files.
+        """
+
+    @property
+    def journal_identity(self):
+        """A dictionary with the identity of the current transfer (used by :attr:`journal`)."""
+        return dict(
+            block_size=self.transfer_block_size,
+            hash_method=self.hash_method,
+            source=self.source.expression,
+            source_mtime=self.source.file_info.get("mtime"),
+            source_size=self.source.file_size,
+            target=self.target.expression,
+        )
+
+    @mutable_property
+    def moved_blocks(self):
+        """
+        Changed blocks that can be copied from another offset in the target (a list or :data:`None`).
+
+        This is a list of tuples with two integers each (the offset to copy
+        from and the offset to copy to) set by :func:`compare_blocks()` when
+        :attr:`detect_moves` is enabled (see :func:`~pdiffcopy.digests.find_moves()`).
+        """
+
+    @mutable_property
+    def range_requests(self):
+        """
+        Whether blocks are read from a remote :attr:`source` using standard HTTP range requests (a boolean).
+
+        Defaults to :data:`False` (see :attr:`Location.range_requests`).
+        """
+        return False
+
+    @mutable_property
+    def recursive(self):
+        """Whether :attr:`source` and :attr:`target` are directory trees (a boolean, defaults to :data:`False`)."""
+        return False
+
+    @lazy_property(writable=True)
+    def report(self):
+        """
+        A :class:`~pdiffcopy.report.PerformanceReport` with timings and counters of the last run.
+
+        A new report is created at the start of :func:`synchronize_once()`
+        and :func:`synchronize_tree()`.
+        """
+        return PerformanceReport()
+
+    @mutable_property
+    def report_file(self):
+        """The pathname of a JSON file where :func:`synchronize()` saves :attr:`report` (a string or :data:`None`)."""
+
+    @mutable_property
+    def server_comparison(self):
+        """
+        Whether hashes are compared by the server (a boolean, defaults to :data:`True`).
+
+        When exactly one of :attr:`source` and :attr:`target` is remote the
+        client uploads the hashes of its local file to the server, which
+        compares them with its own hashes and responds with the offsets of
+        the changed blocks only (see :func:`Location.compare_with()`). This
+        reduces the amount of data transferred and the memory used by the
+        client. When this is :data:`False` the client downloads the hashes
+        of the remote file and compares them itself. This is also what
+        happens when the server doesn't support comparing hashes (because
+        it's running an older version of pdiffcopy), in which case this
+        property is changed to :data:`False`.
+        """
+        return True
+
     @mutable_property
     def source(self):
         """The :class:`Location` from which data is read."""
@@ -81,6 +371,28 @@ class Client(PropertyManager):
         """Automatically coerce :attr:`source` to a :class:`Location`."""
         set_property(self, "source", Location(expression=value))
 
+    @mutable_property
+    def source_hashes(self):
+        """
+        The source hashes of the previous synchronization (a :class:`~pdiffcopy.digests.DigestArray` or :data:`None`).
+
+        These are only kept when :attr:`watch_interval` or :attr:`verify` is
+        set, because after a successful synchronization they also describe
+        the contents of :attr:`target`, which allows :func:`synchronize_incremental()`
+        to find the changes and :func:`verify_changes()` to verify the target
+        without hashing the whole target.
+        """
+
+    @mutable_property
+    def sync_interval(self):
+        """
+        The number of bytes between write-backs for the 'periodic' :attr:`durability` policy (an integer).
+
+        Defaults to :data:`~pdiffcopy.operations.DEFAULT_SYNC_INTERVAL`.
+        The interval applies to each worker process separately.
+        """
+        return DEFAULT_SYNC_INTERVAL
+
     @mutable_property
     def target(self):
         """The :class:`Location` to which data is written."""
@@ -90,11 +402,80 @@ class Client(PropertyManager):
         """Automatically coerce :attr:`target` to a :class:`Location`."""
         set_property(self, "target", Location(expression=value))
 
-    def compute_transfer_size(self, offsets):
+    @mutable_property
+    def targets(self):
+        """
+        The :class:`Location` objects to which data is written (a list, defaults to :attr:`target`).
+
+        When more than one target is given :func:`synchronize()` calls
+        :func:`synchronize_fanout()` to update all targets in a single run.
+        Setting this property also sets :attr:`target` to the first target.
+        """
+        return [self.target] if self.target else []
+
+    @targets.setter
+    def targets(self, value):
+        """Automatically coerce :attr:`targets` to a list of :class:`Location` objects."""
+        locations = [v if isinstance(v, Location) else Location(expression=v) for v in value]
+        set_property(self, "targets", locations)
+        if locations:
+            set_property(self, "target", locations[0])
+
+    @mutable_property
+    def transfer_concurrency(self):
+        """The number of parallel processes used for transfers (an integer, defaults to :attr:`concurrency`)."""
+        return self.concurrency
+
+    @property
+    def hash_options(self):
+        """A dictionary with the keyword arguments for :func:`Location.get_hashes()` based on the client's settings."""
+        options = dict(
+            concurrency=self.hash_concurrency,
+            io_mode=self.io_mode,
+            method=self.hash_method,
+            schedule=self.hash_schedule,
+        )
+        if self.autotune:
+            options.update(autotune=True)
+        return options
+
+    @property
+    def transfer_block_size(self):
+        """The size of the blocks transferred by :func:`transfer_changes()` (an integer)."""
+        return self.fine_block_size or self.block_size
+
+    @property
+    def transfer_options(self):
+        """A dictionary with the keyword arguments for :func:`transfer_block_fn()` based on the client's settings."""
+        return dict(durability=self.durability, io_mode=self.io_mode, sync_interval=self.sync_interval)
+
+    @mutable_property
+    def verify(self):
+        """
+        Whether to verify the target after synchronizing changes (a boolean, defaults to :data:`False`).
+
+        See :func:`verify_changes()` for details.
+        """
+        return False
+
+    @mutable_property
+    def watch_interval(self):
+        """
+        Keep running and synchronize changes at most once every this many seconds (a number, defaults to 0).
+
+        When this is set :func:`synchronize()` calls :func:`synchronize_watch()`
+        instead of synchronizing once. The default value 0 disables watch mode.
+        """
+        return 0
+
+    def compute_transfer_size(self, offsets, file_size=None, block_size=None):
         """
         Figure out how much data we're going to transfer.
 
         :param offsets: a list of integers with the offsets of the blocks to be synchronized.
+        :param file_size: The size of the source file (an integer, defaults
+                          to the :attr:`~Location.file_size` of :attr:`source`).
+        :param block_size: The block size (an integer, defaults to :attr:`transfer_block_size`).
         :returns: The amount of data to be transferred in bytes (an integer).
 
         This would be trivially easy if it wasn't for the last block which can
@@ -103,11 +484,15 @@ class Client(PropertyManager):
         negligible or quite significant, so we go to the effort of calculating
         this correctly.
         """
-        transfer_size = self.block_size * len(offsets)
-        last_block_size = (self.source.file_size % self.block_size) or self.block_size
-        last_block_offset = self.source.file_size - last_block_size
+        if file_size is None:
+            file_size = self.source.file_size
+        if block_size is None:
+            block_size = self.transfer_block_size
+        transfer_size = block_size * len(offsets)
+        last_block_size = (file_size % block_size) or block_size
+        last_block_offset = file_size - last_block_size
         if last_block_offset in offsets:
-            transfer_size -= self.block_size
+            transfer_size -= block_size
             transfer_size += last_block_size
         return transfer_size
 
@@ -180,7 +565,7 @@ class Client(PropertyManager):
                     logger.info("Synchronized changes using rsync in %s ..", rsync_timer)
             # Summarize the results of this iteration.
             metrics = ["%i%%" % difference]
-            metrics.append(format_size(num_blocks * self.block_size, binary=True))
+            metrics.append(format_size(num_blocks * self.transfer_block_size, binary=True))
             metrics.append(str(pdiffcopy_timer))
             if have_rsync:
                 metrics.append(str(rsync_timer))
@@ -192,11 +577,64 @@ class Client(PropertyManager):
         output(format_pretty_table(samples, column_names=column_names))
 
     def synchronize(self):
-        """Synchronize from :attr:`source` to :attr:`target` (possibly more than once, see :attr:`benchmark`)."""
-        if self.benchmark > 0:
+        """
+        Synchronize from :attr:`source` to :attr:`target`.
+
+        When :attr:`watch_interval` is set this calls
+        :func:`synchronize_watch()`, when there's more than one of
+        :attr:`targets` this calls :func:`synchronize_fanout()`, when
+        :attr:`recursive` is :data:`True` this calls
+        :func:`synchronize_tree()`, otherwise the synchronization may be run
+        more than once (see :attr:`benchmark`).
+
+        :returns: The :attr:`report` of the (last) run. When
+                  :attr:`report_file` is set the report is
+                  also saved to that file.
+        """
+        if any(target.static for target in self.targets):
+            raise ValueError("Files on generic HTTP servers can only be used as source!")
+        if self.source.static and self.recursive:
+            raise ValueError("Recursive synchronization isn't supported for files on generic HTTP servers!")
+        if self.range_requests and self.source.hostname:
+            self.source.range_requests = True
+        if self.source.static and self.delta_transfer and not self.append_only:
+            # Computing the hashes of the source would require downloading it.
+            logger.info("Disabling delta transfer because source is a file on a generic HTTP server ..")
+            self.delta_transfer = False
+        if self.watch_interval:
+            # Watch mode checks that it's not combined with multiple targets or recursion.
+            self.synchronize_watch()
+        elif len(self.targets) > 1:
+            self.synchronize_fanout()
+        elif self.recursive:
+            self.synchronize_tree()
+        elif self.benchmark > 0:
             self.run_benchmark()
         else:
             self.synchronize_once()
+        if self.report_file:
+            logger.verbose("Saving performance report to %s ..", self.report_file)
+            self.report.save(self.report_file)
+        return self.report
+
+    def start_report(self):
+        """Start a new :attr:`report` for a synchronization run."""
+        self.report = PerformanceReport()
+        self.report.metadata.update(
+            append_only=self.append_only,
+            autotune=self.autotune,
+            block_size=self.block_size,
+            delta_transfer=self.delta_transfer,
+            dry_run=self.dry_run,
+            hash_concurrency=self.hash_concurrency,
+            hash_method=self.hash_method,
+            recursive=self.recursive,
+            source=self.source.expression,
+            target=self.target.expression,
+            targets=[target.expression for target in self.targets],
+            transfer_block_size=self.block_size if self.recursive else self.transfer_block_size,
+            transfer_concurrency=self.transfer_concurrency,
+        )
 
     def synchronize_once(self):
         """
@@ -205,42 +643,366 @@ class Client(PropertyManager):
         :returns: The number of blocks that differed (an integer).
         """
         timer = Timer()
-        if self.delta_transfer and not self.target.exists:
-            logger.info("Disabling delta transfer because target file doesn't exist ..")
-            self.delta_transfer = False
-        if self.delta_transfer:
-            logger.info("Computing similarity index for delta transfer ..")
-            offsets = self.find_changes()
+        self.start_report()
+        # Get the metadata of both files up front, so that the time spent on it is reported separately.
+        with self.report.measure("metadata"):
+            self.source.file_info
+            self.target.file_info
+        use_journal = self.journal and not self.dry_run
+        offsets = self.journal.load(self.journal_identity) if use_journal else None
+        self.changed_hashes = None
+        self.moved_blocks = None
+        self.source_hashes = None
+        if offsets is not None:
+            logger.info("Resuming interrupted transfer (%s remaining) ..", pluralize(len(offsets), "block"))
         else:
-            logger.info("Performing whole file copy (skipping delta transfer) ..")
-            offsets = range(0, self.source.file_size, self.block_size)
+            if self.delta_transfer and not self.target.exists:
+                logger.info("Disabling delta transfer because target file doesn't exist ..")
+                self.delta_transfer = False
+            if self.delta_transfer:
+                offsets = self.find_appended_blocks() if self.append_only else None
+                if offsets is None:
+                    logger.info("Computing similarity index for delta transfer ..")
+                    offsets = self.find_changes()
+            else:
+                logger.info("Performing whole file copy (skipping delta transfer) ..")
+                offsets = range(0, self.source.file_size, self.transfer_block_size)
+                if self.clone_target():
+                    self.report.blocks_total = self.report.blocks_changed = len(offsets)
+                    self.sync_targets([self.target])
+                    logger.info("Synchronized changes in %s ..", timer)
+                    return len(offsets)
+            if use_journal and offsets:
+                self.journal.start(self.journal_identity, offsets)
+        self.report.blocks_total = len(range(0, self.source.file_size, self.transfer_block_size))
+        self.report.blocks_changed = len(offsets)
+        if offsets:
+            self.transfer_changes(offsets)
+            if self.verify and not self.dry_run:
+                self.verify_changes(offsets, self.source_hashes)
+            self.sync_targets([self.target])
+            logger.info("Synchronized changes in %s ..", timer)
+        elif self.resize_targets([self.target]):
+            self.sync_targets([self.target])
+            logger.info("Resized %s to match %s (no blocks differ).", self.target.label, self.source.label)
+        else:
+            logger.info("Nothing to do! (file contents match)")
+        if use_journal:
+            self.journal.finish()
+        return len(offsets)
+
+    def synchronize_watch(self, limit=None):
+        """
+        Keep :attr:`target` up to date with :attr:`source` until interrupted (see :attr:`watch_interval`).
+
+        :param limit: The maximum number of synchronizations (an integer or
+                      :data:`None` to keep running until interrupted).
+        :raises: :exc:`~exceptions.ValueError` when :attr:`source` isn't a
+                 local file or more than one target is given.
+
+        The source file is watched for changes using a
+        :class:`~pdiffcopy.watch.FileWatcher`. The first synchronization and
+        the synchronizations after the source file was replaced (or change
+        notifications were lost) compare the hashes of both files using
+        :func:`synchronize_once()`, the others only hash the source file
+        (see :func:`synchronize_incremental()`) unless :attr:`append_only`
+        is set, in which case :func:`synchronize_once()` is always used
+        (because then it doesn't need to hash the whole source file).
+        """
+        if self.source.hostname or self.recursive or len(self.targets) > 1:
+            raise ValueError("Watch mode requires a single local source file and a single target!")
+        delta_transfer = self.delta_transfer
+        count = 0
+        # The watch is started before the source is read, so that changes made
+        # while a synchronization is running are picked up afterwards.
+        with FileWatcher(filename=self.source.filename) as watcher:
+            status = REPLACED
+            try:
+                while True:
+                    self.source.clear_cached_properties()
+                    self.target.clear_cached_properties()
+                    if status == REPLACED or self.source_hashes is None or self.dry_run or self.append_only:
+                        self.delta_transfer = delta_transfer
+                        self.synchronize_once()
+                    else:
+                        self.synchronize_incremental()
+                    if self.report_file:
+                        self.report.save(self.report_file)
+                    count += 1
+                    if limit is not None and count >= limit:
+                        break
+                    logger.verbose("Waiting for changes to %s ..", self.source.label)
+                    status = self.wait_for_changes(watcher)
+            except KeyboardInterrupt:
+                logger.info("Stopping watch mode (interrupted) ..")
+
+    def wait_for_changes(self, watcher):
+        """
+        Helper for :func:`synchronize_watch()` to wait until :attr:`source` has changed.
+
+        :param watcher: A :class:`~pdiffcopy.watch.FileWatcher` object.
+        :returns: :data:`~pdiffcopy.watch.MODIFIED` or :data:`~pdiffcopy.watch.REPLACED`.
+
+        Changes are collected until :attr:`watch_interval` seconds have passed,
+        so a file that is modified continuously is synchronized at most once
+        per interval.
+        """
+        timer = Timer()
+        status = None
+        while True:
+            remaining = self.watch_interval - timer.elapsed_time
+            if status and remaining <= 0:
+                return status
+            result = watcher.wait(remaining if remaining > 0 else None)
+            if result == REPLACED or (result and not status):
+                status = result
+
+    def synchronize_incremental(self):
+        """
+        Synchronize the changes to :attr:`source` since the previous synchronization.
+
+        :returns: The number of blocks that differed (an integer).
+
+        Only :attr:`source` is hashed, because the :attr:`source_hashes` of
+        the previous synchronization describe the contents of :attr:`target`
+        (assuming nothing else writes to the target). Blocks are never copied
+        from other offsets within the target here (see :attr:`detect_moves`),
+        because a block modified while the previous synchronization was
+        running may have been transferred with contents that don't match its
+        hash (the block is transferred again by the next synchronization).
+        """
+        timer = Timer()
+        self.start_report()
+        with self.report.measure("metadata"):
+            self.source.file_info
+            self.target.file_info
+        logger.info("Computing hashes of %s to find changes since the previous synchronization ..", self.source.label)
+        with self.report.measure("source_hashing"):
+            source_hashes = self.source.get_hashes(block_size=self.block_size, **self.hash_options)
+        self.report.bytes_hashed["source"] += self.compute_transfer_size(
+            source_hashes, self.source.file_size, self.block_size
+        )
+        with self.report.measure("comparison"):
+            offsets, similarity = compare_hashes(source_hashes, self.source_hashes)
+            self.remember_changes(source_hashes, offsets, self.block_size)
+            self.moved_blocks = []
+        self.report.similarity = similarity
+        if offsets and self.fine_block_size:
+            offsets = self.refine_changes(offsets)
+        self.report.blocks_total = len(range(0, self.source.file_size, self.transfer_block_size))
+        self.report.blocks_changed = len(offsets)
         if offsets:
             self.transfer_changes(offsets)
+            if self.verify:
+                self.verify_changes(offsets, source_hashes)
+            self.sync_targets([self.target])
             logger.info("Synchronized changes in %s ..", timer)
+        elif self.resize_targets([self.target]):
+            self.sync_targets([self.target])
+            logger.info("Resized %s to match %s (no blocks differ).", self.target.label, self.source.label)
         else:
             logger.info("Nothing to do! (file contents match)")
+        self.source_hashes = source_hashes
         return len(offsets)
 
+    def find_appended_blocks(self):
+        """
+        Helper for :func:`synchronize_once()` to find the data appended to :attr:`source` (see :attr:`append_only`).
+
+        :returns: A range with the offsets of the blocks (of
+                  :attr:`transfer_block_size` bytes) after the end of the
+                  target or :data:`None` when the target isn't a prefix of the
+                  source (in which case a regular delta transfer is needed).
+        """
+        source_size = self.source.file_size
+        target_size = self.target.file_size
+        if target_size > source_size:
+            logger.info("Target is larger than source, can't use append-only fast path.")
+            return None
+        samples = select_samples(target_size, self.block_size, self.append_samples)
+        if samples:
+            timer = Timer()
+            logger.info("Verifying common prefix using %s ..", pluralize(len(samples), "sample block"))
+            todo, similarity = self.compare_blocks(
+                block_size=self.block_size, ranges=offsets_to_ranges(samples, self.block_size)
+            )
+            if todo:
+                logger.info("Sample blocks differ, falling back to delta transfer ..")
+                return None
+            logger.info("Verified common prefix in %s.", timer)
+        # The last (partial) block of the target is transferred again.
+        offset = target_size - target_size % self.transfer_block_size
+        self.report.similarity = 100.0 * offset / source_size if source_size else 100.0
+        logger.info("Source was appended to, will transfer %s.", format_size(source_size - offset, binary=True))
+        return range(offset, source_size, self.transfer_block_size)
+
     def find_changes(self):
-        """Helper for :func:`synchronize()` to compute the similarity index."""
+        """
+        Helper for :func:`synchronize()` to compute the similarity index.
+
+        :returns: A list of integers with the offsets of the blocks that
+                  differ (blocks of :attr:`transfer_block_size` bytes).
+        """
+        timer = Timer()
+        logger.info(
+            "Computing hashes of %s blocks using %s ..",
+            format_size(self.block_size, binary=True),
+            pluralize(self.hash_concurrency, "worker"),
+        )
+        todo, similarity = self.compare_blocks(block_size=self.block_size)
+        self.report.similarity = similarity
+        logger.info("Computed %i%% similarity in %s.", similarity, timer)
+        if self.fine_block_size:
+            todo = self.refine_changes(todo)
+        return todo
+
+    def refine_changes(self, offsets):
+        """
+        Helper for :func:`find_changes()` to rehash mismatching blocks using :attr:`fine_block_size`.
+
+        :param offsets: A list of integers with the offsets of the large blocks that differ.
+        :returns: A list of integers with the offsets of the small blocks that differ.
+        """
+        if self.block_size % self.fine_block_size != 0:
+            msg = "The fine block size (%i) doesn't evenly divide the block size (%i)!"
+            raise ValueError(msg % (self.fine_block_size, self.block_size))
+        if not offsets:
+            return []
         timer = Timer()
-        logger.info("Computing hashes using %s ..", pluralize(self.concurrency, "worker"))
-        hash_opts = dict(block_size=self.block_size, concurrency=self.concurrency, method=self.hash_method)
-        source_promise = Promise(target=get_hashes_fn, args=[self.source], kwargs=hash_opts)
-        target_promise = Promise(target=get_hashes_fn, args=[self.target], kwargs=hash_opts)
+        ranges = offsets_to_ranges(offsets, self.block_size)
+        logger.info(
+            "Rehashing %s in %s blocks ..",
+            pluralize(len(offsets), "mismatching block"),
+            format_size(self.fine_block_size, binary=True),
+        )
+        todo, similarity = self.compare_blocks(block_size=self.fine_block_size, ranges=ranges)
+        logger.info(
+            "Narrowed down %s of %s to %s of %s in %s.",
+            pluralize(len(offsets), "block"),
+            format_size(self.block_size, binary=True),
+            pluralize(len(todo), "block"),
+            format_size(self.fine_block_size, binary=True),
+            timer,
+        )
+        return todo
+
+    def clone_target(self):
+        """
+        Try to copy :attr:`source` to :attr:`target` using a reflink.
+
+        :returns: :data:`True` when the target was cloned, :data:`False` when
+                  either of the files isn't local (or :attr:`dry_run` is set)
+                  or the filesystem doesn't support reflinks (see
+                  :func:`~pdiffcopy.operations.clone_file()`).
+        """
+        if self.dry_run or self.source.hostname or self.target.hostname:
+            return False
+        with self.report.measure("transfer"):
+            cloned = clone_file(self.source.filename, self.target.filename)
+        if cloned:
+            logger.info("Cloned %s to %s using a reflink.", self.source.filename, self.target.filename)
+            self.report.bytes_transferred = self.source.file_size
+        return cloned
+
+    def compare_blocks(self, **options):
+        """
+        Compute and compare the hashes of :attr:`source` and :attr:`target` in parallel.
+
+        :param options: Any keyword arguments are passed to :func:`Location.get_hashes()`.
+        :returns: The result of :func:`compare_hashes()`.
+        """
+        options.update(self.hash_options)
+        if (
+            self.server_comparison
+            and bool(self.source.hostname) != bool(self.target.hostname)
+            and not (self.source.static or self.target.static)
+        ):
+            try:
+                return self.compare_on_server(**options)
+            except requests.HTTPError as e:
+                # Servers that predate the /compare endpoint respond with 404 or 405.
+                if e.response is None or e.response.status_code not in (404, 405):
+                    raise
+                logger.warning("Server doesn't support comparing hashes (%s), falling back to downloading hashes ..", e)
+                self.server_comparison = False
+        source_promise = Promise(target=get_hashes_fn, args=[self.source], kwargs=options)
+        target_promise = Promise(target=get_hashes_fn, args=[self.target], kwargs=options)
         source_hashes = source_promise.join()
         target_hashes = target_promise.join()
-        num_hits = 0
-        num_misses = 0
-        todo = []
-        for offset in sorted(set(source_hashes) | set(target_hashes)):
-            if source_hashes.get(offset) == target_hashes.get(offset):
-                num_hits += 1
+        self.report.add_time("source_hashing", source_promise.elapsed_time)
+        self.report.add_time("target_hashing", target_promise.elapsed_time)
+        for side, location, hashes in (("source", self.source, source_hashes), ("target", self.target, target_hashes)):
+            self.report.bytes_hashed[side] += self.compute_transfer_size(
+                hashes, location.file_size or 0, options["block_size"]
+            )
+        with self.report.measure("comparison"):
+            todo, similarity = compare_hashes(source_hashes, target_hashes)
+            self.remember_changes(source_hashes, todo, options["block_size"])
+            self.moved_blocks = find_moves(source_hashes, target_hashes, todo) if self.detect_moves else []
+        if (self.watch_interval or self.verify) and options.get("ranges") is None:
+            self.source_hashes = source_hashes
+        return todo, similarity
+
+    def remember_changes(self, source_hashes, offsets, block_size):
+        """
+        Set :attr:`changed_hashes` based on the result of a comparison.
+
+        :param source_hashes: The hashes of :attr:`source` (a :class:`~pdiffcopy.digests.DigestArray`).
+        :param offsets: The offsets of the blocks that differ (a list of integers).
+        :param block_size: The block size used to compute the hashes (an integer).
+        """
+        self.changed_hashes = DigestArray(block_size=block_size, method=self.hash_method)
+        self.changed_hashes.update((offset, source_hashes[offset]) for offset in offsets)
+
+    def compare_on_server(self, **options):
+        """
+        Helper for :func:`compare_blocks()` to let the server compare hashes (see :attr:`server_comparison`).
+
+        :param options: See :func:`compare_blocks()`.
+        :returns: The result of :func:`compare_hashes()`.
+        """
+        if self.source.hostname:
+            local, remote, local_side, remote_side = self.target, self.source, "target", "source"
+        else:
+            local, remote, local_side, remote_side = self.source, self.target, "source", "target"
+        local_timer = Timer()
+        # Keep the local hashes when they're needed to construct source_hashes.
+        keep_hashes = (self.watch_interval or self.verify) and options.get("ranges") is None
+        local_hashes = DigestArray(block_size=options["block_size"], method=self.hash_method) if keep_hashes else None
+
+        def generate_local_hashes():
+            for offset, digest in compute_hashes(filename=local.filename, **options):
+                if local_hashes is not None:
+                    local_hashes[offset] = digest
+                yield offset, digest
+            self.report.add_time("%s_hashing" % local_side, local_timer.elapsed_time)
+
+        remote_timer = Timer()
+        logger.info("Comparing hashes of %s on server ..", local.label)
+        todo, similarity, self.changed_hashes, self.moved_blocks = remote.compare_with(
+            generate_local_hashes(), remote_side, moves=self.detect_moves, **options
+        )
+        self.report.add_time("%s_hashing" % remote_side, remote_timer.elapsed_time)
+        for side, location in (("source", self.source), ("target", self.target)):
+            file_size = location.file_size or 0
+            if options.get("ranges") is not None:
+                offsets = list(generate_range_offsets(options["ranges"], options["block_size"], file_size))
             else:
-                num_misses += 1
-                todo.append(offset)
-        logger.info("Computed %i%% similarity in %s.", num_hits / ((num_hits + num_misses) / 100.0), timer)
-        return todo
+                offsets = range(0, file_size, options["block_size"])
+            self.report.bytes_hashed[side] += self.compute_transfer_size(offsets, file_size, options["block_size"])
+        if local_hashes is not None:
+            if local_side == "target":
+                # Blocks that match have the same hashes in the source and
+                # the target, so only the hashes of changed blocks need to be
+                # replaced (and blocks after the end of the source removed).
+                block_size = options["block_size"]
+                end_of_source = (self.source.file_size + block_size - 1) // block_size * block_size
+                for offset in range(end_of_source, local.file_size or 0, block_size):
+                    if offset in local_hashes:
+                        del local_hashes[offset]
+                local_hashes.update(self.changed_hashes.items())
+            self.source_hashes = local_hashes
+        return todo, similarity
 
     def transfer_changes(self, offsets):
         """
@@ -250,45 +1012,912 @@ class Client(PropertyManager):
                         to copy from :attr:`source` to :attr:`target`.
         """
         timer = Timer()
-        transfer_size = self.compute_transfer_size(offsets)
+        moves = self.select_moves()
+        if moves:
+            moved = set(target_offset for source_offset, target_offset in moves)
+            offsets = [offset for offset in offsets if offset not in moved]
+        unique, duplicates = self.group_duplicates(offsets)
+        transfer_size = self.compute_transfer_size(unique + [group[0] for group in duplicates])
+        copy_size = self.compute_transfer_size([offset for group in duplicates for offset in group[1:]])
+        move_size = self.compute_transfer_size([target_offset for source_offset, target_offset in moves])
         formatted_size = format_size(transfer_size, binary=True)
-        action = "download" if self.source.hostname else "upload"
-        logger.info("Will %s %s totaling %s.", action, pluralize(len(offsets), "block"), formatted_size)
+        # When both locations are remote the target server pulls the changed
+        # blocks directly from the source server (in batches), so that the
+        # data doesn't need to be routed through the client.
+        pull = bool(self.source.hostname and self.target.hostname)
+        # Blocks read using range requests are downloaded in batches (using multi-range requests).
+        batched = pull or self.source.range_requests
+        if pull:
+            action = "pull"
+        else:
+            action = "download" if self.source.hostname else "upload"
+        logger.info(
+            "Will %s %s totaling %s.",
+            action,
+            pluralize(len(unique) + len(duplicates), "block"),
+            formatted_size,
+        )
+        if moves:
+            logger.info(
+                "Will copy %s totaling %s from other offsets within the target (moved blocks).",
+                pluralize(len(moves), "block"),
+                format_size(move_size, binary=True),
+            )
+        if duplicates:
+            logger.info(
+                "Will copy %s totaling %s within the target (identical blocks).",
+                pluralize(len(offsets) - len(unique) - len(duplicates), "block"),
+                format_size(copy_size, binary=True),
+            )
         if self.dry_run:
             return
+        journal = self.journal if (self.journal and self.journal.identity) else None
+        if journal and self.durability != "block":
+            # Make sure the blocks recorded by a checkpoint can't be lost.
+            journal.sync_callback = self.target.sync
+        # Copy moved blocks before the target is resized or any blocks are
+        # overwritten, because their contents are read from the target.
+        if moves:
+            with self.report.measure("transfer"):
+                for batch in generate_batches(moves, COPY_BATCH_SIZE):
+                    self.target.copy_blocks(batch, self.transfer_block_size, self.durability, self.sync_interval)
+                    if journal:
+                        for source_offset, target_offset in batch:
+                            journal.record(target_offset)
         # Make sure the target file has the right size.
-        if not (self.target.exists and self.source.file_size == self.target.file_size):
-            self.target.resize(self.source.file_size)
-        # Transfer changed blocks in parallel.
+        self.resize_targets([self.target])
+        # Transfer changed blocks in parallel, starting with groups of
+        # identical blocks (each of which is transferred only once).
+        worker_opts = dict(
+            block_size=self.transfer_block_size, source=self.source, target=self.target, **self.transfer_options
+        )
+        pools = []
+        if duplicates:
+            pools.append(
+                WorkerPool(
+                    autotune=self.autotune,
+                    concurrency=self.transfer_concurrency,
+                    generator_fn=functools.partial(iter, duplicates),
+                    label="Deduplicate",
+                    worker_fn=functools.partial(transfer_duplicates_fn, **worker_opts),
+                )
+            )
+        if unique:
+            pools.append(
+                WorkerPool(
+                    autotune=self.autotune,
+                    concurrency=self.transfer_concurrency,
+                    generator_fn=(
+                        functools.partial(generate_batches, unique, PULL_BATCH_SIZE if pull else RANGE_BATCH_SIZE)
+                        if batched
+                        else functools.partial(iter, unique)
+                    ),
+                    label="Transfer",
+                    worker_fn=functools.partial(
+                        pull_blocks_fn if pull else (read_blocks_fn if batched else transfer_block_fn), **worker_opts
+                    ),
+                )
+            )
+        spinner = Spinner(label="%sing changed blocks" % action.capitalize(), total=len(offsets))
+        try:
+            with self.report.measure("transfer"), spinner:
+                progress = 0
+                for pool in pools:
+                    with pool:
+                        for value, latency in pool:
+                            batch = value if isinstance(value, list) else [value]
+                            for offset in batch:
+                                if journal:
+                                    journal.record(offset)
+                                self.report.record_latency(latency / len(batch))
+                            progress += len(batch)
+                            spinner.step(progress=progress)
+        finally:
+            if journal:
+                journal.close()
+        self.report.bytes_copied += copy_size + move_size
+        self.record_transfer_metrics(transfer_size, timer.elapsed_time)
+        logger.info(
+            "%sed %i blocks (%s) in %s (%s/s).",
+            action.capitalize(),
+            len(offsets),
+            formatted_size,
+            timer,
+            format_size(transfer_size / timer.elapsed_time, binary=True),
+        )
+
+    def select_moves(self):
+        """
+        Helper for :func:`transfer_changes()` to get the :attr:`moved_blocks` that can be used.
+
+        :returns: A list of tuples with two integers each (see :attr:`moved_blocks`).
+                  The list is empty when the moves were detected using a block
+                  size other than :attr:`transfer_block_size`.
+        """
+        hashes = self.changed_hashes
+        if self.moved_blocks and hashes is not None and hashes.block_size == self.transfer_block_size:
+            return self.moved_blocks
+        return []
+
+    def group_duplicates(self, offsets):
+        """
+        Helper for :func:`transfer_changes()` to find changed blocks with identical contents.
+
+        :param offsets: A list of integers with the offsets of the blocks to transfer.
+        :returns: A tuple with two values:
+
+                  1. A list with the offsets of the blocks whose contents are unique.
+                  2. A list of lists with the offsets of identical blocks (at
+                     most :data:`COPY_BATCH_SIZE` offsets per list).
+
+                  When :attr:`deduplicate` is disabled or the hashes in
+                  :attr:`changed_hashes` aren't available (or were computed
+                  using a different block size) all offsets are considered
+                  unique.
+        """
+        hashes = self.changed_hashes
+        if not (self.deduplicate and hashes is not None and hashes.block_size == self.transfer_block_size):
+            return list(offsets), []
+        groups = {}
+        for offset in offsets:
+            groups.setdefault(hashes.get(offset, offset), []).append(offset)
+        unique = []
+        duplicates = []
+        for group in sorted(groups.values()):
+            for batch in generate_batches(group, COPY_BATCH_SIZE):
+                if len(batch) > 1:
+                    duplicates.append(batch)
+                else:
+                    unique.extend(batch)
+        unique.sort()
+        return unique, duplicates
+
+    def verify_changes(self, offsets, expected=None):
+        """
+        Verify that :attr:`target` matches :attr:`source` after :func:`transfer_changes()` (see :attr:`verify`).
+
+        :param offsets: The offsets of the blocks that were transferred (integers).
+        :param expected: The hashes of all blocks of :attr:`source` computed
+                         before the transfer (a :class:`~pdiffcopy.digests.DigestArray`
+                         with blocks of :attr:`block_size` bytes) or :data:`None`.
+        :raises: :exc:`~pdiffcopy.exceptions.VerificationError` when blocks
+                 still differ after they were transferred again.
+
+        When `expected` is given only the transferred blocks of the target
+        are hashed. The :func:`~pdiffcopy.digests.tree_digest()` of the
+        expected hashes is compared with the tree digest of the target, which
+        is built from the expected hashes of the blocks that weren't
+        transferred (they matched before the transfer) and the new hashes of
+        the transferred blocks. This avoids a second pass over both files.
+        When `expected` isn't available (for example after a whole file copy)
+        the transferred blocks are hashed on both sides.
+
+        When verification fails the blocks that differ are transferred again
+        and compared once more (this can also happen when the source was
+        modified during the transfer).
+        """
+        timer = Timer()
+        block_size = self.block_size
+        changed = sorted(set(offset - offset % block_size for offset in offsets))
+        ranges = offsets_to_ranges(changed, block_size)
+        logger.info("Verifying %s ..", pluralize(len(changed), "transferred block"))
+        self.target.clear_cached_properties()
+        if self.target.file_size != self.source.file_size:
+            msg = "Target size (%i bytes) doesn't match source size (%i bytes) after synchronization!"
+            raise VerificationError(msg, self.target.file_size, self.source.file_size)
+        if expected is not None and expected.block_size == block_size:
+            with self.report.measure("verification"):
+                written = self.target.get_hashes(block_size=block_size, ranges=ranges, **self.hash_options)
+                actual = expected.copy()
+                for offset in changed:
+                    if offset in actual:
+                        del actual[offset]
+                actual.update(written.items())
+                source_root = tree_digest(expected)
+                target_root = tree_digest(actual)
+                mismatches = list(compare_digests(expected, actual)[0]) if source_root != target_root else []
+            self.report.bytes_hashed["target"] += self.compute_transfer_size(
+                written, self.source.file_size, block_size
+            )
+            if not mismatches:
+                logger.info("Verified target (root digest %s) in %s.", target_root, timer)
+                return
+        else:
+            mismatches = list(self.compare_blocks(block_size=block_size, ranges=ranges)[0])
+            if not mismatches:
+                logger.info("Verified target in %s.", timer)
+                return
+        logger.warning("Verification found %s that differ, transferring again ..", pluralize(len(mismatches), "block"))
+        # Don't copy blocks within the target based on hashes that turned out to be unreliable.
+        self.changed_hashes = None
+        self.moved_blocks = None
+        file_size = self.source.file_size
+        self.transfer_changes(
+            [
+                offset
+                for start in mismatches
+                for offset in range(start, min(start + block_size, file_size), self.transfer_block_size)
+            ]
+        )
+        todo, similarity = self.compare_blocks(block_size=block_size, ranges=offsets_to_ranges(mismatches, block_size))
+        if todo:
+            msg = "Target still differs from source in %s after verification!"
+            raise VerificationError(msg, pluralize(len(todo), "block"))
+        logger.info("Verified target after transferring %s again in %s.", pluralize(len(mismatches), "block"), timer)
+
+    def record_transfer_metrics(self, transfer_size, elapsed_time):
+        """
+        Update :attr:`report` after a transfer has completed.
+
+        :param transfer_size: The number of bytes transferred (an integer).
+        :param elapsed_time: The duration of the transfer in seconds (a number).
+
+        Worker utilization is estimated by dividing the total time spent by
+        workers on transferring blocks by the time available to all workers.
+        When :attr:`autotune` is enabled this is relative to the maximum
+        :attr:`transfer_concurrency`.
+        """
+        self.report.bytes_transferred += transfer_size
+        if self.report.latencies and elapsed_time > 0:
+            busy_time = sum(self.report.latencies) * (self.report.num_latencies / float(len(self.report.latencies)))
+            self.report.utilization["transfer"] = min(1.0, busy_time / (self.transfer_concurrency * elapsed_time))
+
+    def resize_targets(self, targets):
+        """
+        Make sure target files have the same size as :attr:`source`.
+
+        :param targets: A list of :class:`Location` objects.
+        :returns: A list with the :class:`Location` objects whose size
+                  differed (these aren't resized when :attr:`dry_run` is set).
+
+        This is needed even when no blocks differ, because blocks that only
+        exist in a target (after the end of :attr:`source`) aren't reported
+        as changes (see :func:`compare_hashes()`).
+        """
+        resized = [target for target in targets if not (target.exists and target.file_size == self.source.file_size)]
+        if resized and not self.dry_run:
+            with self.report.measure("resize"):
+                for target in resized:
+                    target.resize(self.source.file_size)
+        return resized
+
+    def sync_targets(self, targets):
+        """
+        Synchronize target files to disk (depending on :attr:`durability`).
+
+        :param targets: A list of :class:`Location` objects.
+        """
+        if self.durability in ("end", "periodic") and targets and not self.dry_run:
+            logger.info("Synchronizing %s to disk ..", pluralize(len(targets), "target file"))
+            with self.report.measure("sync"):
+                for target in targets:
+                    target.sync()
+
+    def synchronize_tree(self):
+        """
+        Synchronize the directory tree at :attr:`source` to :attr:`target`.
+
+        :returns: The number of blocks that differed (an integer).
+
+        Files whose size and last modification time match are skipped
+        (modification times are compared with a granularity of one second,
+        like rsync does). The remaining files are hashed and copied using a
+        single pool of worker processes that is shared between all files, so
+        that a large number of small files doesn't leave most workers idle.
+        """
+        timer = Timer()
+        self.start_report()
+        logger.info("Listing files in %s and %s ..", self.source.expression, self.target.expression)
+        with self.report.measure("metadata"):
+            source_files = self.source.list_files()
+            target_files = dict((info["name"], info) for info in self.target.list_files())
+        pending = []
+        for info in source_files:
+            existing = target_files.get(info["name"])
+            if existing and existing["size"] == info["size"] and int(existing["mtime"]) == int(info["mtime"]):
+                logger.verbose("Skipping %s (size and modification time match) ..", info["name"])
+            else:
+                pending.append(info)
+        logger.info(
+            "Found %s (%i up to date, %i to synchronize).",
+            pluralize(len(source_files), "file"),
+            len(source_files) - len(pending),
+            len(pending),
+        )
+        if not pending:
+            logger.info("Nothing to do! (directory trees match)")
+            return 0
+        pairs = []
+        for info in pending:
+            source = self.source.join(info["name"])
+            target = self.target.join(info["name"])
+            # Reuse the metadata we already have to avoid needless round trips.
+            set_property(source, "file_info", info)
+            set_property(target, "file_info", target_files.get(info["name"], {}))
+            pairs.append((source, target))
+        changes = [None] * len(pairs)
+        if self.delta_transfer:
+            indexes = [i for i, (source, target) in enumerate(pairs) if target.exists]
+            if indexes:
+                logger.info("Computing similarity index of %s ..", pluralize(len(indexes), "file"))
+                results = self.find_tree_changes([pairs[i] for i in indexes])
+                for i, offsets in zip(indexes, results):
+                    changes[i] = offsets
+        for i, (source, target) in enumerate(pairs):
+            if changes[i] is None:
+                changes[i] = range(0, source.file_size, self.block_size)
+        self.report.blocks_total = sum(len(range(0, s.file_size, self.block_size)) for s, t in pairs)
+        self.report.blocks_changed = sum(len(offsets) for offsets in changes)
+        self.transfer_tree_changes(pairs, changes)
+        self.sync_targets([target for (source, target), offsets in zip(pairs, changes) if offsets])
+        logger.info("Synchronized directory tree in %s.", timer)
+        return self.report.blocks_changed
+
+    def find_tree_changes(self, pairs):
+        """
+        Helper for :func:`synchronize_tree()` to compute the similarity index of several files.
+
+        :param pairs: A list of tuples with two :class:`Location` objects each (source and target).
+        :returns: A list with a list of changed offsets for each tuple in `pairs`.
+        """
+        timer = Timer()
+        hash_opts = dict(
+            block_size=self.block_size, concurrency=self.hash_concurrency, io_mode=self.io_mode, method=self.hash_method
+        )
+        if self.autotune:
+            hash_opts.update(autotune=True)
+        source_promise = Promise(target=get_tree_hashes_fn, args=[[s for s, t in pairs]], kwargs=hash_opts)
+        target_promise = Promise(target=get_tree_hashes_fn, args=[[t for s, t in pairs]], kwargs=hash_opts)
+        source_hashes = source_promise.join()
+        target_hashes = target_promise.join()
+        self.report.add_time("source_hashing", source_promise.elapsed_time)
+        self.report.add_time("target_hashing", target_promise.elapsed_time)
+        results = []
+        for (source, target), a, b in zip(pairs, source_hashes, target_hashes):
+            self.report.bytes_hashed["source"] += self.compute_transfer_size(a, source.file_size, self.block_size)
+            self.report.bytes_hashed["target"] += self.compute_transfer_size(b, target.file_size, self.block_size)
+            with self.report.measure("comparison"):
+                todo, similarity = compare_hashes(a, b)
+            logger.verbose("Computed %i%% similarity for %s.", similarity, source.filename)
+            results.append(todo)
+        logger.info("Computed similarity index of %s in %s.", pluralize(len(pairs), "file"), timer)
+        return results
+
+    def transfer_tree_changes(self, pairs, changes):
+        """
+        Helper for :func:`synchronize_tree()` to transfer the differences of several files.
+
+        :param pairs: A list of tuples with two :class:`Location` objects each (source and target).
+        :param changes: A list with a list of changed offsets for each tuple in `pairs`.
+        """
+        timer = Timer()
+        num_blocks = sum(len(offsets) for offsets in changes)
+        transfer_size = sum(
+            self.compute_transfer_size(offsets, source.file_size, self.block_size)
+            for (source, target), offsets in zip(pairs, changes)
+        )
+        formatted_size = format_size(transfer_size, binary=True)
+        action = "download" if self.source.hostname else "upload"
+        logger.info(
+            "Will %s %s of %s totaling %s.",
+            action,
+            pluralize(num_blocks, "block"),
+            pluralize(len(pairs), "file"),
+            formatted_size,
+        )
+        if self.dry_run:
+            return
+        # Make sure the target files have the right size.
+        with self.report.measure("resize"):
+            for source, target in pairs:
+                if not (target.exists and source.file_size == target.file_size):
+                    target.resize(source.file_size)
+        # Transfer changed blocks of all files using a single worker pool.
+        work = [(i, offset) for i, offsets in enumerate(changes) for offset in offsets]
         pool = WorkerPool(
-            concurrency=self.concurrency,
-            generator_fn=functools.partial(iter, offsets),
+            autotune=self.autotune,
+            concurrency=self.transfer_concurrency,
+            generator_fn=functools.partial(iter, work),
+            label="Transfer",
             worker_fn=functools.partial(
-                transfer_block_fn, block_size=self.block_size, source=self.source, target=self.target
+                transfer_tree_block_fn, block_size=self.block_size, pairs=pairs, **self.transfer_options
             ),
         )
-        spinner = Spinner(label="%sing changed blocks" % action.capitalize(), total=len(offsets))
-        with pool, spinner:
-            for i, result in enumerate(pool, start=1):
+        spinner = Spinner(label="%sing changed blocks" % action.capitalize(), total=len(work))
+        with self.report.measure("transfer"), pool, spinner:
+            for i, (offset, latency) in enumerate(pool, start=1):
+                self.report.record_latency(latency)
                 spinner.step(progress=i)
+        self.record_transfer_metrics(transfer_size, timer.elapsed_time)
+        # Copy the modification times so that the next run can skip these files.
+        for source, target in pairs:
+            target.set_mtime(source.file_info["mtime"])
         logger.info(
             "%sed %i blocks (%s) in %s (%s/s).",
             action.capitalize(),
-            len(offsets),
+            num_blocks,
             formatted_size,
             timer,
             format_size(transfer_size / timer.elapsed_time, binary=True),
         )
 
+    def synchronize_fanout(self):
+        """
+        Synchronize from :attr:`source` to all of the :attr:`targets`.
+
+        :returns: The number of blocks that differed in at least one target (an integer).
+        :raises: :exc:`~exceptions.ValueError` when :attr:`append_only`,
+                 :attr:`recursive`, :attr:`benchmark`, :attr:`journal_file`
+                 or :attr:`verify` is set (these aren't supported in
+                 combination with multiple targets).
+
+        The source file is hashed only once and each changed block is read
+        from the source file only once, after which it's written to every
+        target that needs it.
+        """
+        unsupported = [
+            name
+            for name, enabled in (
+                ("append only", self.append_only),
+                ("recursive", self.recursive),
+                ("benchmark", self.benchmark),
+                ("journal", self.journal_file),
+                ("verify", self.verify),
+            )
+            if enabled
+        ]
+        if unsupported:
+            raise ValueError("Multiple targets can't be combined with %s mode!" % concatenate(unsupported))
+        timer = Timer()
+        self.start_report()
+        with self.report.measure("metadata"):
+            self.source.file_info
+            for target in self.targets:
+                target.file_info
+        if self.delta_transfer:
+            logger.info("Computing similarity index for %s ..", pluralize(len(self.targets), "target"))
+            changes = self.find_fanout_changes()
+        else:
+            logger.info("Performing whole file copy to %s ..", pluralize(len(self.targets), "target"))
+            changes = [range(0, self.source.file_size, self.transfer_block_size)] * len(self.targets)
+        offsets = sorted(set(offset for todo in changes for offset in todo))
+        self.report.blocks_total = len(range(0, self.source.file_size, self.transfer_block_size))
+        self.report.blocks_changed = len(offsets)
+        if offsets:
+            self.transfer_fanout_changes(changes)
+            # Targets that were only resized need to be synchronized as well.
+            self.sync_targets(
+                [
+                    target
+                    for target, todo in zip(self.targets, changes)
+                    if todo or target.file_size != self.source.file_size
+                ]
+            )
+            logger.info("Synchronized changes to %s in %s ..", pluralize(len(self.targets), "target"), timer)
+        else:
+            resized = self.resize_targets(self.targets)
+            if resized:
+                self.sync_targets(resized)
+                logger.info("Resized %s (no blocks differ).", pluralize(len(resized), "target"))
+            else:
+                logger.info("Nothing to do! (file contents match)")
+        return len(offsets)
+
+    def find_fanout_changes(self):
+        """
+        Helper for :func:`synchronize_fanout()` to compute the similarity index of each target.
+
+        :returns: A list with a list of changed offsets for each of :attr:`targets`.
+        """
+        timer = Timer()
+        logger.info(
+            "Computing hashes of %s blocks using %s ..",
+            format_size(self.block_size, binary=True),
+            pluralize(self.hash_concurrency, "worker"),
+        )
+        changes = self.compare_fanout_blocks(block_size=self.block_size)
+        logger.info("Computed similarity index in %s.", timer)
+        if self.fine_block_size and any(changes):
+            if self.block_size % self.fine_block_size != 0:
+                msg = "The fine block size (%i) doesn't evenly divide the block size (%i)!"
+                raise ValueError(msg % (self.fine_block_size, self.block_size))
+            logger.info("Rehashing mismatching blocks in %s blocks ..", format_size(self.fine_block_size, binary=True))
+            changes = self.compare_fanout_blocks(
+                block_size=self.fine_block_size,
+                ranges=[offsets_to_ranges(todo, self.block_size) for todo in changes],
+            )
+        return changes
+
+    def compare_fanout_blocks(self, block_size, ranges=None):
+        """
+        Compute and compare the hashes of :attr:`source` and all :attr:`targets` in parallel.
+
+        :param block_size: The block size (an integer).
+        :param ranges: A list with the byte ranges to hash for each of
+                       :attr:`targets` (see :func:`refine_changes()`) or
+                       :data:`None` to hash the complete files.
+        :returns: A list with a list of changed offsets for each of :attr:`targets`.
+
+        The source file is hashed only once (limited to the union of `ranges`).
+        Targets that don't exist yet aren't hashed at all.
+        """
+        options = dict(
+            block_size=block_size,
+            concurrency=self.hash_concurrency,
+            io_mode=self.io_mode,
+            method=self.hash_method,
+            schedule=self.hash_schedule,
+        )
+        if self.autotune:
+            options.update(autotune=True)
+        source_options = dict(options)
+        if ranges is not None:
+            union = sorted(set(offset for r in ranges for start, end in r for offset in range(start, end, block_size)))
+            source_options.update(ranges=offsets_to_ranges(union, block_size))
+        source_promise = Promise(target=get_hashes_fn, args=[self.source], kwargs=source_options)
+        target_promises = []
+        for i, target in enumerate(self.targets):
+            if target.exists and (ranges is None or ranges[i]):
+                target_options = dict(options, ranges=ranges[i]) if ranges is not None else options
+                target_promises.append(Promise(target=get_hashes_fn, args=[target], kwargs=target_options))
+            else:
+                target_promises.append(None)
+        source_hashes = source_promise.join()
+        self.report.add_time("source_hashing", source_promise.elapsed_time)
+        self.report.bytes_hashed["source"] += self.compute_transfer_size(
+            source_hashes, self.source.file_size, block_size
+        )
+        changes = []
+        similarities = []
+        for i, (target, promise) in enumerate(zip(self.targets, target_promises)):
+            if ranges is not None and not ranges[i]:
+                # Nothing to refine for this target.
+                changes.append([])
+                continue
+            # Compare against the source hashes in the ranges hashed for this target.
+            if ranges is not None:
+                expected = set(offset for start, end in ranges[i] for offset in range(start, end, block_size))
+                relevant = DigestArray(block_size=block_size, method=self.hash_method)
+                relevant.update((o, d) for o, d in source_hashes.items() if o in expected)
+            else:
+                relevant = source_hashes
+            if promise is None:
+                logger.info("Target %s doesn't exist yet, will copy all blocks.", target.expression)
+                changes.append(sorted(relevant))
+                similarities.append(0.0)
+                continue
+            target_hashes = promise.join()
+            self.report.add_time("target_hashing", promise.elapsed_time)
+            self.report.bytes_hashed["target"] += self.compute_transfer_size(
+                target_hashes, target.file_size or 0, block_size
+            )
+            with self.report.measure("comparison"):
+                todo, similarity = compare_hashes(relevant, target_hashes)
+            logger.verbose("Computed %i%% similarity for %s.", similarity, target.expression)
+            changes.append(todo)
+            similarities.append(similarity)
+        if similarities:
+            # Report the similarity of the least similar target.
+            self.report.similarity = min(similarities)
+        return changes
+
+    def transfer_fanout_changes(self, changes):
+        """
+        Helper for :func:`synchronize_fanout()` to transfer the differences to all targets.
+
+        :param changes: A list with a list of changed offsets for each of :attr:`targets`.
+        """
+        timer = Timer()
+        needed_by = {}
+        for i, todo in enumerate(changes):
+            for offset in todo:
+                needed_by.setdefault(offset, []).append(i)
+        work = sorted(needed_by.items())
+        read_size = self.compute_transfer_size(needed_by)
+        transfer_size = sum(self.compute_transfer_size(todo) for todo in changes)
+        logger.info(
+            "Will read %s (%s) once and write %s to %s.",
+            pluralize(len(work), "changed block"),
+            format_size(read_size, binary=True),
+            format_size(transfer_size, binary=True),
+            pluralize(len(self.targets), "target"),
+        )
+        if self.dry_run:
+            return
+        # Make sure the target files have the right size.
+        self.resize_targets(self.targets)
+        pool = WorkerPool(
+            autotune=self.autotune,
+            concurrency=self.transfer_concurrency,
+            generator_fn=functools.partial(iter, work),
+            label="Transfer",
+            worker_fn=functools.partial(
+                fanout_block_fn,
+                block_size=self.transfer_block_size,
+                source=self.source,
+                targets=self.targets,
+                **self.transfer_options
+            ),
+        )
+        spinner = Spinner(label="Transferring changed blocks", total=len(work))
+        with self.report.measure("transfer"), pool, spinner:
+            for i, (offset, latency) in enumerate(pool, start=1):
+                self.report.record_latency(latency)
+                spinner.step(progress=i)
+        self.record_transfer_metrics(transfer_size, timer.elapsed_time)
+        logger.info(
+            "Transferred %i blocks (%s) to %s in %s (%s/s).",
+            len(work),
+            format_size(transfer_size, binary=True),
+            pluralize(len(self.targets), "target"),
+            timer,
+            format_size(transfer_size / timer.elapsed_time, binary=True),
+        )
+
+
+def compare_hashes(source_hashes, target_hashes):
+    """
+    Compare the block hashes of two files.
+
+    :param source_hashes: A dictionary with source file block hashes (see :func:`Location.get_hashes()`).
+    :param target_hashes: A dictionary with target file block hashes (see :func:`Location.get_hashes()`).
+    :returns: A tuple with two values:
+
+              1. A sorted list of integers with the offsets of the blocks that
+                 differ. Blocks that only exist in the target aren't included
+                 because those are removed by truncating the target.
+              2. The similarity of the two files (a percentage, as a float).
+
+    When both arguments are :class:`~pdiffcopy.digests.DigestArray` objects
+    the comparison is delegated to :func:`~pdiffcopy.digests.compare_digests()`
+    (in which case the offsets are returned as an :class:`array.array`).
+    """
+    if isinstance(source_hashes, DigestArray) and isinstance(target_hashes, DigestArray):
+        return compare_digests(source_hashes, target_hashes)
+    num_hits = 0
+    num_misses = 0
+    todo = []
+    for offset in sorted(set(source_hashes) | set(target_hashes)):
+        if source_hashes.get(offset) == target_hashes.get(offset):
+            num_hits += 1
+        else:
+            num_misses += 1
+            if offset in source_hashes:
+                todo.append(offset)
+    similarity = num_hits / ((num_hits + num_misses) / 100.0) if (num_hits + num_misses) else 100.0
+    return todo, similarity
+
+
+def offsets_to_ranges(offsets, block_size):
+    """
+    Convert the offsets of blocks to byte ranges.
+
+    :param offsets: A sorted list of integers with the offsets of blocks.
+    :param block_size: The block size (an integer).
+    :returns: A list of lists with two integers each (the start and end of a
+              range), where consecutive blocks are merged into a single range.
+    """
+    ranges = []
+    for offset in offsets:
+        if ranges and ranges[-1][1] == offset:
+            ranges[-1][1] = offset + block_size
+        else:
+            ranges.append([offset, offset + block_size])
+    return ranges
+
+
+def select_samples(size, block_size, count):
+    """
+    Select blocks to verify a common prefix (used by :func:`Client.find_appended_blocks()`).
+
+    :param size: The size of the prefix in bytes (an integer).
+    :param block_size: The block size (an integer).
+    :param count: The number of blocks to select (an integer).
+    :returns: A sorted list with the offsets of (at most) `count` complete
+              blocks within the prefix, including the first and last blocks.
+    """
+    num_blocks = size // block_size
+    if num_blocks <= count:
+        indexes = range(num_blocks)
+    else:
+        indexes = set([0, num_blocks - 1])
+        indexes.update(random.sample(range(1, num_blocks - 1), max(0, count - 2)))
+    return sorted(index * block_size for index in indexes)
+
+
+def select_block_size(file_size):
+    """
+    Select a block size based on the size of a file.
+
+    :param file_size: The size of the file in bytes (an integer).
+    :returns: The block size in bytes (an integer).
+
+    The block size is chosen so that a file is divided into roughly 65536
+    blocks, rounded up to a power of two and kept between 128 KiB and 64 MiB.
+    This keeps the number of hashes (and the overhead associated with each
+    block) bounded for very large files, without needlessly increasing the
+    amount of data transferred for smaller files.
+    """
+    block_size = 1024 * 128
+    while block_size < 1024 * 1024 * 64 and block_size * 65536 < file_size:
+        block_size *= 2
+    return block_size
+
 
 def get_hashes_fn(location, **options):
     """Adapter for :mod:`multiprocessing` used by :func:`Client.find_changes()`."""
     return location.get_hashes(**options)
 
 
-def transfer_block_fn(offset, source, target, block_size):
-    """Adapter for :mod:`multiprocessing` used by :func:`Client.transfer_changes()`."""
-    target.write_block(offset, source.read_block(offset, block_size))
+def get_tree_hashes_fn(locations, **options):
+    """
+    Adapter for :mod:`multiprocessing` used by :func:`Client.find_tree_changes()`.
+
+    :param locations: A list of :class:`Location` objects that are either all
+                      local or all remote.
+    :param options: See :func:`Location.get_hashes()`.
+    :returns: A list with a :class:`~pdiffcopy.digests.DigestArray` for each location.
+    """
+    if any(location.hostname for location in locations):
+        return [location.get_hashes(**options) for location in locations]
+    results = dict(
+        (location.filename, DigestArray(block_size=options["block_size"], method=options["method"]))
+        for location in locations
+    )
+    progress = 0
+    total = sum(location.file_size for location in locations)
+    with Spinner(label="Computing hashes", total=total) as spinner:
+        for filename, offset, digest in compute_tree_hashes(
+            filenames=[location.filename for location in locations], **options
+        ):
+            results[filename][offset] = digest
+            progress += options["block_size"]
+            spinner.step(progress)
+    return [results[location.filename] for location in locations]
+
+
+def fanout_block_fn(value, source, targets, block_size, **options):
+    """
+    Adapter for :mod:`multiprocessing` used by :func:`Client.transfer_fanout_changes()`.
+
+    :param value: A tuple with two values: The offset of the block (an
+                  integer) and a list of integers with the indexes of the
+                  `targets` that need the block.
+    :param source: The :class:`Location` to read the block from.
+    :param targets: A list of :class:`Location` objects.
+    :param options: See :func:`transfer_block_fn()`.
+    :returns: A tuple with two values:
+
+              1. The offset of the block that was transferred (an integer).
+              2. The time it took to transfer the block (a float, in seconds).
+
+    The block is read once and then written to each target that needs it.
+    """
+    timer = Timer()
+    offset, indexes = value
+    data = source.read_block(offset, block_size, options.get("io_mode", "buffered"))
+    for i in indexes:
+        targets[i].write_block(
+            offset,
+            data,
+            durability=options.get("durability", "none"),
+            sync_interval=options.get("sync_interval", DEFAULT_SYNC_INTERVAL),
+        )
+    return offset, timer.elapsed_time
+
+
+def generate_batches(values, size):
+    """
+    Split a list of values into batches.
+
+    :param values: A list of values.
+    :param size: The maximum number of values in a batch (an integer).
+    :returns: A generator of lists.
+    """
+    for start in range(0, len(values), size):
+        end = start + size
+        yield list(values[start:end])
+
+
+def pull_blocks_fn(offsets, source, target, block_size, **options):
+    """
+    Adapter for :mod:`multiprocessing` used by :func:`Client.transfer_changes()`.
+
+    :param offsets: A list of integers with the byte offsets of the blocks
+                    that the target server should pull from the source server.
+    :param options: See :func:`Location.pull_blocks()`.
+    :returns: A tuple with two values:
+
+              1. The offsets of the blocks that were transferred (a list of integers).
+              2. The time it took to transfer the blocks (a float, in seconds).
+    """
+    timer = Timer()
+    target.pull_blocks(source, offsets, block_size, **options)
+    return offsets, timer.elapsed_time
+
+
+def read_blocks_fn(offsets, source, target, block_size, **options):
+    """
+    Adapter for :mod:`multiprocessing` used by :func:`Client.transfer_changes()`.
+
+    :param offsets: A list of integers with the byte offsets of the blocks
+                    to read from the source using :func:`Location.read_blocks()`.
+    :param options: See :func:`transfer_block_fn()`.
+    :returns: A tuple with two values:
+
+              1. The offsets of the blocks that were transferred (a list of integers).
+              2. The time it took to transfer the blocks (a float, in seconds).
+    """
+    timer = Timer()
+    for offset, data in source.read_blocks(offsets, block_size, options.get("io_mode", "buffered")):
+        target.write_block(
+            offset,
+            data,
+            durability=options.get("durability", "none"),
+            sync_interval=options.get("sync_interval", DEFAULT_SYNC_INTERVAL),
+        )
+    return offsets, timer.elapsed_time
+
+
+def transfer_block_fn(offset, source, target, block_size, **options):
+    """
+    Adapter for :mod:`multiprocessing` used by :func:`Client.transfer_changes()`.
+
+    :param options: The keyword arguments `io_mode`, `durability` and
+                    `sync_interval` (all optional) are supported.
+    :returns: A tuple with two values:
+
+              1. The offset of the block that was transferred (an integer).
+              2. The time it took to transfer the block (a float, in seconds).
+    """
+    timer = Timer()
+    io_mode = options.get("io_mode", "buffered")
+    write_opts = dict(
+        durability=options.get("durability", "none"),
+        sync_interval=options.get("sync_interval", DEFAULT_SYNC_INTERVAL),
+    )
+    if io_mode == "buffered" and not (source.hostname or target.hostname):
+        # Let the kernel copy blocks between local files.
+        with span("copy_block", "io", offset=offset):
+            copy_block(source.filename, target.filename, offset, block_size, **write_opts)
+    elif source.hostname and target.hostname:
+        # Let the target server pull the block from the source server.
+        target.pull_blocks(source, [offset], block_size, io_mode=io_mode, **write_opts)
+    else:
+        target.write_block(offset, source.read_block(offset, block_size, io_mode), **write_opts)
+    return offset, timer.elapsed_time
+
+
+def transfer_duplicates_fn(offsets, source, target, block_size, **options):
+    """
+    Adapter for :mod:`multiprocessing` used by :func:`Client.transfer_changes()`.
+
+    :param offsets: A list of integers with the byte offsets of blocks that
+                    have identical contents in the source. The first block is
+                    transferred and then copied to the other offsets within
+                    the target (using :func:`Location.copy_blocks()`).
+    :param options: See :func:`transfer_block_fn()`.
+    :returns: A tuple with two values:
+
+              1. The offsets of the blocks that were transferred (a list of integers).
+              2. The time it took to transfer the blocks (a float, in seconds).
+    """
+    timer = Timer()
+    transfer_block_fn(offsets[0], source, target, block_size, **options)
+    target.copy_blocks(
+        [(offsets[0], offset) for offset in offsets[1:]],
+        block_size,
+        durability=options.get("durability", "none"),
+        sync_interval=options.get("sync_interval", DEFAULT_SYNC_INTERVAL),
+    )
+    return offsets, timer.elapsed_time
+
+
+def transfer_tree_block_fn(value, pairs, block_size, **options):
+    """Adapter for :mod:`multiprocessing` used by :func:`Client.transfer_tree_changes()`."""
+    index, offset = value
+    source, target = pairs[index]
+    return transfer_block_fn(offset, source, target, block_size, **options)
 
 
 class Location(PropertyManager):
@@ -304,7 +1933,9 @@ class Location(PropertyManager):
     @mutable_property
     def expression(self):
         """The location expression (a string)."""
-        if self.hostname:
+        if self.url:
+            return "static+" + self.url
+        elif self.hostname:
             netloc = "%s:%s" % (self.hostname, self.port_number)
             return urlunparse(("http", netloc, self.filename, "", "", ""))
         else:
@@ -312,11 +1943,25 @@ class Location(PropertyManager):
 
     @expression.setter
     def expression(self, value):
-        """Parse a location expression."""
+        """
+        Parse a location expression.
+
+        Location expressions starting with ``static+http://`` or
+        ``static+https://`` refer to files on generic HTTP servers (see
+        :attr:`url`), other URLs refer to files on a ``pdiffcopy`` server
+        and anything else is considered to be a local pathname.
+        """
         parsed_url = urlparse(value)
+        if parsed_url.scheme in STATIC_SCHEMES:
+            self.url = value[len("static+"):]
+            self.filename = unquote(parsed_url.path)
+            self.hostname = parsed_url.hostname
+            self.port_number = parsed_url.port
+            return
         if parsed_url.scheme and parsed_url.scheme != "http":
             msg = "Invalid URL scheme! (expected 'http', got %r instead)"
             raise ValueError(msg % parsed_url.scheme)
+        self.url = None
         if parsed_url.hostname:
             self.filename = parsed_url.path
             self.hostname = parsed_url.hostname
@@ -329,7 +1974,7 @@ class Location(PropertyManager):
 
     @mutable_property
     def filename(self):
-        """The absolute pathname of the file to copy (a string)."""
+        """The absolute pathname of the file (or directory) to copy (a string)."""
 
     @mutable_property
     def hostname(self):
@@ -338,17 +1983,75 @@ class Location(PropertyManager):
     @property
     def label(self):
         """A human friendly label for the location (a string)."""
+        if self.url:
+            return "static file %s" % self.url
         vicinity = "remote" if self.hostname else "local"
         return "%s file %s" % (vicinity, self.filename)
 
+    @mutable_property
+    def multi_range_requests(self):
+        """
+        Whether several byte ranges are requested at once (a boolean, defaults to :data:`True`).
+
+        This is set to :data:`False` by :func:`request_ranges()` when the
+        server responds to a multi-range request with the whole file (which
+        is allowed by :rfc:`7233` and done by many servers).
+        """
+        return True
+
     @mutable_property
     def port_number(self):
         """The port number of a pdiffcopy server (a number or :data:`None`)."""
 
+    @mutable_property
+    def range_requests(self):
+        """
+        Whether blocks are read using standard HTTP range requests (a boolean).
+
+        This defaults to :data:`True` for :attr:`static` locations and to
+        :data:`False` otherwise. When this is :data:`True` for a file on a
+        ``pdiffcopy`` server blocks are read from the server's ``/files``
+        endpoint (see :func:`~pdiffcopy.server.files_resource()`) instead of
+        the ``/blocks`` endpoint, which means the responses can be cached by
+        (reverse) proxies. Hashes are still computed by the server.
+        """
+        return self.static
+
+    @property
+    def static(self):
+        """:data:`True` if :attr:`url` is set, :data:`False` otherwise."""
+        return bool(self.url)
+
+    @mutable_property
+    def url(self):
+        """
+        The URL of a file on a generic HTTP server (a string or :data:`None`).
+
+        Files on generic HTTP servers (for example static file servers,
+        object stores or caching proxies) can only be used as a source. The
+        server needs to support range requests because blocks are read
+        using :func:`read_blocks()` and the hashes of the file are computed
+        by the client (see :func:`get_hashes()`).
+        """
+
     @cached_property
     def file_info(self):
         """A dictionary with file metadata."""
-        if self.hostname:
+        if self.url:
+            logger.debug("Requesting metadata of %s ..", self.url)
+            response = requests.head(self.url, allow_redirects=True)
+            if response.status_code == 404:
+                return {}
+            response.raise_for_status()
+            info = dict(
+                etag=response.headers.get("ETag"),
+                last_modified=response.headers.get("Last-Modified"),
+                size=int(response.headers["Content-Length"]),
+            )
+            if "Last-Modified" in response.headers:
+                info.update(mtime=email.utils.mktime_tz(email.utils.parsedate_tz(response.headers["Last-Modified"])))
+            return info
+        elif self.hostname:
             request_url = self.get_url("info", filename=self.filename)
             logger.debug("Requesting %s ..", request_url)
             response = requests.get(request_url)
@@ -366,31 +2069,82 @@ class Location(PropertyManager):
         logger.info("Getting size of %s ..", self.label)
         return self.file_info.get("size")
 
+    def copy_blocks(self, copies, size, durability="none", sync_interval=DEFAULT_SYNC_INTERVAL):
+        """
+        Copy blocks to other offsets within :attr:`filename` (without transferring any data).
+
+        :param copies: A list of tuples with two integers each (the offset to
+                       copy from and the offset to copy to).
+        :param size: The number of bytes to copy for each tuple (an integer).
+        :param durability: See :func:`write_block()`.
+        :param sync_interval: See :func:`write_block()`.
+        """
+        with span("copy_blocks", "io", copies=len(copies), remote=bool(self.hostname)):
+            if self.hostname:
+                params = dict(filename=self.filename, size=size)
+                if durability != "none":
+                    params.update(durability=durability, sync_interval=sync_interval)
+                request_url = self.get_url("copy", **params)
+                logger.debug("Posting to %s ..", request_url)
+                requests.post(request_url, json=dict(copies=copies)).raise_for_status()
+            else:
+                copy_blocks(self.filename, copies, size, durability, sync_interval)
+
+    def extract_block(self, parts, offset, size):
+        """
+        Extract a block from the result of :func:`request_ranges()`.
+
+        :param parts: The result of :func:`request_ranges()`.
+        :param offset: The byte offset of the block (an integer).
+        :param size: The size of the block in bytes (an integer).
+        :returns: The data of the block (a byte string, which is shorter than
+                  `size` at the end of the file and empty past the end of the file).
+        """
+        for start, data in parts:
+            if start <= offset < start + len(data):
+                return data[offset - start:offset - start + size]
+        return b""
+
     def get_hashes(self, **options):
         """
         Get the hashes of the blocks in a file.
 
-        :param options: See :attr:`get_url()`.
-        :returns: A generator of tokens with two values each:
-
-                  1. A byte offset into the file (an integer).
-                  2. The hash of the block starting at that offset (a string).
+        :param options: See :func:`~pdiffcopy.hashing.compute_hashes()`.
+        :returns: A :class:`~pdiffcopy.digests.DigestArray` which maps byte
+                  offsets into the file (integers) to the hashes of the
+                  blocks starting at those offsets (strings).
         """
-        results = {}
+        results = DigestArray(block_size=options["block_size"], method=options["method"])
         options.update(filename=self.filename)
-        if self.hostname:
+        if self.url:
+            # Generic HTTP servers can't compute hashes, so the client
+            # downloads the blocks and computes the hashes itself.
+            ranges = options.get("ranges") or [(0, self.file_size)]
+            offsets = list(generate_range_offsets(ranges, options["block_size"], self.file_size))
+            with Spinner(label="Downloading blocks to compute hashes", total=len(offsets)) as spinner:
+                for i, (offset, data) in enumerate(self.read_blocks(offsets, options["block_size"]), start=1):
+                    results[offset] = hashlib.new(options["method"], data).hexdigest()
+                    spinner.step(i)
+        elif self.hostname:
             logger.info("Requesting hashes from server ..")
+            ranges = options.pop("ranges", None)
             request_url = self.get_url("hashes", **options)
-            logger.debug("Requesting %s ..", request_url)
-            response = requests.get(request_url, stream=True)
+            if ranges is not None:
+                logger.debug("Posting to %s ..", request_url)
+                response = requests.post(request_url, json=dict(ranges=ranges), stream=True)
+            else:
+                logger.debug("Requesting %s ..", request_url)
+                response = requests.get(request_url, stream=True)
             response.raise_for_status()
             for line in response.iter_lines(decode_unicode=True):
-                offset, _, digest = line.partition("\t")
-                results[int(offset)] = digest
+                offset, digest = decode_hash(line)
+                results[offset] = digest
         else:
             progress = 0
             block_size = options["block_size"]
             total = os.path.getsize(options["filename"])
+            if options.get("ranges") is not None:
+                total = min(total, sum(end - start for start, end in options["ranges"]))
             with Spinner(label="Computing hashes", total=total) as spinner:
                 for offset, digest in compute_hashes(**options):
                     results[offset] = digest
@@ -398,6 +2152,68 @@ class Location(PropertyManager):
                     spinner.step(progress)
         return results
 
+    def compare_with(self, hashes, side, moves=False, **options):
+        """
+        Compare hashes of another file with the hashes of :attr:`filename` on the server.
+
+        :param hashes: An iterable of tuples with two values each (a byte
+                       offset and a digest) with the hashes of the other file.
+        :param side: The role of :attr:`filename` in the synchronization
+                     (one of the strings 'source' and 'target').
+        :param moves: :data:`True` to let the server detect moved blocks
+                      (see :func:`~pdiffcopy.digests.find_moves()`).
+        :param options: See :func:`~pdiffcopy.hashing.compute_hashes()`.
+        :returns: A tuple with four values: The two values returned by
+                  :func:`compare_hashes()`, a :class:`~pdiffcopy.digests.DigestArray`
+                  with the source hashes of the blocks that differ and a list
+                  of moved blocks (see :attr:`Client.moved_blocks`).
+        :raises: :exc:`~pdiffcopy.exceptions.TransferError` when the
+                 server doesn't complete the comparison.
+
+        The hashes are uploaded in a compact binary format (see
+        :func:`~pdiffcopy.hashing.pack_hash()`) as they are generated and
+        the server only responds with the offsets of changed blocks, so
+        neither list of hashes needs to be kept in memory by the client.
+        """
+        ranges = options.pop("ranges", None)
+        options.update(filename=self.filename, side=side)
+        if moves:
+            options.update(moves="true")
+
+        def generate_request_body():
+            yield (json.dumps(dict(ranges=ranges)) + "\n").encode("ascii")
+            # Combine records into larger chunks to reduce overhead.
+            chunk = []
+            for offset, digest in hashes:
+                chunk.append(pack_hash(offset, digest))
+                if len(chunk) >= 4096:
+                    yield b"".join(chunk)
+                    chunk = []
+            if chunk:
+                yield b"".join(chunk)
+
+        request_url = self.get_url("compare", **options)
+        logger.debug("Posting to %s ..", request_url)
+        response = requests.post(request_url, data=generate_request_body(), stream=True)
+        response.raise_for_status()
+        todo = []
+        changed = DigestArray(block_size=options["block_size"], method=options["method"])
+        moved = []
+        similarity = None
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith("similarity="):
+                similarity = float(line.partition("=")[2])
+            elif line.startswith("move="):
+                source_offset, target_offset = line.partition("=")[2].split("\t")
+                moved.append((int(source_offset), int(target_offset)))
+            elif line:
+                offset, digest = decode_hash(line)
+                changed[offset] = digest
+                todo.append(offset)
+        if similarity is None:
+            raise TransferError("Server of %s didn't complete the comparison of hashes!", self.label)
+        return todo, similarity, changed, moved
+
     def get_url(self, endpoint, **params):
         """
         Get the server URL for the given `endpoint`.
@@ -413,22 +2229,159 @@ class Location(PropertyManager):
             params=urlencode(params),
         )
 
-    def read_block(self, offset, size):
+    def join(self, name):
         """
-        Read a block of data from :attr:`filename`.
+        Get a :class:`Location` for a file inside the directory :attr:`filename`.
 
-        :param offset: The byte offset where reading starts (an integer).
-        :param size: The number of bytes to read (an integer).
-        :returns: A byte string.
+        :param name: The relative pathname of the file (a string).
+        :returns: A :class:`Location` object on the same host.
+        """
+        return Location(
+            filename=os.path.join(self.filename, name),
+            hostname=self.hostname,
+            port_number=self.port_number,
+            range_requests=self.range_requests,
+        )
+
+    def list_files(self):
+        """
+        List the files in the directory tree at :attr:`filename`.
+
+        :returns: A list of dictionaries (see :func:`~pdiffcopy.operations.list_files()`).
         """
         if self.hostname:
-            request_url = self.get_url("blocks", filename=self.filename, offset=offset, size=size)
+            request_url = self.get_url("list", directory=self.filename)
             logger.debug("Requesting %s ..", request_url)
             response = requests.get(request_url)
             response.raise_for_status()
-            return response.content
+            return response.json()["files"]
         else:
-            return read_block(self.filename, offset, size)
+            return list_files(self.filename)
+
+    def pull_blocks(
+        self, source, offsets, block_size, io_mode="buffered", durability="none", sync_interval=DEFAULT_SYNC_INTERVAL
+    ):
+        """
+        Instruct the server of :attr:`filename` to copy blocks directly from another server.
+
+        :param source: The :class:`Location` to copy the blocks from (the
+                       host name needs to resolve to the source server on
+                       the target server, so ``localhost`` only works when
+                       both files are on the same server).
+        :param offsets: A list of integers with the byte offsets of the blocks to copy.
+        :param block_size: The size of each block in bytes (an integer).
+        :param io_mode: See :func:`read_block()`.
+        :param durability: See :func:`write_block()`.
+        :param sync_interval: See :func:`write_block()`.
+        :raises: :exc:`~pdiffcopy.exceptions.TransferError` when the server
+                 didn't confirm that all blocks were copied.
+
+        The server responds with the offset of each block as soon as it has
+        been written, so a broken connection can't go unnoticed.
+        """
+        params = dict(block_size=block_size, filename=self.filename, source=source.expression)
+        if io_mode != "buffered":
+            params.update(io_mode=io_mode)
+        if durability != "none":
+            params.update(durability=durability, sync_interval=sync_interval)
+        with span("pull_blocks", "io", blocks=len(offsets)):
+            request_url = self.get_url("pull", **params)
+            logger.debug("Posting to %s ..", request_url)
+            response = requests.post(request_url, json=dict(offsets=offsets), stream=True)
+            response.raise_for_status()
+            copied = set(int(line) for line in response.iter_lines() if line)
+        missing = set(offsets) - copied
+        if missing:
+            raise TransferError(
+                "Server of %s didn't confirm %s pulled from %s!",
+                self.label,
+                pluralize(len(missing), "block"),
+                source.label,
+            )
+
+    def read_block(self, offset, size, io_mode="buffered"):
+        """
+        Read a block of data from :attr:`filename`.
+
+        :param offset: The byte offset where reading starts (an integer).
+        :param size: The number of bytes to read (an integer).
+        :param io_mode: One of the strings in :data:`~pdiffcopy.operations.IO_MODES`.
+        :returns: A byte string.
+        """
+        with span("read_block", "io", offset=offset, remote=bool(self.hostname)):
+            if self.range_requests:
+                return self.extract_block(self.request_ranges([(offset, offset + size)]), offset, size)
+            elif self.hostname:
+                params = dict(filename=self.filename, offset=offset, size=size)
+                if io_mode != "buffered":
+                    params.update(io_mode=io_mode)
+                request_url = self.get_url("blocks", **params)
+                logger.debug("Requesting %s ..", request_url)
+                response = requests.get(request_url)
+                response.raise_for_status()
+                return response.content
+            else:
+                return read_block(self.filename, offset, size, io_mode)
+
+    def read_blocks(self, offsets, size, io_mode="buffered"):
+        """
+        Read several blocks of data from :attr:`filename`.
+
+        :param offsets: A list of integers with the byte offsets of the blocks to read.
+        :param size: The size of each block in bytes (an integer).
+        :param io_mode: See :func:`read_block()`.
+        :returns: A generator of tuples with two values each (the byte
+                  offset and the data of a block).
+
+        When :attr:`range_requests` is :data:`True` up to
+        :data:`RANGE_BATCH_SIZE` blocks are requested at once (using a
+        multi-range request), otherwise :func:`read_block()` is used.
+        """
+        if not self.range_requests:
+            for offset in offsets:
+                yield offset, self.read_block(offset, size, io_mode)
+            return
+        for batch in generate_batches(offsets, RANGE_BATCH_SIZE):
+            with span("read_blocks", "io", blocks=len(batch), remote=True):
+                parts = self.request_ranges([(offset, offset + size) for offset in batch])
+            for offset in batch:
+                yield offset, self.extract_block(parts, offset, size)
+
+    def request_ranges(self, ranges):
+        """
+        Read byte ranges of :attr:`filename` using standard HTTP range requests.
+
+        :param ranges: A list of tuples with two integers each (the start and end offset of a byte range).
+        :returns: A list of tuples with two values each (the offset of the
+                  first byte and the contents of a part of the response).
+        :raises: :exc:`~pdiffcopy.exceptions.TransferError` when the server
+                 doesn't support range requests or the file was changed
+                 since :attr:`file_info` was requested.
+
+        When :attr:`multi_range_requests` is :data:`True` all byte ranges are
+        requested at once. When the server responds with the whole file the
+        byte ranges are requested separately instead (and
+        :attr:`multi_range_requests` is set to :data:`False`).
+        """
+        ranges = merge_ranges(ranges)
+        if len(ranges) > 1 and self.multi_range_requests:
+            parts = self.send_range_request(ranges)
+            if parts is not None:
+                return parts
+            logger.info(
+                "Server of %s doesn't support multi-range requests, requesting ranges separately ..", self.label
+            )
+            self.multi_range_requests = False
+        parts = []
+        for byte_range in ranges:
+            result = self.send_range_request([byte_range])
+            if result is None:
+                raise TransferError(
+                    "Server of %s doesn't support range requests (or the file changed during the transfer)!",
+                    self.label,
+                )
+            parts.extend(result)
+        return parts
 
     def resize(self, size):
         """
@@ -443,17 +2396,82 @@ class Location(PropertyManager):
         else:
             resize_file(self.filename, size)
 
-    def write_block(self, offset, data):
+    def send_range_request(self, ranges):
         """
-        Write a block of data to :attr:`filename`.
+        Helper for :func:`request_ranges()` to send a single range request.
 
-        :param offset: The byte offset where writing starts (an integer).
-        :param data: The byte string to write to the file.
+        :param ranges: A list of tuples with two integers each (the start and end offset of a byte range).
+        :returns: A list of tuples (see :func:`request_ranges()`) or
+                  :data:`None` when the server responded with the whole file.
+        """
+        if self.url:
+            request_url = self.url
+        else:
+            request_url = "http://%s:%s/files%s" % (self.hostname, self.port_number, quote(self.filename))
+        headers = dict(Range=format_range_header(ranges))
+        # Make sure we never combine blocks of different versions of the file.
+        # Weak entity tags can't be used for this (see RFC 7233 section 3.2).
+        etag = self.file_info.get("etag")
+        if etag and not etag.startswith("W/"):
+            headers["If-Range"] = etag
+        elif self.file_info.get("last_modified"):
+            headers["If-Range"] = self.file_info["last_modified"]
+        logger.debug("Requesting %s (%s) ..", request_url, headers["Range"])
+        response = requests.get(request_url, headers=headers, stream=True)
+        try:
+            if response.status_code == 416:
+                # None of the ranges exist, which means we're reading past the end of the file.
+                return []
+            response.raise_for_status()
+            if response.status_code != 206:
+                return None
+            content_type = response.headers.get("Content-Type", "")
+            if content_type.startswith("multipart/byteranges"):
+                return parse_multipart_byteranges(content_type, response.content)
+            start, end, file_size = parse_content_range(response.headers.get("Content-Range"))
+            return [(start, response.content)]
+        finally:
+            response.close()
+
+    def set_mtime(self, mtime):
+        """
+        Change the last modification time of :attr:`filename`.
+
+        :param mtime: The new modification time (a number, seconds since the Unix epoch).
         """
         if self.hostname:
-            request_url = self.get_url("blocks", filename=self.filename, offset=offset)
+            request_url = self.get_url("utime", filename=self.filename, mtime=mtime)
             logger.debug("Posting to %s ..", request_url)
-            response = requests.post(request_url, data=data)
-            response.raise_for_status()
+            requests.post(request_url).raise_for_status()
+        else:
+            set_mtime(self.filename, mtime)
+
+    def sync(self):
+        """Make sure :attr:`filename` has been written to disk (see :func:`~pdiffcopy.operations.sync_file()`)."""
+        if self.hostname:
+            request_url = self.get_url("sync", filename=self.filename)
+            logger.debug("Posting to %s ..", request_url)
+            requests.post(request_url).raise_for_status()
         else:
-            write_block(self.filename, offset, data)
+            sync_file(self.filename)
+
+    def write_block(self, offset, data, durability="none", sync_interval=DEFAULT_SYNC_INTERVAL):
+        """
+        Write a block of data to :attr:`filename`.
+
+        :param offset: The byte offset where writing starts (an integer).
+        :param data: The byte string to write to the file.
+        :param durability: See :func:`~pdiffcopy.operations.apply_durability()`.
+        :param sync_interval: See :func:`~pdiffcopy.operations.apply_durability()`.
+        """
+        with span("write_block", "io", offset=offset, remote=bool(self.hostname)):
+            if self.hostname:
+                params = dict(filename=self.filename, offset=offset)
+                if durability != "none":
+                    params.update(durability=durability, sync_interval=sync_interval)
+                request_url = self.get_url("blocks", **params)
+                logger.debug("Posting to %s ..", request_url)
+                response = requests.post(request_url, data=data)
+                response.raise_for_status()
+            else:
+                write_block(self.filename, offset, data, durability, sync_interval)
@@ -0,0 +1,403 @@
+# Fast large file synchronization inspired by rsync.
+#
+# Author: Peter Odding <peter@peterodding.com>
+# Last Change: October 18, 2026
+# URL: https://pdiffcopy.readthedocs.io
+
+"""
+Compact storage and comparison of block hashes.
+
+Storing the hashes of a file in a dictionary with byte offsets as keys and
+hexadecimal digests as values costs well over a hundred bytes per block,
+which adds up to gigabytes for files with tens of millions of blocks.
+:class:`DigestArray` instead stores the raw digests in a single contiguous
+buffer indexed by block number, which costs the size of a digest plus one
+byte per block.
+
+:func:`compare_digests()` compares two of these arrays a chunk of blocks at a
+time. When NumPy_ is installed the comparison is vectorized, otherwise large
+identical chunks are still skipped using a single comparison of byte strings.
+
+:func:`tree_digest()` combines the digests of all blocks into a single
+digest of the whole file, which makes it cheap to verify that two files are
+identical when the digests of their blocks are already known.
+
+:func:`find_moves()` uses a reverse index (from digests to offsets) to find
+changed blocks whose contents already exist at another offset in the target,
+so that they can be copied within the target instead of being transferred.
+The target is scanned using :func:`numpy.isin()` when NumPy_ is installed.
+
+.. _NumPy: https://numpy.org/
+"""
+
+# Standard library modules.
+import array
+import binascii
+import hashlib
+import logging
+import struct
+
+# External dependencies.
+from property_manager import PropertyManager, lazy_property, required_property
+from six.moves import range
+
+# Optional dependencies.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Public identifiers that require documentation.
+__all__ = (
+    "CHUNK_SIZE",
+    "OFFSET_TYPECODE",
+    "DigestArray",
+    "compare_chunk",
+    "compare_chunk_vectorized",
+    "compare_digests",
+    "find_moves",
+    "load_chunk",
+    "logger",
+    "order_moves",
+    "scan_digests",
+    "scan_digests_vectorized",
+    "tree_digest",
+)
+
+# Initialize a logger for this module.
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 64
+"""The number of blocks compared at once by :func:`compare_digests()` (an integer)."""
+
+OFFSET_TYPECODE = "Q" if "Q" in getattr(array, "typecodes", "") else "L"
+"""The :mod:`array` type code used for the offsets returned by :func:`compare_digests()` (a string)."""
+
+
+class DigestArray(PropertyManager):
+
+    """
+    The hashes of the blocks in a file, stored as a contiguous array of raw digests.
+
+    Objects of this type support the subset of the dictionary interface used
+    by :mod:`pdiffcopy` (with byte offsets as keys and hexadecimal digests as
+    values) so they can be used in place of the dictionaries returned by
+    earlier versions of :func:`~pdiffcopy.client.Location.get_hashes()`.
+    """
+
+    @required_property
+    def block_size(self):
+        """The block size (an integer)."""
+
+    @lazy_property
+    def digest_size(self):
+        """The size of a raw digest in bytes (an integer, based on :attr:`method`)."""
+        return hashlib.new(self.method).digest_size
+
+    @lazy_property
+    def digests(self):
+        """The raw digests of all blocks, concatenated (a :class:`bytearray`)."""
+        return bytearray()
+
+    @required_property
+    def method(self):
+        """The hash method used to generate the digests (a string)."""
+
+    @property
+    def num_blocks(self):
+        """The number of blocks covered by the array, whether they have a digest or not (an integer)."""
+        return len(self.present)
+
+    @lazy_property
+    def present(self):
+        """A :class:`bytearray` with one byte per block (1 when the block has a digest, 0 otherwise)."""
+        return bytearray()
+
+    def copy(self):
+        """Create a copy of the array (a :class:`DigestArray` object)."""
+        duplicate = DigestArray(block_size=self.block_size, method=self.method)
+        duplicate.digests.extend(self.digests)
+        duplicate.present.extend(self.present)
+        return duplicate
+
+    def get(self, offset, default=None):
+        """Get the hexadecimal digest of the block at the given offset (or `default`)."""
+        return self[offset] if offset in self else default
+
+    def items(self):
+        """Get a generator of tuples with two values each (an offset and a hexadecimal digest)."""
+        for offset in self:
+            yield offset, self[offset]
+
+    def update(self, hashes):
+        """
+        Add hashes to the array.
+
+        :param hashes: An iterable of tuples with two values each (an offset
+                       and a hexadecimal digest), like the values generated by
+                       :func:`~pdiffcopy.hashing.compute_hashes()`.
+        """
+        for offset, digest in hashes:
+            self[offset] = digest
+
+    def __contains__(self, offset):
+        """Check whether the block at the given offset has a digest."""
+        index, remainder = divmod(offset, self.block_size)
+        return remainder == 0 and 0 <= index < len(self.present) and self.present[index] == 1
+
+    def __delitem__(self, offset):
+        """Remove the digest of the block at the given offset."""
+        if offset not in self:
+            raise KeyError(offset)
+        index = offset // self.block_size
+        start = index * self.digest_size
+        end = start + self.digest_size
+        self.digests[start:end] = bytearray(self.digest_size)
+        self.present[index] = 0
+
+    def __getitem__(self, offset):
+        """Get the hexadecimal digest of the block at the given offset."""
+        if offset not in self:
+            raise KeyError(offset)
+        start = offset // self.block_size * self.digest_size
+        end = start + self.digest_size
+        return binascii.hexlify(bytes(self.digests[start:end])).decode("ascii")
+
+    def __iter__(self):
+        """Get a generator of the offsets of the blocks that have a digest."""
+        for index, flag in enumerate(self.present):
+            if flag:
+                yield index * self.block_size
+
+    def __len__(self):
+        """Get the number of blocks that have a digest."""
+        return self.present.count(1)
+
+    def __setitem__(self, offset, digest):
+        """Set the hexadecimal digest of the block at the given offset."""
+        index, remainder = divmod(offset, self.block_size)
+        if remainder != 0:
+            raise ValueError("Offset %i isn't aligned to the block size %i!" % (offset, self.block_size))
+        if index >= len(self.present):
+            missing = index + 1 - len(self.present)
+            self.present.extend(bytearray(missing))
+            self.digests.extend(bytearray(missing * self.digest_size))
+        start = index * self.digest_size
+        end = start + self.digest_size
+        self.digests[start:end] = binascii.unhexlify(digest)
+        self.present[index] = 1
+
+
+def compare_digests(source, target):
+    """
+    Compare the block hashes of two files.
+
+    :param source: A :class:`DigestArray` with the hashes of the source file.
+    :param target: A :class:`DigestArray` with the hashes of the target file.
+    :returns: The same values as :func:`~pdiffcopy.client.compare_hashes()`,
+              except that the offsets are returned as an :class:`array.array`
+              (which uses 8 bytes per offset).
+    :raises: :exc:`~exceptions.ValueError` when the block sizes or hash
+             methods of the two arrays don't match.
+    """
+    if source.block_size != target.block_size or source.digest_size != target.digest_size:
+        raise ValueError("Can't compare digests with different block sizes or hash methods!")
+    todo = array.array(OFFSET_TYPECODE)
+    num_hits = 0
+    num_blocks = 0
+    compare_fn = compare_chunk_vectorized if numpy is not None else compare_chunk
+    total = max(source.num_blocks, target.num_blocks)
+    for start in range(0, total, CHUNK_SIZE):
+        hits, blocks, changed = compare_fn(source, target, start, min(start + CHUNK_SIZE, total))
+        num_hits += hits
+        num_blocks += blocks
+        # NumPy arrays are converted to lists because array.frombytes() doesn't exist on Python 2.
+        todo.extend(changed if isinstance(changed, list) else changed.tolist())
+    similarity = num_hits / (num_blocks / 100.0) if num_blocks else 100.0
+    return todo, similarity
+
+
+def scan_digests(digests, wanted):
+    """
+    Find the blocks whose digest is one of the given digests (used by :func:`find_moves()`).
+
+    :param digests: A :class:`DigestArray` object.
+    :param wanted: A dictionary or set with raw digests (byte strings).
+    :returns: A list with the indexes of the matching blocks (which can
+              include blocks without a digest when `wanted` contains zeros).
+    """
+    # Scan the digests using a list comprehension because it's several times
+    # faster than a regular loop (the list only contains the matches) and
+    # slice a memoryview to avoid copying the whole buffer.
+    size = digests.digest_size
+    view = memoryview(digests.digests)
+    return [i for i, start in enumerate(range(0, len(view), size)) if view[start:start + size].tobytes() in wanted]
+
+
+def scan_digests_vectorized(digests, wanted):
+    """
+    Find matching blocks using NumPy (see :func:`scan_digests()`).
+
+    The raw digests are viewed as an array of fixed size values (without
+    copying them) and matched using :func:`numpy.isin()`.
+    """
+    values = numpy.frombuffer(digests.digests, dtype="V%i" % digests.digest_size)
+    needles = numpy.frombuffer(b"".join(wanted), dtype=values.dtype)
+    return numpy.flatnonzero(numpy.isin(values, needles)).tolist()
+
+
+def tree_digest(digests):
+    """
+    Compute a digest of a whole file from the digests of its blocks.
+
+    :param digests: A :class:`DigestArray` object.
+    :returns: A hexadecimal digest (a string).
+
+    The result is the hash (using the same hash method as the blocks) of the
+    number of blocks, which blocks have a digest and the digests of all
+    blocks (in other words the root of a hash tree with two levels). Blocks
+    without a digest are always stored as zeros, so this takes a single pass
+    over memory and no file needs to be read.
+    """
+    root = hashlib.new(digests.method)
+    root.update(struct.pack("!Q", digests.num_blocks))
+    root.update(digests.present)
+    root.update(digests.digests)
+    return root.hexdigest()
+
+
+def find_moves(source, target, offsets):
+    """
+    Find changed blocks whose contents exist at another offset in the target (block move detection).
+
+    :param source: A :class:`DigestArray` with the hashes of the source file.
+    :param target: A :class:`DigestArray` with the hashes of the target file.
+    :param offsets: The offsets of the blocks that differ (as returned by
+                    :func:`compare_digests()`).
+    :returns: The result of :func:`order_moves()`.
+    :raises: :exc:`~exceptions.ValueError` when the block sizes or hash
+             methods of the two arrays don't match.
+
+    The reverse index only contains the digests of changed blocks (which
+    keeps it small) and offsets of target blocks that won't be overwritten
+    are preferred, because copies from those blocks can be done in any order.
+    """
+    if source.block_size != target.block_size or source.digest_size != target.digest_size:
+        raise ValueError("Can't compare digests with different block sizes or hash methods!")
+    wanted = [(offset, binascii.unhexlify(source[offset])) for offset in offsets]
+    if not wanted:
+        return []
+    changed = set(offset for offset, digest in wanted)
+    index = dict((digest, None) for offset, digest in wanted)
+    size = target.digest_size
+    scan_fn = scan_digests_vectorized if numpy is not None else scan_digests
+    for i in scan_fn(target, index):
+        if target.present[i]:
+            start = i * size
+            digest = bytes(target.digests[start:start + size])
+            offset = i * target.block_size
+            previous = index[digest]
+            if previous is None or (previous in changed and offset not in changed):
+                index[digest] = offset
+    return order_moves(dict((offset, index[digest]) for offset, digest in wanted if index[digest] is not None))
+
+
+def order_moves(moves):
+    """
+    Order copies within the target so that no block is overwritten before it has been copied.
+
+    :param moves: A dictionary with the offsets to copy to (integers) as
+                  keys and the offsets to copy from (integers) as values.
+    :returns: A list of tuples with two integers each (the offset to copy
+              from and the offset to copy to). Moves that form a cycle (for
+              example two blocks that traded places) can't be ordered and are
+              left out, which means those blocks will be transferred.
+    """
+    readers = {}
+    for source_offset in moves.values():
+        readers[source_offset] = readers.get(source_offset, 0) + 1
+    ready = sorted((offset for offset in moves if not readers.get(offset)), reverse=True)
+    ordered = []
+    while ready:
+        target_offset = ready.pop()
+        source_offset = moves[target_offset]
+        ordered.append((source_offset, target_offset))
+        readers[source_offset] -= 1
+        if readers[source_offset] == 0 and source_offset in moves:
+            ready.append(source_offset)
+    return ordered
+
+
+def compare_chunk(source, target, start, end):
+    """
+    Compare a chunk of blocks (used by :func:`compare_digests()` when NumPy isn't installed).
+
+    :param source: A :class:`DigestArray` with the hashes of the source file.
+    :param target: A :class:`DigestArray` with the hashes of the target file.
+    :param start: The index of the first block in the chunk (an integer).
+    :param end: The index of the block after the chunk (an integer).
+    :returns: A tuple with three values: The number of identical blocks, the
+              number of blocks that have a digest in either array and a list
+              with the offsets of the blocks that need to be transferred.
+    """
+    size = source.digest_size
+    source_present = source.present[start:end]
+    target_present = target.present[start:end]
+    low = start * size
+    high = end * size
+    source_digests = source.digests[low:high]
+    target_digests = target.digests[low:high]
+    if source_present == target_present and source_digests == target_digests:
+        # The common case of identical chunks takes only two comparisons.
+        count = source_present.count(1)
+        return count, count, []
+    hits = 0
+    blocks = 0
+    changed = []
+    for i in range(end - start):
+        in_source = i < len(source_present) and source_present[i] == 1
+        in_target = i < len(target_present) and target_present[i] == 1
+        if in_source or in_target:
+            blocks += 1
+            low = i * size
+            high = low + size
+            if in_source and in_target and source_digests[low:high] == target_digests[low:high]:
+                hits += 1
+            elif in_source:
+                changed.append((start + i) * source.block_size)
+    return hits, blocks, changed
+
+
+def compare_chunk_vectorized(source, target, start, end):
+    """
+    Compare a chunk of blocks using NumPy (see :func:`compare_chunk()`).
+
+    The offsets of the blocks that need to be transferred are returned as a
+    NumPy array instead of a list.
+    """
+    source_present, source_digests = load_chunk(source, start, end)
+    target_present, target_digests = load_chunk(target, start, end)
+    equal = source_present & target_present & (source_digests == target_digests)
+    changed = (numpy.flatnonzero(source_present & ~equal) + start) * source.block_size
+    hits = int(numpy.count_nonzero(equal))
+    blocks = int(numpy.count_nonzero(source_present | target_present))
+    return hits, blocks, changed
+
+
+def load_chunk(digests, start, end):
+    """
+    Get a chunk of a :class:`DigestArray` as NumPy arrays (used by :func:`compare_chunk_vectorized()`).
+
+    :returns: A tuple with two NumPy arrays of the same length (``end - start``),
+              one with booleans (whether each block has a digest) and one with
+              the raw digests. Blocks beyond the end of the array are padded.
+    """
+    count = max(0, min(end, digests.num_blocks) - start)
+    present = numpy.zeros(end - start, dtype=bool)
+    values = numpy.zeros(end - start, dtype="V%i" % digests.digest_size)
+    if count:
+        present[:count] = numpy.frombuffer(digests.present, dtype=numpy.uint8, count=count, offset=start) == 1
+        values[:count] = numpy.frombuffer(
+            digests.digests, dtype=values.dtype, count=count, offset=start * digests.digest_size
+        )
+    return present, values
@@ -1,7 +1,7 @@
 # Fast large file synchronization inspired by rsync.
 #
 # Author: Peter Odding <peter@peterodding.com>
-# Last Change: March 6, 2020
+# Last Change: October 18, 2026
 # URL: https://pdiffcopy.readthedocs.io
 
 """Custom exceptions raised by the :mod:`pdiffcopy` modules."""
@@ -10,7 +10,7 @@
 from humanfriendly.text import compact
 
 # Public identifiers that require documentation.
-__all__ = ("BenchmarkAbortedError", "DependencyError", "ProgramError")
+__all__ = ("BenchmarkAbortedError", "DependencyError", "ProgramError", "TransferError", "VerificationError")
 
 
 class ProgramError(Exception):
@@ -36,3 +36,13 @@ class BenchmarkAbortedError(ProgramError):
 class DependencyError(ProgramError):
 
     """Raised when client or server installation requirements are missing."""
+
+
+class TransferError(ProgramError):
+
+    """Raised when a server doesn't complete a request (e.g. pulling blocks from another server)."""
+
+
+class VerificationError(ProgramError):
+
+    """Raised when the target still differs from the source after a synchronization was verified and repaired."""
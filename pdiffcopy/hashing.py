@@ -1,41 +1,304 @@
 # Fast large file synchronization inspired by rsync.
 #
 # Author: Peter Odding <peter@peterodding.com>
-# Last Change: March 6, 2020
+# Last Change: October 18, 2026
 # URL: https://pdiffcopy.readthedocs.io
 
 """Parallel hashing of files using :mod:`multiprocessing` and :mod:`pdiffcopy.mp`."""
 
 # Standard library modules.
+import binascii
 import functools
 import hashlib
+import logging
+import math
 import os
+import struct
 
 # External dependencies.
 from six.moves import range
 
 # Modules included in our package.
 from pdiffcopy.mp import WorkerPool
+from pdiffcopy.operations import fadvise, read_block
 
 # Public identifiers that require documentation.
-__all__ = ("compute_hashes", "hash_worker")
+__all__ = (
+    "SCHEDULES",
+    "compute_hashes",
+    "compute_tree_hashes",
+    "decode_hash",
+    "encode_hash",
+    "generate_range_offsets",
+    "generate_stripes",
+    "generate_tree_offsets",
+    "hash_worker",
+    "logger",
+    "pack_hash",
+    "stripe_hash_worker",
+    "tree_hash_worker",
+    "unpack_hashes",
+)
 
+# Initialize a logger for this module.
+logger = logging.getLogger(__name__)
 
-def compute_hashes(filename, block_size, method, concurrency):
-    """Compute checksums of a file in blocks (parallel)."""
+SCHEDULES = ("blocks", "stripes")
+"""
+The supported ways of distributing hashing work over worker processes (a tuple of strings):
+
+``blocks``
+ Each block is a separate unit of work (the default). Workers end up reading
+ interleaved blocks, which works well on SSDs and network storage.
+
+``stripes``
+ Workers hash contiguous stripes of blocks that shrink towards the end of
+ the file (see :func:`generate_stripes()`), so every worker reads
+ sequentially. This avoids seek storms on spinning disks.
+"""
+
+
+def compute_hashes(
+    filename,
+    block_size,
+    method,
+    concurrency,
+    ranges=None,
+    autotune=False,
+    busy_counter=None,
+    io_mode="buffered",
+    schedule="blocks",
+):
+    """
+    Compute checksums of a file in blocks (parallel).
+
+    :param filename: An absolute filename (a string).
+    :param block_size: The block size (an integer).
+    :param method: The hash method (a string).
+    :param concurrency: The number of worker processes (an integer).
+    :param ranges: An optional list of tuples with two integers each (the
+                   start and end offset of a byte range). When given only
+                   the blocks within these ranges are hashed.
+    :param autotune: :data:`True` to tune the number of active workers based
+                     on measured throughput (see :class:`.ConcurrencyTuner`),
+                     in which case `concurrency` is the maximum.
+    :param busy_counter: See :attr:`.WorkerPool.busy_counter`.
+    :param io_mode: One of the strings in :data:`~pdiffcopy.operations.IO_MODES`.
+    :param schedule: One of the strings in :data:`SCHEDULES`.
+    :returns: A generator of tuples with two values each:
+
+              1. A byte offset into the file (an integer).
+              2. The hash of the block starting at that offset (a string).
+    :raises: :exc:`~exceptions.ValueError` when `schedule` isn't supported.
+    """
+    if schedule not in SCHEDULES:
+        raise ValueError("Unsupported schedule %r! (supported: %s)" % (schedule, ", ".join(SCHEDULES)))
+    file_size = os.path.getsize(filename)
+    if ranges is None:
+        ranges = [(0, file_size)]
+    worker_opts = dict(block_size=block_size, filename=filename, io_mode=io_mode, method=method)
+    if schedule == "stripes":
+        if autotune:
+            # The tuner measures throughput in values per second, which is
+            # meaningless when the values are stripes of decreasing size.
+            logger.warning("Concurrency autotuning isn't supported with stripe scheduling, ignoring.")
+            autotune = False
+        generator_fn = functools.partial(generate_stripes, ranges, block_size, file_size, concurrency)
+        worker_fn = functools.partial(stripe_hash_worker, **worker_opts)
+    else:
+        generator_fn = functools.partial(generate_range_offsets, ranges, block_size, file_size)
+        worker_fn = functools.partial(hash_worker, **worker_opts)
     with WorkerPool(
+        autotune=autotune,
+        busy_counter=busy_counter,
         concurrency=concurrency,
-        generator_fn=functools.partial(range, 0, os.path.getsize(filename), block_size),
-        worker_fn=functools.partial(hash_worker, block_size=block_size, filename=filename, method=method),
+        generator_fn=generator_fn,
+        label="Hashing",
+        worker_fn=worker_fn,
     ) as pool:
-        for offset, digest in pool:
-            yield offset, digest
+        for value in pool:
+            if schedule == "stripes":
+                for offset, digest in value:
+                    yield offset, digest
+            else:
+                offset, digest = value
+                yield offset, digest
+
+
+def compute_tree_hashes(filenames, block_size, method, concurrency, autotune=False, io_mode="buffered"):
+    """
+    Compute checksums of several files in blocks (parallel).
+
+    :param filenames: A list of absolute filenames (strings).
+    :param block_size: The block size (an integer).
+    :param method: The hash method (a string).
+    :param concurrency: The number of worker processes (an integer).
+    :param autotune: See :func:`compute_hashes()`.
+    :param io_mode: See :func:`compute_hashes()`.
+    :returns: A generator of tuples with three values each:
+
+              1. The filename (a string).
+              2. A byte offset into the file (an integer).
+              3. The hash of the block starting at that offset (a string).
+
+    Unlike calling :func:`compute_hashes()` once for each file this uses a
+    single pool of worker processes for all of the files, so that small files
+    don't leave most of the workers idle.
+    """
+    with WorkerPool(
+        autotune=autotune,
+        concurrency=concurrency,
+        generator_fn=functools.partial(generate_tree_offsets, filenames, block_size),
+        label="Hashing",
+        worker_fn=functools.partial(tree_hash_worker, block_size=block_size, io_mode=io_mode, method=method),
+    ) as pool:
+        for filename, offset, digest in pool:
+            yield filename, offset, digest
+
+
+def generate_range_offsets(ranges, block_size, file_size):
+    """Generator function used by :func:`compute_hashes()`."""
+    for start, end in ranges:
+        for offset in range(start, min(end, file_size), block_size):
+            yield offset
+
+
+def generate_stripes(ranges, block_size, file_size, concurrency):
+    """
+    Generator function used by :func:`compute_hashes()` to partition a file into contiguous stripes.
+
+    :param ranges: A list of tuples with two integers each (the start and
+                   end offset of a byte range).
+    :param block_size: The block size (an integer).
+    :param file_size: The size of the file (an integer).
+    :param concurrency: The number of worker processes (an integer).
+    :returns: A generator of tuples with two integers each (the start and
+              end offset of a stripe).
+
+    This implements `guided self-scheduling`_: Each stripe covers the
+    remaining work divided by the number of workers (rounded up to a multiple
+    of the block size), so workers start out reading large contiguous regions
+    (which keeps their reads sequential, so kernel read-ahead works as
+    intended) while the stripes shrink to single blocks towards the end,
+    where workers that finish early pick up the remaining work.
+
+    .. _guided self-scheduling: https://doi.org/10.1109/TC.1987.5009495
+    """
+    spans = [(start, min(end, file_size)) for start, end in ranges if start < min(end, file_size)]
+    remaining = sum(end - start for start, end in spans)
+    for start, end in spans:
+        while start < end:
+            stripe_size = int(math.ceil(remaining / float(concurrency)))
+            stripe_size = max(block_size, stripe_size + (-stripe_size % block_size))
+            stripe_end = min(end, start + stripe_size)
+            yield start, stripe_end
+            remaining -= stripe_end - start
+            start = stripe_end
 
 
-def hash_worker(offset, block_size, filename, method):
+def generate_tree_offsets(filenames, block_size):
+    """Generator function used by :func:`compute_tree_hashes()`."""
+    for filename in filenames:
+        for offset in range(0, os.path.getsize(filename), block_size):
+            yield filename, offset
+
+
+def decode_hash(line):
+    """
+    Decode a line of output generated by :func:`encode_hash()`.
+
+    :param line: A line of text (a string, optionally with a trailing newline).
+    :returns: A tuple with two values (the byte offset and the digest).
+    """
+    offset, _, digest = line.rstrip("\n").partition("\t")
+    return int(offset), digest
+
+
+def encode_hash(offset, digest):
+    """
+    Encode the hash of a block for transmission in the response of the ``/hashes`` endpoint.
+
+    :param offset: A byte offset into the file (an integer).
+    :param digest: The hash of the block starting at that offset (a string).
+    :returns: A line of text with two fields (offset and digest) delimited by a tab character.
+    """
+    return "%i\t%s\n" % (offset, digest)
+
+
+def pack_hash(offset, digest):
+    """
+    Encode the hash of a block in the compact binary format used by the ``/compare`` endpoint.
+
+    :param offset: A byte offset into the file (an integer).
+    :param digest: The hexadecimal hash of the block starting at that offset (a string).
+    :returns: A byte string with the offset (8 bytes, big endian) followed
+              by the raw digest (half the size of the hexadecimal digest).
+    """
+    return struct.pack(">Q", offset) + binascii.unhexlify(digest)
+
+
+def unpack_hashes(handle, method):
+    """
+    Decode hashes encoded by :func:`pack_hash()`.
+
+    :param handle: A file like object with a :func:`read()` method.
+    :param method: The hash method used to generate the digests (a string,
+                   used to determine the size of each record).
+    :returns: A generator of tuples with two values each (the byte offset
+              and the hexadecimal digest).
+    :raises: :exc:`~exceptions.ValueError` when the input ends with a partial record.
+    """
+    record_size = 8 + hashlib.new(method).digest_size
+    while True:
+        record = handle.read(record_size)
+        # Reads from sockets and pipes may return less data than requested.
+        while record and len(record) < record_size:
+            more = handle.read(record_size - len(record))
+            if not more:
+                raise ValueError("Truncated hash record! (expected %i bytes, got %i)" % (record_size, len(record)))
+            record += more
+        if not record:
+            break
+        (offset,) = struct.unpack(">Q", record[:8])
+        yield offset, binascii.hexlify(record[8:]).decode("ascii")
+
+
+def hash_worker(offset, block_size, filename, method, io_mode="buffered"):
     """Worker function to be run in child processes."""
+    context = hashlib.new(method)
+    context.update(read_block(filename, offset, block_size, io_mode))
+    return offset, context.hexdigest()
+
+
+def stripe_hash_worker(stripe, block_size, filename, method, io_mode="buffered"):
+    """
+    Worker function used by :func:`compute_hashes()` to hash a stripe of blocks.
+
+    :param stripe: A tuple with two integers (the start and end offset of the stripe).
+    :returns: A list of tuples with two values each (see :func:`compute_hashes()`).
+
+    The file is opened once for the whole stripe and read sequentially so
+    that the kernel's read-ahead can do its job. In 'nocache' mode each block
+    is dropped from the page cache after it has been hashed, because stripes
+    can be a large part of the file.
+    """
+    start, end = stripe
+    if io_mode == "direct":
+        return [hash_worker(offset, block_size, filename, method, io_mode) for offset in range(start, end, block_size)]
+    results = []
     with open(filename, "rb") as handle:
-        handle.seek(offset)
-        context = hashlib.new(method)
-        context.update(handle.read(block_size))
-        return offset, context.hexdigest()
+        fadvise(handle, start, end - start, "SEQUENTIAL")
+        handle.seek(start)
+        for offset in range(start, end, block_size):
+            context = hashlib.new(method)
+            context.update(handle.read(block_size))
+            results.append((offset, context.hexdigest()))
+            if io_mode == "nocache":
+                fadvise(handle, offset, block_size, "DONTNEED")
+    return results
+
+
+def tree_hash_worker(value, block_size, method, io_mode="buffered"):
+    """Worker function used by :func:`compute_tree_hashes()`."""
+    filename, offset = value
+    return (filename,) + hash_worker(offset, block_size, filename, method, io_mode)
@@ -0,0 +1,216 @@
+# Fast large file synchronization inspired by rsync.
+#
+# Author: Peter Odding <peter@peterodding.com>
+# Last Change: October 18, 2026
+# URL: https://pdiffcopy.readthedocs.io
+
+"""
+On-disk progress journals that enable resuming of interrupted transfers.
+
+A journal is a small text file maintained by the client while it's
+transferring changed blocks. The first line contains a JSON encoded header
+with the identity of the source file (its size, last modification time, the
+hash method and block size) and the offsets of the blocks that were planned
+to be transferred. Each line after that records the offsets of the blocks
+that were completed since the previous checkpoint.
+
+A block is only recorded as completed once it has been written to disk, so
+that a transfer that was interrupted by a power failure doesn't skip blocks
+that were lost. Because the client usually leaves write-back to the operating
+system the target file is synchronized to disk before each checkpoint (see
+:attr:`Journal.sync_callback`).
+
+Offsets are stored as ranges of consecutive blocks (pairs with the offset of
+the first block and the number of blocks) which keeps journals compact even
+for very large files, because changed blocks tend to be clustered together.
+"""
+
+# Standard library modules.
+import errno
+import json
+import os
+
+# External dependencies.
+from humanfriendly import Timer
+from humanfriendly.testing import make_dirs
+from humanfriendly.text import pluralize
+from property_manager import PropertyManager, mutable_property, required_property
+from verboselogs import VerboseLogger
+
+# Public identifiers that require documentation.
+__all__ = ("Journal", "compress_offsets", "expand_ranges", "logger")
+
+# Initialize a logger for this module.
+logger = VerboseLogger(__name__)
+
+
+class Journal(PropertyManager):
+
+    """Persistent record of the progress of :func:`~pdiffcopy.client.Client.transfer_changes()`."""
+
+    @mutable_property
+    def block_size(self):
+        """The block size used to compress offsets into ranges (an integer)."""
+
+    @mutable_property
+    def checkpoint_interval(self):
+        """The number of seconds between checkpoints (a number, defaults to 5)."""
+        return 5
+
+    @required_property
+    def filename(self):
+        """The absolute pathname of the journal file (a string)."""
+
+    @mutable_property
+    def handle(self):
+        """The file handle used by :func:`record()` (a file object or :data:`None`)."""
+
+    @mutable_property
+    def sync_callback(self):
+        """
+        A callable that makes the transferred blocks durable (or :data:`None`).
+
+        This is called by :func:`checkpoint()` before the buffered offsets
+        are written to disk, so that the journal never claims blocks that
+        could still be lost (e.g. :func:`Location.sync() <pdiffcopy.client.Location.sync()>`).
+        """
+
+    @mutable_property
+    def identity(self):
+        """A dictionary with the identity of the transfer (set by :func:`load()` and :func:`start()`)."""
+
+    def load(self, identity):
+        """
+        Load the progress of a previous transfer.
+
+        :param identity: A dictionary with the identity of the current
+                         transfer (JSON serializable, must contain the key
+                         ``block_size``).
+        :returns: A sorted list of integers with the offsets of the blocks
+                  that still need to be transferred, or :data:`None` when the
+                  journal doesn't exist or doesn't match `identity`.
+        """
+        try:
+            with open(self.filename) as handle:
+                lines = handle.readlines()
+        except IOError as e:
+            if e.errno == errno.ENOENT:
+                return None
+            raise
+        try:
+            header = json.loads(lines[0])
+        except (IndexError, ValueError):
+            logger.warning("Ignoring corrupt journal %s ..", self.filename)
+            return None
+        if header.get("identity") != identity:
+            logger.info("Ignoring journal %s because the source file has changed ..", self.filename)
+            return None
+        block_size = identity["block_size"]
+        planned = expand_ranges(header["planned"], block_size)
+        completed = set()
+        for line in lines[1:]:
+            try:
+                completed.update(expand_ranges(json.loads(line), block_size))
+            except ValueError:
+                # The last line may have been truncated by an interruption.
+                logger.debug("Ignoring truncated line in journal %s ..", self.filename)
+        self.identity = identity
+        self.block_size = block_size
+        return [offset for offset in planned if offset not in completed]
+
+    def start(self, identity, offsets):
+        """
+        Start a new journal, overwriting the previous journal (if any).
+
+        :param identity: A dictionary with the identity of the current transfer (see :func:`load()`).
+        :param offsets: A list of integers with the offsets of the blocks to be transferred.
+        """
+        self.identity = identity
+        self.block_size = identity["block_size"]
+        header = dict(identity=identity, planned=compress_offsets(offsets, self.block_size))
+        make_dirs(os.path.dirname(self.filename))
+        temporary_file = "%s.tmp" % self.filename
+        with open(temporary_file, "w") as handle:
+            handle.write(json.dumps(header, sort_keys=True) + "\n")
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.rename(temporary_file, self.filename)
+        logger.verbose("Started journal %s with %s.", self.filename, pluralize(len(offsets), "block"))
+
+    def record(self, offset):
+        """
+        Record that a block has been transferred.
+
+        :param offset: The offset of the block (an integer).
+
+        Completed offsets are buffered in memory and written to disk (followed
+        by an :func:`os.fsync()` call) once every :attr:`checkpoint_interval`
+        seconds, so that the overhead of journaling stays negligible.
+        """
+        if self.handle is None:
+            self.handle = open(self.filename, "a")
+            self.pending = []
+            self.timer = Timer()
+        self.pending.append(offset)
+        if self.timer.elapsed_time >= self.checkpoint_interval:
+            self.checkpoint()
+
+    def checkpoint(self):
+        """Write the buffered offsets to disk."""
+        if self.handle is not None and self.pending:
+            num_blocks = pluralize(len(self.pending), "block")
+            logger.debug("Writing checkpoint to journal %s (%s) ..", self.filename, num_blocks)
+            if self.sync_callback is not None:
+                self.sync_callback()
+            ranges = compress_offsets(sorted(self.pending), self.block_size)
+            self.handle.write(json.dumps(ranges, separators=(",", ":")) + "\n")
+            self.handle.flush()
+            os.fsync(self.handle.fileno())
+            self.pending = []
+        self.timer = Timer()
+
+    def close(self):
+        """Write a final checkpoint and close the journal."""
+        if self.handle is not None:
+            self.checkpoint()
+            self.handle.close()
+            self.handle = None
+
+    def finish(self):
+        """Remove the journal after the transfer has completed successfully."""
+        self.close()
+        logger.verbose("Removing journal %s ..", self.filename)
+        try:
+            os.unlink(self.filename)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+
+def compress_offsets(offsets, block_size):
+    """
+    Compress a sorted list of block offsets into ranges of consecutive blocks.
+
+    :param offsets: A sorted list of integers.
+    :param block_size: The block size (an integer).
+    :returns: A list of lists with two integers each (the offset of the first
+              block in the range and the number of blocks in the range).
+    """
+    ranges = []
+    for offset in offsets:
+        if ranges and ranges[-1][0] + ranges[-1][1] * block_size == offset:
+            ranges[-1][1] += 1
+        else:
+            ranges.append([offset, 1])
+    return ranges
+
+
+def expand_ranges(ranges, block_size):
+    """
+    Expand ranges created by :func:`compress_offsets()` back into a list of offsets.
+
+    :param ranges: A list of lists with two integers each.
+    :param block_size: The block size (an integer).
+    :returns: A list of integers.
+    """
+    return [start + i * block_size for start, count in ranges for i in range(count)]
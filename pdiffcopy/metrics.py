@@ -0,0 +1,265 @@
+# Fast large file synchronization inspired by rsync.
+#
+# Author: Peter Odding <peter@peterodding.com>
+# Last Change: October 18, 2026
+# URL: https://pdiffcopy.readthedocs.io
+
+"""
+Process shared metrics in the Prometheus_ text exposition format.
+
+The ``pdiffcopy`` server runs as several :pypi:`gunicorn` worker processes
+which each start their own pools of hashing processes, so metrics kept in
+ordinary Python objects would only describe the process that happens to
+handle a ``/metrics`` request. To avoid this the values of all metrics
+defined here are stored in shared memory (see
+:func:`multiprocessing.RawArray()`) that's allocated when the metric is
+created. As long as metrics are created before the worker processes are
+forked (e.g. at import time) all processes update the same values.
+
+To make it possible to allocate shared memory up front the label values of
+each metric need to be known in advance. Values that weren't declared are
+aggregated under the label value ``other``.
+
+.. _Prometheus: https://prometheus.io/docs/instrumenting/exposition_formats/
+"""
+
+# Standard library modules.
+import multiprocessing
+
+# External dependencies.
+from property_manager import PropertyManager, lazy_property, mutable_property, required_property
+
+# Public identifiers that require documentation.
+__all__ = ("Counter", "DEFAULT_BUCKETS", "Gauge", "Histogram", "Metric", "MetricsRegistry", "format_value")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+"""The default histogram buckets in seconds (a tuple of numbers)."""
+
+
+class MetricsRegistry(PropertyManager):
+
+    """A collection of metrics that can be rendered in the Prometheus text format."""
+
+    @lazy_property
+    def lock(self):
+        """A :class:`multiprocessing.Lock` object that's shared by all metrics in the registry."""
+        return multiprocessing.Lock()
+
+    @lazy_property
+    def metrics(self):
+        """A list of :class:`Metric` objects."""
+        return []
+
+    def counter(self, name, help, **options):
+        """Create and register a :class:`Counter` (see :class:`Metric` for the supported options)."""
+        return self.register(Counter(name=name, help=help, lock=self.lock, **options))
+
+    def gauge(self, name, help, **options):
+        """Create and register a :class:`Gauge` (see :class:`Metric` for the supported options)."""
+        return self.register(Gauge(name=name, help=help, lock=self.lock, **options))
+
+    def histogram(self, name, help, **options):
+        """Create and register a :class:`Histogram` (see :class:`Metric` for the supported options)."""
+        return self.register(Histogram(name=name, help=help, lock=self.lock, **options))
+
+    def register(self, metric):
+        """
+        Register a metric and allocate its shared memory.
+
+        :param metric: A :class:`Metric` object.
+        :returns: The same :class:`Metric` object.
+        """
+        # Make sure shared memory is allocated before any processes are forked.
+        metric.values
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """
+        Render all registered metrics in the Prometheus text exposition format.
+
+        :returns: A string.
+        """
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class Metric(PropertyManager):
+
+    """Base class for process shared metrics."""
+
+    kind = "untyped"
+    """The Prometheus metric type (a string)."""
+
+    @required_property
+    def help(self):
+        """A description of the metric (a string)."""
+
+    @mutable_property
+    def label(self):
+        """The name of the label used to distinguish series (a string or :data:`None`)."""
+
+    @mutable_property
+    def label_values(self):
+        """A tuple with the supported label values (strings)."""
+        return ()
+
+    @required_property(repr=False)
+    def lock(self):
+        """The :class:`multiprocessing.Lock` used to update :attr:`values`."""
+
+    @required_property
+    def name(self):
+        """The name of the metric (a string)."""
+
+    @lazy_property
+    def series(self):
+        """A tuple with the label values of all series (``('other',)`` is added when :attr:`label` is set)."""
+        return tuple(self.label_values) + ("other",) if self.label else (None,)
+
+    @property
+    def slots_per_series(self):
+        """The number of shared memory slots needed for each series (an integer)."""
+        return 1
+
+    @lazy_property(repr=False)
+    def values(self):
+        """The shared memory of the metric (a :func:`multiprocessing.RawArray()` of doubles)."""
+        return multiprocessing.RawArray("d", len(self.series) * self.slots_per_series)
+
+    def find_slot(self, label_value=None):
+        """
+        Find the first shared memory slot of a series.
+
+        :param label_value: The label value of the series (a string or :data:`None`).
+        :returns: An index into :attr:`values` (an integer).
+        """
+        if self.label:
+            try:
+                index = self.series.index(label_value)
+            except ValueError:
+                index = len(self.series) - 1
+        else:
+            index = 0
+        return index * self.slots_per_series
+
+    def format_labels(self, label_value, **extra):
+        """Format the labels of a series (a string)."""
+        pairs = []
+        if self.label:
+            pairs.append((self.label, label_value))
+        pairs.extend(sorted(extra.items()))
+        if pairs:
+            return "{%s}" % ",".join('%s="%s"' % (k, v) for k, v in pairs)
+        return ""
+
+    def get(self, label_value=None):
+        """Get the current value of a series (a number)."""
+        return self.values[self.find_slot(label_value)]
+
+    def render(self):
+        """Render the metric in the Prometheus text exposition format (a list of strings)."""
+        lines = ["# HELP %s %s" % (self.name, self.help), "# TYPE %s %s" % (self.name, self.kind)]
+        for label_value in self.series:
+            lines.append(
+                "%s%s %s" % (self.name, self.format_labels(label_value), format_value(self.get(label_value)))
+            )
+        return lines
+
+
+class Counter(Metric):
+
+    """A monotonically increasing counter."""
+
+    kind = "counter"
+
+    def inc(self, amount=1, label_value=None):
+        """
+        Increase the counter.
+
+        :param amount: The number to add (defaults to one).
+        :param label_value: The label value of the series (a string or :data:`None`).
+        """
+        slot = self.find_slot(label_value)
+        with self.lock:
+            self.values[slot] += amount
+
+
+class Gauge(Counter):
+
+    """A value that can go up and down."""
+
+    kind = "gauge"
+
+    def dec(self, amount=1, label_value=None):
+        """Decrease the gauge (see :func:`~Counter.inc()`)."""
+        self.inc(-amount, label_value)
+
+    def set(self, value, label_value=None):
+        """Set the value of the gauge."""
+        slot = self.find_slot(label_value)
+        with self.lock:
+            self.values[slot] = value
+
+
+class Histogram(Metric):
+
+    """A histogram of observed values with cumulative buckets."""
+
+    kind = "histogram"
+
+    @mutable_property
+    def buckets(self):
+        """The upper bounds of the buckets (a tuple of numbers, defaults to :data:`DEFAULT_BUCKETS`)."""
+        return DEFAULT_BUCKETS
+
+    @property
+    def slots_per_series(self):
+        """One slot for each bucket, the +Inf bucket, the sum and the count (an integer)."""
+        return len(self.buckets) + 3
+
+    def observe(self, value, label_value=None):
+        """
+        Record an observation.
+
+        :param value: The observed value (a number).
+        :param label_value: The label value of the series (a string or :data:`None`).
+        """
+        slot = self.find_slot(label_value)
+        with self.lock:
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.values[slot + i] += 1
+            self.values[slot + len(self.buckets)] += 1
+            self.values[slot + len(self.buckets) + 1] += value
+            self.values[slot + len(self.buckets) + 2] += 1
+
+    def render(self):
+        """Render the histogram in the Prometheus text exposition format (a list of strings)."""
+        lines = ["# HELP %s %s" % (self.name, self.help), "# TYPE %s %s" % (self.name, self.kind)]
+        for label_value in self.series:
+            slot = self.find_slot(label_value)
+            for i, bound in enumerate(tuple(self.buckets) + ("+Inf",)):
+                le = bound if isinstance(bound, str) else format_value(bound)
+                lines.append(
+                    "%s_bucket%s %s"
+                    % (self.name, self.format_labels(label_value, le=le), format_value(self.values[slot + i]))
+                )
+            labels = self.format_labels(label_value)
+            lines.append("%s_sum%s %s" % (self.name, labels, format_value(self.values[slot + len(self.buckets) + 1])))
+            lines.append(
+                "%s_count%s %s" % (self.name, labels, format_value(self.values[slot + len(self.buckets) + 2]))
+            )
+        return lines
+
+
+def format_value(value):
+    """
+    Format a metric value.
+
+    :param value: A number.
+    :returns: The number formatted as a string (integral values are formatted without a decimal point).
+    """
+    return str(int(value)) if value == int(value) else repr(value)
@@ -0,0 +1,333 @@
+# Micro-benchmarks for pdiffcopy.
+#
+# Author: Peter Odding <peter@peterodding.com>
+# Last Change: October 18, 2026
+# URL: https://pdiffcopy.readthedocs.io
+
+"""
+Usage: python -m pdiffcopy.microbench [OPTIONS]
+
+Measure the cost of the primitives that pdiffcopy is built on in isolation:
+Hashing of blocks, dispatching values through a worker pool, reading and
+writing of blocks, encoding of the response of the /hashes endpoint and
+comparison of hashes.
+
+Each micro-benchmark is run several times and the fastest run is reported (in
+seconds per operation) because slower runs are usually caused by unrelated
+activity on the system. The results can be saved as a baseline and later runs
+can be compared against that baseline to detect performance regressions.
+
+Supported options:
+
+  -b, --block-size=BYTES
+
+    Benchmark the given block size (can be repeated, defaults to 64 KiB
+    and 1 MiB). Can be a plain integer number (bytes) or an expression
+    like 64K, 1MiB, etc.
+
+  -m, --method=NAME
+
+    Benchmark the given hash method (can be repeated, defaults to sha1).
+
+  -c, --concurrency=COUNT
+
+    Benchmark worker pool dispatch using the given number of worker processes
+    (can be repeated, defaults to 1 and 4).
+
+  -n, --number=COUNT
+
+    The number of operations in each run of a micro-benchmark (defaults to 100).
+
+  -r, --repeat=COUNT
+
+    The number of runs of each micro-benchmark (defaults to 3).
+
+  -s, --save-baseline=FILE
+
+    Save the results to FILE so that they can be used as a baseline.
+
+  -B, --baseline=FILE
+
+    Compare the results against the baseline saved in FILE. The exit
+    code will be 1 when any regressions are found.
+
+  -t, --threshold=PERCENTAGE
+
+    The percentage by which a micro-benchmark needs to be slower than the
+    baseline to be considered a regression (defaults to 20).
+
+  -h, --help
+
+    Show this message and exit.
+"""
+
+# Standard library modules.
+import functools
+import itertools
+import getopt
+import json
+import logging
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import timeit
+
+# External dependencies.
+import coloredlogs
+from humanfriendly import format_size, format_timespan, parse_size
+from humanfriendly.tables import format_pretty_table
+from humanfriendly.terminal import output, usage, warning
+
+# Modules included in our package.
+from pdiffcopy import __version__
+from pdiffcopy.client import compare_hashes
+from pdiffcopy.digests import DigestArray
+from pdiffcopy.hashing import decode_hash, encode_hash, hash_worker
+from pdiffcopy.mp import WorkerPool
+from pdiffcopy.operations import read_block, write_block
+
+# Public identifiers that require documentation.
+__all__ = (
+    "DEFAULT_THRESHOLD",
+    "compare_results",
+    "logger",
+    "main",
+    "make_digest_array",
+    "measure",
+    "noop_worker",
+    "run_microbenchmarks",
+)
+
+# Initialize a logger for this module.
+logger = logging.getLogger(__name__)
+
+DEFAULT_THRESHOLD = 20
+"""The default regression threshold (a percentage)."""
+
+
+def main():
+    """Command line interface for the micro-benchmarks."""
+    coloredlogs.install()
+    try:
+        options, arguments = getopt.gnu_getopt(
+            sys.argv[1:],
+            "b:m:c:n:r:s:B:t:h",
+            [
+                "block-size=",
+                "method=",
+                "concurrency=",
+                "number=",
+                "repeat=",
+                "save-baseline=",
+                "baseline=",
+                "threshold=",
+                "help",
+            ],
+        )
+    except Exception as e:
+        warning("Error: %s", e)
+        sys.exit(1)
+    bench_opts = {}
+    baseline_file = None
+    save_file = None
+    threshold = DEFAULT_THRESHOLD
+    for option, value in options:
+        if option in ("-b", "--block-size"):
+            bench_opts.setdefault("block_sizes", []).append(parse_size(value))
+        elif option in ("-m", "--method"):
+            bench_opts.setdefault("methods", []).append(value)
+        elif option in ("-c", "--concurrency"):
+            bench_opts.setdefault("concurrencies", []).append(int(value))
+        elif option in ("-n", "--number"):
+            bench_opts["number"] = int(value)
+        elif option in ("-r", "--repeat"):
+            bench_opts["repeat"] = int(value)
+        elif option in ("-s", "--save-baseline"):
+            save_file = value
+        elif option in ("-B", "--baseline"):
+            baseline_file = value
+        elif option in ("-t", "--threshold"):
+            threshold = float(value)
+        elif option in ("-h", "--help"):
+            usage(__doc__)
+            sys.exit(0)
+    try:
+        results = run_microbenchmarks(**bench_opts)
+        output(
+            format_pretty_table(
+                [[name, format_timespan(seconds, detailed=True)] for name, seconds in sorted(results.items())],
+                column_names=["Micro-benchmark", "Time per operation"],
+            )
+        )
+        if save_file:
+            logger.info("Saving baseline to %s ..", save_file)
+            with open(save_file, "w") as handle:
+                json.dump(
+                    dict(python=platform.python_version(), results=results, version=__version__),
+                    handle,
+                    indent=2,
+                    sort_keys=True,
+                )
+        if baseline_file:
+            with open(baseline_file) as handle:
+                baseline = json.load(handle)["results"]
+            regressions = compare_results(results, baseline, threshold)
+            if regressions:
+                for name, old, new in regressions:
+                    warning(
+                        "Regression in %s: %s -> %s (%.1f%% slower)",
+                        name,
+                        format_timespan(old, detailed=True),
+                        format_timespan(new, detailed=True),
+                        (new / old - 1) * 100,
+                    )
+                sys.exit(1)
+            logger.info("No regressions found (threshold %s%%).", threshold)
+    except Exception:
+        logger.exception("Micro-benchmarks terminating due to exception!")
+        sys.exit(1)
+
+
+def run_microbenchmarks(
+    block_sizes=(1024 * 64, 1024 * 1024), methods=("sha1",), concurrencies=(1, 4), number=100, repeat=3
+):
+    """
+    Run the micro-benchmarks.
+
+    :param block_sizes: The block sizes to benchmark (a list of integers).
+    :param methods: The hash methods to benchmark (a list of strings).
+    :param concurrencies: The worker pool concurrency levels to benchmark (a list of integers).
+    :param number: The number of operations in each run (an integer).
+    :param repeat: The number of runs (an integer).
+    :returns: A dictionary with the names of micro-benchmarks (strings) as
+              keys and the time per operation in seconds (floats) as values.
+    """
+    results = {}
+    directory = tempfile.mkdtemp(prefix="pdiffcopy-microbench-")
+    try:
+        filename = os.path.join(directory, "data.bin")
+        with open(filename, "wb") as handle:
+            handle.write(os.urandom(max(block_sizes) * 4))
+        file_size = os.path.getsize(filename)
+        for block_size in block_sizes:
+            label = format_size(block_size, binary=True)
+            offsets = range(0, file_size, block_size)
+            for method in methods:
+                name = "hash_worker[%s, %s]" % (method, label)
+                logger.info("Running micro-benchmark %s ..", name)
+                results[name] = measure(
+                    lambda: [hash_worker(o, block_size, filename, method) for o in offsets],
+                    len(offsets),
+                    number,
+                    repeat,
+                )
+            name = "read_block[%s]" % label
+            logger.info("Running micro-benchmark %s ..", name)
+            results[name] = measure(
+                lambda: [read_block(filename, o, block_size) for o in offsets], len(offsets), number, repeat
+            )
+            data = os.urandom(block_size)
+            name = "write_block[%s]" % label
+            logger.info("Running micro-benchmark %s ..", name)
+            results[name] = measure(
+                lambda: [write_block(filename, o, data) for o in offsets], len(offsets), number, repeat
+            )
+        for concurrency in concurrencies:
+            name = "WorkerPool[concurrency=%i]" % concurrency
+            logger.info("Running micro-benchmark %s ..", name)
+            # Start the pool once so that only dispatching values is measured.
+            with WorkerPool(concurrency=concurrency, generator_fn=itertools.count, worker_fn=noop_worker) as pool:
+                values = iter(pool)
+                results[name] = measure(functools.partial(run_worker_pool, values, number), number, number, repeat)
+        # The digests generated here have the length of SHA-1 digests.
+        hashes = [(i * 1024 * 1024, "%040x" % i) for i in range(1000)]
+        name = "encode_hash"
+        logger.info("Running micro-benchmark %s ..", name)
+        results[name] = measure(lambda: [encode_hash(o, d) for o, d in hashes], len(hashes), number, repeat)
+        lines = [encode_hash(o, d) for o, d in hashes]
+        name = "decode_hash"
+        logger.info("Running micro-benchmark %s ..", name)
+        results[name] = measure(lambda: [decode_hash(line) for line in lines], len(lines), number, repeat)
+        # Compare hashes that differ in every tenth block, stored in dictionaries and digest arrays.
+        source_hashes = dict(hashes)
+        target_hashes = dict((o, d if i % 10 else "%040x" % 0) for i, (o, d) in enumerate(hashes))
+        for label, source, target in (
+            ("dict", source_hashes, target_hashes),
+            ("DigestArray", make_digest_array(source_hashes), make_digest_array(target_hashes)),
+        ):
+            name = "compare_hashes[%s]" % label
+            logger.info("Running micro-benchmark %s ..", name)
+            results[name] = measure(
+                functools.partial(compare_hashes, source, target), len(hashes), number * 10, repeat
+            )
+    finally:
+        shutil.rmtree(directory)
+    return results
+
+
+def measure(function, operations, number, repeat):
+    """
+    Measure the time per operation of a micro-benchmark.
+
+    :param function: The function to call (a callable).
+    :param operations: The number of operations performed by each call (an integer).
+    :param number: The minimum number of operations in each run (an integer).
+    :param repeat: The number of runs (an integer).
+    :returns: The time per operation of the fastest run in seconds (a float).
+    """
+    calls = max(1, number // operations)
+    timings = timeit.repeat(function, number=calls, repeat=repeat)
+    return min(timings) / (calls * operations)
+
+
+def run_worker_pool(values, count):
+    """
+    Dispatch values through a :class:`~pdiffcopy.mp.WorkerPool` (used to benchmark its overhead).
+
+    :param values: The iterator of a running worker pool whose generator
+                   function never stops (e.g. :func:`itertools.count()`).
+    :param count: The number of values to dispatch (an integer).
+
+    The worker processes are started by the caller (outside of the measured
+    code) and terminated when the pool is closed.
+    """
+    for value in itertools.islice(values, count):
+        pass
+
+
+def make_digest_array(hashes):
+    """Convert a dictionary of hashes to a :class:`~pdiffcopy.digests.DigestArray` (used by the micro-benchmarks)."""
+    array = DigestArray(block_size=1024 * 1024, method="sha1")
+    array.update(hashes.items())
+    return array
+
+
+def noop_worker(value):
+    """Worker function for :func:`run_worker_pool()` that returns its argument."""
+    return value
+
+
+def compare_results(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    Compare micro-benchmark results against a baseline.
+
+    :param results: The results of :func:`run_microbenchmarks()`.
+    :param baseline: Results of a previous run (a dictionary in the same format).
+    :param threshold: The percentage by which a micro-benchmark needs to be
+                      slower than the baseline to be considered a regression
+                      (a number, defaults to :data:`DEFAULT_THRESHOLD`).
+    :returns: A list of tuples with three values each (the name of the
+              micro-benchmark, the baseline time and the current time).
+              Micro-benchmarks that are missing from the baseline are ignored.
+    """
+    regressions = []
+    for name, seconds in sorted(results.items()):
+        if name in baseline and seconds > baseline[name] * (1 + threshold / 100.0):
+            regressions.append((name, baseline[name], seconds))
+    return regressions
+
+
+if __name__ == "__main__":
+    main()
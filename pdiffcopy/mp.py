@@ -1,7 +1,7 @@
 # Fast large file synchronization inspired by rsync.
 #
 # Author: Peter Odding <peter@peterodding.com>
-# Last Change: March 6, 2020
+# Last Change: October 18, 2026
 # URL: https://pdiffcopy.readthedocs.io
 
 """
@@ -22,14 +22,20 @@ import time
 
 # External dependencies.
 import coloredlogs
+from humanfriendly import Timer
 from property_manager import PropertyManager, lazy_property, mutable_property, required_property
 from six.moves import queue
+from verboselogs import VerboseLogger
+
+# Modules included in our package.
+from pdiffcopy.profiling import profile_process
+from pdiffcopy.tracing import begin_span, end_span, set_process_name, span
 
 # Public identifiers that require documentation.
-__all__ = ("Promise", "WorkerPool", "generator_adapter", "logger", "worker_adapter")
+__all__ = ("ConcurrencyTuner", "Promise", "WorkerPool", "generator_adapter", "logger", "worker_adapter")
 
 # Initialize a logger for this module.
-logger = logging.getLogger(__name__)
+logger = VerboseLogger(__name__)
 
 
 class Promise(multiprocessing.Process):
@@ -45,27 +51,38 @@ class Promise(multiprocessing.Process):
         process is started automatically.
         """
         super(Promise, self).__init__(**options)
+        self.elapsed_time = None
         self.log_level = coloredlogs.get_level()
         self.queue = multiprocessing.Queue()
         self.start()
 
     def run(self):
         """Run the target function in a newly spawned child process."""
-        try:
-            initialize_child(self.log_level)
-            logger.debug("Child process calling function ..")
-            result = self._target(*self._args, **self._kwargs)
-            logger.debug("Child process communicating return value ..")
-            self.queue.put(result)
-            logger.debug("Child process is done, exiting ..")
-        except BaseException as e:
-            logger.exception("Child process got exception, will re-raise in parent!")
-            self.queue.put(e)
+        timer = Timer()
+        with profile_process("promise"):
+            try:
+                initialize_child(self.log_level)
+                set_process_name("Promise (%s)" % getattr(self._target, "__name__", "function"))
+                logger.debug("Child process calling function ..")
+                with span("call", "mp"):
+                    result = self._target(*self._args, **self._kwargs)
+                logger.debug("Child process communicating return value ..")
+                self.queue.put((result, timer.elapsed_time))
+                logger.debug("Child process is done, exiting ..")
+            except BaseException as e:
+                logger.exception("Child process got exception, will re-raise in parent!")
+                self.queue.put((e, timer.elapsed_time))
 
     def join(self):
-        """Get the return value and wait for the child process to finish."""
+        """
+        Get the return value and wait for the child process to finish.
+
+        After this method returns (or raises an exception) the
+        :attr:`elapsed_time` attribute contains the number of seconds
+        that the target function took to run in the child process.
+        """
         logger.debug("Parent process waiting for return value ..")
-        result = self.queue.get()
+        result, self.elapsed_time = self.queue.get()
         logger.debug("Parent process joining child process ..")
         super(Promise, self).join()
         if isinstance(result, BaseException):
@@ -76,19 +93,184 @@ class Promise(multiprocessing.Process):
             return result
 
 
+class ConcurrencyTuner(PropertyManager):
+
+    """
+    Tune the concurrency of a :class:`WorkerPool` based on measured throughput.
+
+    This implements an AIMD_ style controller: After each measurement interval
+    the throughput is compared to the throughput of the previous interval.
+    While adding a worker improves throughput the concurrency is additively
+    increased by one. When adding a worker makes throughput significantly
+    worse (e.g. because a spinning disk starts seeking) the concurrency is
+    multiplicatively decreased. When adding a worker doesn't make a difference
+    the last increase is reverted and the concurrency is considered converged,
+    until throughput changes significantly (in which case probing resumes).
+
+    .. _AIMD: https://en.wikipedia.org/wiki/Additive_increase/multiplicative_decrease
+    """
+
+    @mutable_property
+    def count(self):
+        """The number of values processed in the current measurement interval (an integer)."""
+        return 0
+
+    @mutable_property
+    def decrease_factor(self):
+        """The factor used to decrease the concurrency (a float, defaults to 0.5)."""
+        return 0.5
+
+    @mutable_property
+    def interval(self):
+        """The duration of a measurement interval in seconds (a number, defaults to 2)."""
+        return 2
+
+    @mutable_property
+    def last_action(self):
+        """The last adjustment made by :func:`update()` (one of the strings 'increase', 'decrease' or 'hold')."""
+
+    @required_property
+    def maximum(self):
+        """The maximum concurrency (an integer)."""
+
+    @mutable_property
+    def minimum(self):
+        """The minimum concurrency (an integer, defaults to 1)."""
+        return 1
+
+    @mutable_property
+    def peak_throughput(self):
+        """The highest throughput measured so far (values per second, a float)."""
+        return 0.0
+
+    @mutable_property
+    def throughput(self):
+        """The throughput measured in the previous interval (values per second, a float or :data:`None`)."""
+
+    @mutable_property
+    def timer(self):
+        """The :class:`~humanfriendly.Timer` of the current measurement interval."""
+
+    @mutable_property
+    def tolerance(self):
+        """The relative change in throughput that's considered significant (a float, defaults to 0.1)."""
+        return 0.1
+
+    @mutable_property
+    def value(self):
+        """The current concurrency (an integer, defaults to half of :attr:`maximum`)."""
+        return max(self.minimum, min(self.maximum, self.maximum // 2))
+
+    def record(self, count=1):
+        """
+        Record that values have been processed.
+
+        :param count: The number of processed values (an integer, defaults to one).
+        :returns: :data:`True` when :attr:`value` has changed, :data:`False` otherwise.
+        """
+        if self.timer is None:
+            self.timer = Timer()
+        self.count += count
+        elapsed_time = self.timer.elapsed_time
+        if elapsed_time >= self.interval:
+            throughput = self.count / elapsed_time
+            self.count = 0
+            self.timer = Timer()
+            return self.update(throughput)
+        return False
+
+    def update(self, throughput):
+        """
+        Adjust the concurrency based on the throughput of the last interval.
+
+        :param throughput: The measured throughput (values per second, a float).
+        :returns: :data:`True` when :attr:`value` has changed, :data:`False` otherwise.
+        """
+        previous_value = self.value
+        previous_throughput = self.throughput
+        self.peak_throughput = max(self.peak_throughput, throughput)
+        self.throughput = throughput
+        if previous_throughput is None:
+            action = "increase"
+        elif throughput > previous_throughput * (1 + self.tolerance):
+            # Throughput improved significantly: Keep probing upwards.
+            action = "increase"
+        elif throughput < previous_throughput * (1 - self.tolerance):
+            # Throughput got significantly worse: Back off unless we just did.
+            action = "increase" if self.last_action == "decrease" else "decrease"
+        elif self.last_action == "increase":
+            # Adding the last worker didn't help, so revert it.
+            self.value = max(self.minimum, self.value - 1)
+            action = "hold"
+        else:
+            action = "hold"
+        if action == "increase":
+            self.value = min(self.maximum, self.value + 1)
+        elif action == "decrease":
+            self.value = max(self.minimum, int(self.value * self.decrease_factor))
+        self.last_action = action
+        if self.value != previous_value:
+            logger.debug(
+                "Adjusted concurrency from %i to %i (throughput %.2f/s, previous %s) ..",
+                previous_value,
+                self.value,
+                throughput,
+                "%.2f/s" % previous_throughput if previous_throughput is not None else "unknown",
+            )
+            return True
+        return False
+
+
 class WorkerPool(PropertyManager):
 
     """Simple to use worker pool implementation using :mod:`multiprocessing`."""
 
+    @lazy_property
+    def active_limit(self):
+        """
+        The number of worker processes that are allowed to be active.
+
+        A :class:`multiprocessing.Value` object when :attr:`autotune` is
+        enabled, :data:`None` otherwise.
+        """
+        return multiprocessing.Value("i", self.tuner.value) if self.autotune else None
+
     @lazy_property
     def all_processes(self):
         """A list with all :class:`multiprocessing.Process` objects used by the pool."""
         return [self.generator_process] + self.worker_processes
 
+    @mutable_property
+    def autotune(self):
+        """
+        Whether to tune the number of active workers (a boolean, defaults to :data:`False`).
+
+        When this is :data:`True` then :attr:`concurrency` is the maximum
+        number of worker processes and the number of workers that are
+        actually active is tuned by :attr:`tuner`.
+        """
+        return False
+
+    @mutable_property
+    def busy_counter(self):
+        """
+        An optional object that tracks the number of busy workers.
+
+        When this is set it's expected to be an object with ``inc()`` and
+        ``dec()`` methods that work across processes (for example a
+        :class:`~pdiffcopy.metrics.Gauge`). The worker processes call these
+        methods before and after applying :attr:`worker_fn`.
+        """
+
     @required_property
     def concurrency(self):
         """The number of processes allowed to run simultaneously (an integer)."""
 
+    @lazy_property
+    def generator_done(self):
+        """A :class:`multiprocessing.Event` that's set when :attr:`generator_fn` is exhausted."""
+        return multiprocessing.Event()
+
     @required_property
     def generator_fn(self):
         """A user defined generator to populate :attr:`input_queue`."""
@@ -100,6 +282,7 @@ class WorkerPool(PropertyManager):
             target=generator_adapter,
             kwargs=dict(
                 concurrency=self.concurrency,
+                generator_done=self.generator_done,
                 generator_fn=self.generator_fn,
                 input_queue=self.input_queue,
                 log_level=self.log_level,
@@ -111,6 +294,11 @@ class WorkerPool(PropertyManager):
         """The input queue (a :class:`multiprocessing.Queue` object)."""
         return multiprocessing.Queue(self.concurrency)
 
+    @mutable_property
+    def label(self):
+        """A description of what the pool is used for (a string, used in log messages)."""
+        return "Worker pool"
+
     @mutable_property
     def log_level(self):
         """
@@ -131,6 +319,11 @@ class WorkerPool(PropertyManager):
         """The time to wait between checking :attr:`output_queue` (a floating point number, defaults to 0.1 second)."""
         return 0.1
 
+    @lazy_property
+    def tuner(self):
+        """A :class:`ConcurrencyTuner` object when :attr:`autotune` is enabled, :data:`None` otherwise."""
+        return ConcurrencyTuner(maximum=self.concurrency) if self.autotune else None
+
     @required_property
     def worker_fn(self):
         """A user defined worker function to consume :attr:`input_queue` and populate :attr:`output_queue`."""
@@ -142,10 +335,15 @@ class WorkerPool(PropertyManager):
             multiprocessing.Process(
                 target=worker_adapter,
                 kwargs=dict(
+                    active_limit=self.active_limit,
+                    busy_counter=self.busy_counter,
+                    generator_done=self.generator_done,
                     input_queue=self.input_queue,
                     log_level=self.log_level,
                     output_queue=self.output_queue,
+                    polling_interval=self.polling_interval,
                     worker_fn=self.worker_fn,
+                    worker_index=i,
                 ),
             )
             for i in range(self.concurrency)
@@ -160,7 +358,10 @@ class WorkerPool(PropertyManager):
         while True:
             try:
                 logger.debug("Waiting for value on output queue ..")
-                yield self.output_queue.get(timeout=self.polling_interval)
+                value = self.output_queue.get(timeout=self.polling_interval)
+                if self.tuner and self.tuner.record():
+                    self.active_limit.value = self.tuner.value
+                yield value
             except queue.Empty:
                 if any(p.is_alive() for p in self.all_processes):
                     logger.debug("Got empty output queue, backing off ..")
@@ -172,6 +373,15 @@ class WorkerPool(PropertyManager):
         while not self.output_queue.empty():
             logger.debug("Flushing output queue ..")
             yield self.output_queue.get()
+        if self.tuner and self.tuner.throughput is None:
+            logger.verbose("%s finished before concurrency could be tuned.", self.label)
+        elif self.tuner:
+            logger.info(
+                "%s concurrency converged on %i (peak throughput %.2f values/s).",
+                self.label,
+                self.tuner.value,
+                self.tuner.peak_throughput,
+            )
         logger.debug("Worker pool has finished.")
 
     def __enter__(self):
@@ -194,20 +404,34 @@ class WorkerPool(PropertyManager):
                 worker.join()
 
 
-def generator_adapter(concurrency, generator_fn, input_queue, log_level):
+def generator_adapter(concurrency, generator_fn, input_queue, log_level, generator_done=None):
     """Adapter function for the generator process."""
-    initialize_child(log_level)
-    # Populate the input queue from the generator function.
-    for value in generator_fn():
-        logger.debug("Generator putting value onto input queue (%s) ..", value)
-        input_queue.put(value)
-    # Push one sentinel token for each worker process.
-    for i in range(concurrency):
-        logger.debug("Generator putting sentinel onto input queue  ..")
-        input_queue.put(None)
-    # Let multiprocessing know we've filled up the input queue.
-    input_queue.close()
-    logger.debug("Generator function is finished.")
+    with profile_process("generator"):
+        initialize_child(log_level)
+        set_process_name("Generator")
+        # Populate the input queue from the generator function.
+        iterator = iter(generator_fn())
+        while True:
+            event = begin_span("generate", "mp")
+            try:
+                value = next(iterator)
+            except StopIteration:
+                break
+            finally:
+                end_span(event)
+            logger.debug("Generator putting value onto input queue (%s) ..", value)
+            with span("enqueue", "mp"):
+                input_queue.put(value)
+        # Push one sentinel token for each worker process.
+        for i in range(concurrency):
+            logger.debug("Generator putting sentinel onto input queue  ..")
+            input_queue.put(None)
+        # Let multiprocessing know we've filled up the input queue.
+        input_queue.close()
+        # Let idle workers know that they should drain the input queue.
+        if generator_done is not None:
+            generator_done.set()
+        logger.debug("Generator function is finished.")
 
 
 def initialize_child(log_level=logging.INFO):
@@ -215,20 +439,46 @@ def initialize_child(log_level=logging.INFO):
     coloredlogs.install(level=log_level)
 
 
-def worker_adapter(input_queue, log_level, output_queue, worker_fn):
+def worker_adapter(
+    input_queue,
+    log_level,
+    output_queue,
+    worker_fn,
+    active_limit=None,
+    busy_counter=None,
+    generator_done=None,
+    polling_interval=0.1,
+    worker_index=0,
+):
     """Adapter function for the worker processes."""
-    initialize_child(log_level)
-    while True:
-        # Get the next value to process from the input queue.
-        logger.debug("Worker waiting for value on input queue ..")
-        input_value = input_queue.get()
-        # Check for sentinel values.
-        if input_value is None:
-            logger.debug("Worker got sentinel value, exiting ..")
-            break
-        # Process the value using the worker function.
-        logger.debug("Worker applying user defined function to value: %s", input_value)
-        output_value = worker_fn(input_value)
-        # Put the new value on the output queue.
-        logger.debug("Worker putting value on output queue: %s", output_value)
-        output_queue.put(output_value)
+    with profile_process("worker"):
+        initialize_child(log_level)
+        set_process_name("Worker #%i" % (worker_index + 1))
+        while True:
+            # Stay idle while the concurrency has been tuned down (but make sure
+            # to exit once the generator is done, to consume our sentinel value).
+            if active_limit is not None:
+                while worker_index >= active_limit.value and not generator_done.is_set():
+                    time.sleep(polling_interval)
+            # Get the next value to process from the input queue.
+            logger.debug("Worker waiting for value on input queue ..")
+            with span("dequeue", "mp"):
+                input_value = input_queue.get()
+            # Check for sentinel values.
+            if input_value is None:
+                logger.debug("Worker got sentinel value, exiting ..")
+                break
+            # Process the value using the worker function.
+            logger.debug("Worker applying user defined function to value: %s", input_value)
+            if busy_counter is not None:
+                busy_counter.inc()
+            try:
+                with span("work", "mp"):
+                    output_value = worker_fn(input_value)
+            finally:
+                if busy_counter is not None:
+                    busy_counter.dec()
+            # Put the new value on the output queue.
+            logger.debug("Worker putting value on output queue: %s", output_value)
+            with span("publish", "mp"):
+                output_queue.put(output_value)
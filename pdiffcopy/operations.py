@@ -1,8 +1,11 @@
 """Utility functions used by the client as well as the server."""
 
 # Standard library modules.
+import ctypes
+import ctypes.util
 import errno
 import logging
+import mmap
 import os
 
 # External dependencies.
@@ -10,26 +13,124 @@ from humanfriendly import format_size
 from humanfriendly.testing import make_dirs
 
 # Public identifiers that require documentation.
-__all__ = ("get_file_info", "get_file_size", "logger", "read_block", "resize_file", "write_block")
+__all__ = (
+    "COPY_FALLBACK_ERRNOS",
+    "DEFAULT_SYNC_INTERVAL",
+    "DIRECT_IO_ALIGNMENT",
+    "DURABILITY_POLICIES",
+    "FICLONE",
+    "IO_MODES",
+    "SYNC_FILE_RANGE_WRITE",
+    "apply_durability",
+    "clone_file",
+    "copy_block",
+    "copy_blocks",
+    "copy_range",
+    "fadvise",
+    "get_file_info",
+    "get_file_size",
+    "get_libc",
+    "list_files",
+    "logger",
+    "read_block",
+    "read_block_direct",
+    "resize_file",
+    "set_mtime",
+    "sync_file",
+    "sync_file_range",
+    "write_block",
+)
 
 # Initialize a logger for this module.
 logger = logging.getLogger(__name__)
 
+SYNC_FILE_RANGE_WRITE = 2
+"""The ``sync_file_range()`` flag that starts write-back of dirty pages without waiting (an integer)."""
+
+# The number of bytes written by the current process since the last
+# write-back, by filename (used by the 'periodic' durability policy).
+unsynced_bytes = {}
+
+# Shared libraries loaded using ctypes (see get_libc()).
+libraries = {}
+
+COPY_FALLBACK_ERRNOS = (errno.EINVAL, errno.ENOSYS, errno.ENOTTY, errno.EOPNOTSUPP, errno.EXDEV)
+"""
+Error codes that indicate in-kernel copying isn't supported (a tuple of integers).
+
+Used by :func:`clone_file()` and :func:`copy_block()` to decide whether to fall back.
+"""
+
+DEFAULT_SYNC_INTERVAL = 1024 * 1024 * 64
+"""The default number of bytes written between write-backs by the ``periodic`` durability policy (64 MiB)."""
+
+DIRECT_IO_ALIGNMENT = 4096
+"""The alignment of offsets, sizes and buffers used for direct I/O (an integer)."""
+
+DURABILITY_POLICIES = ("none", "end", "periodic", "block")
+"""
+The supported durability policies of :func:`write_block()` (a tuple of strings):
+
+``none``
+ Written data is left to the operating system to write back whenever it
+ sees fit (the default, fastest but not durable).
+
+``end``
+ The target file is synchronized using :func:`sync_file()` when all blocks
+ have been written (the caller is responsible for this).
+
+``periodic``
+ Like ``end`` but write-back of written data is also started using
+ :func:`sync_file_range()` each time a process has written
+ :data:`DEFAULT_SYNC_INTERVAL` bytes (configurable), which avoids a
+ large backlog of dirty pages that would make the final synchronization
+ slow and disrupt other programs.
+
+``block``
+ Each block is synchronized using :func:`os.fdatasync()` before
+ :func:`write_block()` returns (slowest but every acknowledged block is
+ durable).
+"""
+
+FICLONE = 0x40049409
+"""The Linux ``ioctl()`` request that clones a file using a reflink (an integer)."""
+
+IO_MODES = ("buffered", "nocache", "direct")
+"""
+The supported I/O modes of :func:`read_block()` (a tuple of strings):
+
+``buffered``
+ Regular reads through the page cache (the default).
+
+``nocache``
+ Reads through the page cache that use :func:`os.posix_fadvise()` to tell
+ the kernel to read the whole block up front and to drop it from the page
+ cache afterwards. This avoids evicting the working set of other programs
+ when large files are hashed.
+
+``direct``
+ Reads that bypass the page cache using ``O_DIRECT`` (see
+ :func:`read_block_direct()`). Falls back to ``nocache`` when the platform
+ or filesystem doesn't support direct I/O.
+"""
+
 
 def get_file_info(filename):
     """
     Get information about a local file.
 
     :param filename: An absolute filename (a string).
-    :returns: A dictionary with file metadata, currently only the file size
-              is included. If the file doesn't exist an empty dictionary is
-              returned.
+    :returns: A dictionary with file metadata, currently the file size and
+              last modification time are included. If the file doesn't exist
+              an empty dictionary is returned.
     """
-    size = get_file_size(filename)
-    if size is not None:
-        return {"size": size}
-    else:
-        return {}
+    try:
+        metadata = os.stat(filename)
+    except OSError as e:
+        if e.errno == errno.ENOENT:
+            return {}
+        raise
+    return {"size": metadata.st_size, "mtime": metadata.st_mtime}
 
 
 def get_file_size(filename):
@@ -48,19 +149,268 @@ def get_file_size(filename):
         raise
 
 
-def read_block(filename, offset, size):
+def list_files(directory):
+    """
+    List the regular files in a local directory tree.
+
+    :param directory: An absolute pathname (a string).
+    :returns: A list of dictionaries, one for each regular file in the
+              directory tree (sorted by name). Each dictionary contains the
+              metadata returned by :func:`get_file_info()` and a ``name``
+              key with the pathname relative to `directory`. If the
+              directory doesn't exist an empty list is returned.
+    """
+    results = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            pathname = os.path.join(root, name)
+            if os.path.isfile(pathname) and not os.path.islink(pathname):
+                info = get_file_info(pathname)
+                if info:
+                    info["name"] = os.path.relpath(pathname, directory)
+                    results.append(info)
+    return results
+
+
+def apply_durability(handle, offset, size, durability="none", sync_interval=DEFAULT_SYNC_INTERVAL):
+    """
+    Apply a durability policy after a block has been written.
+
+    :param handle: The file object that the block was written to.
+    :param offset: The byte offset of the block (an integer).
+    :param size: The size of the block (an integer).
+    :param durability: One of the strings in :data:`DURABILITY_POLICIES`.
+    :param sync_interval: The number of bytes between write-backs for the
+                          ``periodic`` policy (an integer).
+    :raises: :exc:`~exceptions.ValueError` when `durability` isn't supported.
+    """
+    if durability not in DURABILITY_POLICIES:
+        msg = "Unsupported durability policy %r! (supported: %s)"
+        raise ValueError(msg % (durability, ", ".join(DURABILITY_POLICIES)))
+    if durability == "block":
+        handle.flush()
+        os.fdatasync(handle.fileno())
+    elif durability == "periodic":
+        total = unsynced_bytes.get(handle.name, 0) + size
+        if total >= sync_interval:
+            handle.flush()
+            logger.debug("Starting write-back of %s (%i bytes written since the last one) ..", handle.name, total)
+            try:
+                sync_file_range(handle.fileno(), 0, 0, SYNC_FILE_RANGE_WRITE)
+            except NotImplementedError:
+                os.fdatasync(handle.fileno())
+            total = 0
+        unsynced_bytes[handle.name] = total
+
+
+def clone_file(source, target):
+    """
+    Clone a local file using a reflink (copy-on-write).
+
+    :param source: The absolute filename of the file to clone (a string).
+    :param target: The absolute filename of the clone (a string).
+    :returns: :data:`True` when the file was cloned, :data:`False` when the
+              platform or filesystem doesn't support reflinks (for example
+              because `source` and `target` are on different filesystems).
+
+    On filesystems like Btrfs and XFS cloning a file takes constant time
+    because no data is copied, the two files share their extents until
+    either one is modified.
+    """
+    try:
+        import fcntl
+    except ImportError:
+        return False
+    make_dirs(os.path.dirname(target))
+    with open(source, "rb") as source_handle:
+        # The target is opened without truncating it so that its contents
+        # are left intact when cloning isn't supported.
+        fd = os.open(target, os.O_WRONLY | os.O_CREAT, 0o666)
+        try:
+            fcntl.ioctl(fd, FICLONE, source_handle.fileno())
+        except (IOError, OSError) as e:
+            if e.errno not in COPY_FALLBACK_ERRNOS:
+                raise
+            logger.debug("Failed to clone %s to %s (%s).", source, target, e)
+            return False
+        else:
+            # Cloning doesn't shrink the target, so remove any old data after the end of the source.
+            os.ftruncate(fd, os.fstat(source_handle.fileno()).st_size)
+        finally:
+            os.close(fd)
+    logger.debug("Cloned %s to %s.", source, target)
+    return True
+
+
+def copy_block(source, target, offset, size, durability="none", sync_interval=DEFAULT_SYNC_INTERVAL):
+    """
+    Copy a block of data between local files.
+
+    :param source: The absolute filename of the file to read from (a string).
+    :param target: The absolute filename of the file to write to (a string).
+    :param offset: The byte offset of the block in both files (an integer).
+    :param size: The number of bytes to copy (an integer).
+    :param durability: See :func:`apply_durability()`.
+    :param sync_interval: See :func:`apply_durability()`.
+    :returns: The number of bytes copied (an integer).
+
+    When available :func:`os.copy_file_range()` is used so that the data is
+    copied inside the kernel instead of passing through Python, which also
+    allows filesystems to share extents or perform server side copies.
+    Otherwise the block is read and written the regular way.
+    """
+    logger.debug("Copying %s block %s (%i bytes) to %s ..", source, offset, size, target)
+    with open(source, "rb") as source_handle, open(target, "r+b") as target_handle:
+        copied = copy_range(source_handle, target_handle, offset, offset, size)
+        apply_durability(target_handle, offset, copied, durability, sync_interval)
+        return copied
+
+
+def copy_blocks(filename, copies, size, durability="none", sync_interval=DEFAULT_SYNC_INTERVAL):
+    """
+    Copy blocks of data to other offsets within a local file.
+
+    :param filename: An absolute filename (a string).
+    :param copies: A list of tuples with two integers each (the offset to
+                   copy from and the offset to copy to).
+    :param size: The number of bytes to copy for each tuple (an integer).
+    :param durability: See :func:`apply_durability()`.
+    :param sync_interval: See :func:`apply_durability()`.
+    :returns: The total number of bytes copied (an integer).
+    """
+    logger.debug("Copying %i blocks (%i bytes each) within %s ..", len(copies), size, filename)
+    total = 0
+    with open(filename, "r+b") as handle:
+        for source_offset, target_offset in copies:
+            copied = copy_range(handle, handle, source_offset, target_offset, size)
+            apply_durability(handle, target_offset, copied, durability, sync_interval)
+            total += copied
+    return total
+
+
+def copy_range(source_handle, target_handle, source_offset, target_offset, size):
+    """
+    Copy a range of bytes between open files (used by :func:`copy_block()` and :func:`copy_blocks()`).
+
+    :param source_handle: The file object to read from.
+    :param target_handle: The file object to write to (may be the same as `source_handle`).
+    :param source_offset: The byte offset to copy from (an integer).
+    :param target_offset: The byte offset to copy to (an integer).
+    :param size: The number of bytes to copy (an integer).
+    :returns: The number of bytes copied (an integer, less than `size` at the end of the source file).
+
+    When available :func:`os.copy_file_range()` is used, otherwise (or when
+    the kernel refuses, for example because the ranges overlap) the data is
+    read and written the regular way.
+    """
+    if hasattr(os, "copy_file_range"):
+        try:
+            copied = 0
+            while copied < size:
+                num_bytes = os.copy_file_range(
+                    source_handle.fileno(),
+                    target_handle.fileno(),
+                    size - copied,
+                    source_offset + copied,
+                    target_offset + copied,
+                )
+                if num_bytes == 0:
+                    # End of the source file.
+                    break
+                copied += num_bytes
+            return copied
+        except OSError as e:
+            if e.errno not in COPY_FALLBACK_ERRNOS:
+                raise
+    source_handle.seek(source_offset)
+    data = source_handle.read(size)
+    target_handle.seek(target_offset)
+    target_handle.write(data)
+    return len(data)
+
+
+def fadvise(handle, offset, size, *advice):
+    """
+    Give the kernel hints about how a file will be accessed (if supported).
+
+    :param handle: A file object.
+    :param offset: The byte offset where the region starts (an integer).
+    :param size: The size of the region in bytes (an integer).
+    :param advice: One or more names of ``POSIX_FADV_*`` constants without
+                   the prefix (strings like ``SEQUENTIAL`` or ``DONTNEED``).
+
+    On platforms without :func:`os.posix_fadvise()` this does nothing.
+    """
+    if hasattr(os, "posix_fadvise"):
+        for name in advice:
+            os.posix_fadvise(handle.fileno(), offset, size, getattr(os, "POSIX_FADV_%s" % name))
+
+
+def read_block(filename, offset, size, io_mode="buffered"):
     """
     Read a block of data from a local file.
 
     :param filename: An absolute filename (a string).
     :param offset: The byte offset were reading starts (an integer).
     :param size: The number of bytes to read (an integer).
+    :param io_mode: One of the strings in :data:`IO_MODES`.
     :returns: The read data (a byte string).
+    :raises: :exc:`~exceptions.ValueError` when `io_mode` isn't supported.
     """
     logger.debug("Reading %s block %s (%i bytes) ..", filename, offset, size)
+    if io_mode not in IO_MODES:
+        raise ValueError("Unsupported I/O mode %r! (supported: %s)" % (io_mode, ", ".join(IO_MODES)))
+    if io_mode == "direct":
+        if hasattr(os, "O_DIRECT") and hasattr(os, "preadv"):
+            try:
+                return read_block_direct(filename, offset, size)
+            except OSError as e:
+                # EINVAL means the filesystem doesn't support O_DIRECT.
+                if e.errno != errno.EINVAL:
+                    raise
+        logger.debug("Direct I/O not supported for %s, falling back to 'nocache' mode.", filename)
+        io_mode = "nocache"
     with open(filename, "rb") as handle:
+        if io_mode == "nocache":
+            fadvise(handle, offset, size, "SEQUENTIAL", "WILLNEED")
         handle.seek(offset)
-        return handle.read(size)
+        data = handle.read(size)
+        if io_mode == "nocache":
+            fadvise(handle, offset, size, "DONTNEED")
+        return data
+
+
+def read_block_direct(filename, offset, size):
+    """
+    Read a block of data from a local file while bypassing the page cache.
+
+    :param filename: An absolute filename (a string).
+    :param offset: The byte offset were reading starts (an integer).
+    :param size: The number of bytes to read (an integer).
+    :returns: The read data (a byte string).
+    :raises: :exc:`~exceptions.OSError` with :data:`errno.EINVAL` when the
+             filesystem doesn't support ``O_DIRECT``.
+
+    Direct I/O requires the offset, size and memory address of reads to be
+    aligned (see :data:`DIRECT_IO_ALIGNMENT`), so the aligned region around
+    the requested block is read into an anonymous memory map (which is page
+    aligned) and the requested block is sliced out of that.
+    """
+    start = offset - offset % DIRECT_IO_ALIGNMENT
+    end = offset + size
+    end += -end % DIRECT_IO_ALIGNMENT
+    fd = os.open(filename, os.O_RDONLY | os.O_DIRECT)
+    try:
+        buffer = mmap.mmap(-1, end - start)
+        try:
+            num_bytes = os.preadv(fd, [buffer], start)
+            skip = offset - start
+            return buffer[skip:min(num_bytes, skip + size)]
+        finally:
+            buffer.close()
+    finally:
+        os.close(fd)
 
 
 def resize_file(filename, size):
@@ -85,16 +435,75 @@ def resize_file(filename, size):
         handle.close()
 
 
-def write_block(filename, offset, data):
+def set_mtime(filename, mtime):
+    """
+    Change the last modification time of a local file.
+
+    :param filename: An absolute filename (a string).
+    :param mtime: The new modification time (a number, seconds since the Unix epoch).
+    """
+    logger.debug("Setting modification time of %s to %s ..", filename, mtime)
+    os.utime(filename, (mtime, mtime))
+
+
+def sync_file(filename):
+    """
+    Make sure the contents and metadata of a local file have been written to disk.
+
+    :param filename: An absolute filename (a string).
+    """
+    logger.debug("Synchronizing %s to disk ..", filename)
+    fd = os.open(filename, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    unsynced_bytes.pop(filename, None)
+
+
+def sync_file_range(fd, offset, size, flags):
+    """
+    Call the Linux ``sync_file_range()`` system call (using :mod:`ctypes`).
+
+    :param fd: An open file descriptor (an integer).
+    :param offset: The byte offset where the range starts (an integer).
+    :param size: The size of the range in bytes (an integer, zero means up to the end of the file).
+    :param flags: A bitmask of ``SYNC_FILE_RANGE_*`` flags (an integer).
+    :raises: :exc:`~exceptions.NotImplementedError` when the system call
+             isn't available and :exc:`~exceptions.OSError` when it fails.
+
+    Unlike :func:`os.fdatasync()` this can start write-back of dirty pages
+    without waiting for it to complete. It doesn't guarantee durability
+    by itself (no metadata or disk caches are flushed).
+    """
+    function = getattr(get_libc(), "sync_file_range", None)
+    if function is None:
+        raise NotImplementedError("sync_file_range() isn't available on this platform!")
+    function.argtypes = (ctypes.c_int, ctypes.c_int64, ctypes.c_int64, ctypes.c_uint)
+    if function(fd, offset, size, flags) != 0:
+        error_number = ctypes.get_errno()
+        raise OSError(error_number, os.strerror(error_number))
+
+
+def get_libc():
+    """Get a :class:`ctypes.CDLL` object for the C library (cached)."""
+    if "libc" not in libraries:
+        libraries["libc"] = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    return libraries["libc"]
+
+
+def write_block(filename, offset, data, durability="none", sync_interval=DEFAULT_SYNC_INTERVAL):
     """
     Write a block of data to a local file.
 
     :param filename: An absolute filename (a string).
     :param offset: The byte offset were writing starts (an integer).
     :param data: The data to write (a byte string).
+    :param durability: See :func:`apply_durability()`.
+    :param sync_interval: See :func:`apply_durability()`.
     """
     logger.debug("Writing %s block %s (size: %s) ..", filename, offset, len(data))
     with open(filename, "r+b") as handle:
         handle.seek(offset)
         handle.write(data)
-        handle.flush()
+        apply_durability(handle, offset, len(data), durability, sync_interval)
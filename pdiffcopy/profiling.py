@@ -0,0 +1,154 @@
+# Fast large file synchronization inspired by rsync.
+#
+# Author: Peter Odding <peter@peterodding.com>
+# Last Change: October 18, 2026
+# URL: https://pdiffcopy.readthedocs.io
+
+"""
+Profiling of the processes involved in a synchronization.
+
+Most of the work done by pdiffcopy happens in child processes created by
+:mod:`pdiffcopy.mp`, which means running the program under :mod:`cProfile`
+only shows the parent process waiting for its children. When profiling is
+enabled using :func:`enable_profiling()` each child process profiles itself
+and saves its statistics to a separate file in the profile directory when it
+exits, after which :func:`merge_profiles()` can be used to combine them.
+
+The profile directory is passed to child processes using an environment
+variable so that it's also inherited by the worker processes of the server.
+"""
+
+# Standard library modules.
+import contextlib
+import cProfile
+import glob
+import logging
+import os
+import pstats
+import uuid
+
+# External dependencies.
+from humanfriendly.testing import make_dirs
+from six import StringIO
+
+# Public identifiers that require documentation.
+__all__ = (
+    "PROFILE_DIRECTORY_VARIABLE",
+    "enable_profiling",
+    "format_profile",
+    "get_profile_directory",
+    "logger",
+    "merge_profiles",
+    "profile_process",
+    "save_profile",
+    "start_profiler",
+)
+
+# Initialize a logger for this module.
+logger = logging.getLogger(__name__)
+
+PROFILE_DIRECTORY_VARIABLE = "PDIFFCOPY_PROFILE_DIRECTORY"
+"""The name of the environment variable that enables profiling (a string)."""
+
+
+def enable_profiling(directory):
+    """
+    Enable profiling of the current process and any child processes created afterwards.
+
+    :param directory: The pathname of the directory where profile
+                      statistics should be saved (a string, the directory
+                      is created if it doesn't exist yet).
+    """
+    directory = os.path.abspath(directory)
+    make_dirs(directory)
+    os.environ[PROFILE_DIRECTORY_VARIABLE] = directory
+    logger.info("Saving profile statistics to %s ..", directory)
+
+
+def get_profile_directory():
+    """Get the profile directory (a string or :data:`None` when profiling isn't enabled)."""
+    return os.environ.get(PROFILE_DIRECTORY_VARIABLE) or None
+
+
+def start_profiler():
+    """
+    Start profiling (if enabled).
+
+    :returns: A :class:`cProfile.Profile` object or :data:`None` when
+              profiling isn't enabled (see :func:`enable_profiling()`).
+    """
+    if get_profile_directory():
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+
+
+def save_profile(profiler, label):
+    """
+    Stop profiling and save the collected statistics.
+
+    :param profiler: The return value of :func:`start_profiler()`.
+    :param label: A short description of what was profiled (a string, used
+                  to generate the filename of the statistics).
+    """
+    if profiler is not None:
+        profiler.disable()
+        filename = os.path.join(
+            get_profile_directory(), "%s-%i-%s.prof" % (label, os.getpid(), uuid.uuid4().hex[:8])
+        )
+        profiler.dump_stats(filename)
+        logger.debug("Saved profile statistics to %s.", filename)
+
+
+@contextlib.contextmanager
+def profile_process(label):
+    """
+    Context manager to profile a block of code (if enabled).
+
+    :param label: See :func:`save_profile()`.
+
+    The statistics are saved even when an exception is raised, which matters
+    because processes created by :mod:`multiprocessing` exit using
+    :func:`os._exit()` which means :mod:`atexit` handlers never run.
+    """
+    profiler = start_profiler()
+    try:
+        yield
+    finally:
+        save_profile(profiler, label)
+
+
+def merge_profiles(directory, since=None):
+    """
+    Merge the statistics saved by the processes involved in a synchronization.
+
+    :param directory: The pathname of the profile directory (a string).
+    :param since: Ignore statistics saved before this time (a number like
+                  :func:`time.time()` or :data:`None`).
+    :returns: A :class:`pstats.Stats` object or :data:`None` when no
+              statistics were found.
+    """
+    stats = None
+    filenames = sorted(glob.glob(os.path.join(directory, "*.prof")))
+    for filename in filenames:
+        if since is None or os.path.getmtime(filename) >= since:
+            if stats is None:
+                stats = pstats.Stats(filename, stream=StringIO())
+            else:
+                stats.add(filename)
+    return stats
+
+
+def format_profile(stats, limit=25, sort_key="cumulative"):
+    """
+    Format the most expensive functions in profile statistics.
+
+    :param stats: A :class:`pstats.Stats` object.
+    :param limit: The maximum number of functions to include (an integer).
+    :param sort_key: The :func:`pstats.Stats.sort_stats()` key (a string).
+    :returns: The formatted statistics (a string).
+    """
+    stream = StringIO()
+    stats.stream = stream
+    stats.sort_stats(sort_key).print_stats(limit)
+    return stream.getvalue()
@@ -0,0 +1,181 @@
+# Fast large file synchronization inspired by rsync.
+#
+# Author: Peter Odding <peter@peterodding.com>
+# Last Change: October 18, 2026
+# URL: https://pdiffcopy.readthedocs.io
+
+"""
+Support for standard HTTP range requests (see :rfc:`7233`).
+
+Next to its own ``/blocks`` endpoint the server exposes files using standard
+range requests (see :func:`~pdiffcopy.server.files_resource()`) and the
+client can read blocks from any HTTP server that supports range requests
+(see :attr:`~pdiffcopy.client.Location.range_requests`). This means caching
+reverse proxies can be put in front of a source and plain static file
+servers can be used as a source.
+
+The functions in this module convert between byte ranges (tuples with the
+start and end offset of each range, where the end offset is exclusive, like
+everywhere else in pdiffcopy) and the ``Range``, ``Content-Range`` and
+``multipart/byteranges`` syntax used by HTTP.
+"""
+
+# Standard library modules.
+import re
+
+# Public identifiers that require documentation.
+__all__ = (
+    "format_content_range",
+    "format_etag",
+    "format_range_header",
+    "merge_ranges",
+    "parse_content_range",
+    "parse_multipart_byteranges",
+    "parse_range_header",
+)
+
+# Syntax of a byte range specifier (used by parse_range_header()).
+RANGE_SPEC_PATTERN = re.compile(r"^\s*(\d*)\s*-\s*(\d*)\s*$")
+
+# Syntax of a Content-Range header (used by parse_content_range()).
+CONTENT_RANGE_PATTERN = re.compile(r"^\s*bytes\s+(\d+)-(\d+)/(\d+|\*)\s*$", re.IGNORECASE)
+
+
+def format_content_range(start, end, size):
+    """
+    Format the value of a ``Content-Range`` header.
+
+    :param start: The offset of the first byte in the range (an integer).
+    :param end: The offset just past the last byte in the range (an integer).
+    :param size: The size of the file (an integer).
+    :returns: A string like ``bytes 0-1023/4096``.
+    """
+    return "bytes %i-%i/%i" % (start, end - 1, size)
+
+
+def format_etag(info):
+    """
+    Generate an entity tag for a file.
+
+    :param info: The result of :func:`os.stat()`.
+    :returns: A quoted string that changes whenever the inode number, size or
+              last modification time of the file changes.
+    """
+    return '"%x-%x-%x"' % (info.st_ino, info.st_size, int(info.st_mtime * 1e9))
+
+
+def format_range_header(ranges):
+    """
+    Format the value of a ``Range`` header.
+
+    :param ranges: A list of tuples with two integers each (the start and end offset of a byte range).
+    :returns: A string like ``bytes=0-1023,4096-5119``.
+
+    Adjacent byte ranges are merged (see :func:`merge_ranges()`), because
+    servers may merge them anyway (and some servers refuse requests with
+    many small ranges).
+    """
+    return "bytes=" + ",".join("%i-%i" % (start, end - 1) for start, end in merge_ranges(ranges))
+
+
+def merge_ranges(ranges):
+    """
+    Merge adjacent and overlapping byte ranges.
+
+    :param ranges: A list of tuples with two integers each (the start and end offset of a byte range).
+    :returns: A sorted list of tuples with two integers each.
+    """
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(end, merged[-1][1]))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def parse_content_range(value):
+    """
+    Parse the value of a ``Content-Range`` header.
+
+    :param value: The value of the header (a string).
+    :returns: A tuple with three integers (the start and end offset of the
+              byte range and the size of the file, which is :data:`None`
+              when the server doesn't know the size).
+    :raises: :exc:`~exceptions.ValueError` when the value can't be parsed.
+    """
+    match = CONTENT_RANGE_PATTERN.match(value or "")
+    if not match:
+        raise ValueError("Invalid Content-Range header! (%r)" % value)
+    first, last, size = match.groups()
+    return int(first), int(last) + 1, None if size == "*" else int(size)
+
+
+def parse_multipart_byteranges(content_type, body):
+    """
+    Parse a ``multipart/byteranges`` response body.
+
+    :param content_type: The value of the ``Content-Type`` header (a string).
+    :param body: The response body (a byte string).
+    :returns: A list of tuples with two values each (the offset of the first
+              byte in the part and the contents of the part).
+    :raises: :exc:`~exceptions.ValueError` when the body can't be parsed.
+    """
+    match = re.search(r'boundary="?([^";]+)"?', content_type or "")
+    if not match:
+        raise ValueError("Missing boundary in multipart response! (%r)" % content_type)
+    delimiter = b"--" + match.group(1).encode("ascii")
+    parts = []
+    position = body.find(delimiter)
+    while position >= 0:
+        position += len(delimiter)
+        if body[position:position + 2] == b"--":
+            return parts
+        header_end = body.find(b"\r\n\r\n", position)
+        if header_end < 0:
+            break
+        headers = body[position:header_end].decode("latin-1")
+        match = re.search(r"^content-range:(.*)$", headers, re.IGNORECASE | re.MULTILINE)
+        if not match:
+            raise ValueError("Missing Content-Range header in multipart response!")
+        start, end, size = parse_content_range(match.group(1))
+        data_start = header_end + 4
+        data = body[data_start:data_start + end - start]
+        if len(data) != end - start:
+            break
+        parts.append((start, data))
+        position = body.find(delimiter, data_start + len(data))
+    raise ValueError("Truncated multipart response!")
+
+
+def parse_range_header(value, size):
+    """
+    Parse the value of a ``Range`` header.
+
+    :param value: The value of the header (a string).
+    :param size: The size of the file (an integer).
+    :returns: A list of tuples with two integers each (the start and end
+              offset of a byte range), an empty list when none of the ranges
+              can be satisfied or :data:`None` when the header is invalid
+              (in which case :rfc:`7233` says it should be ignored).
+    """
+    unit, _, specs = (value or "").partition("=")
+    if unit.strip().lower() != "bytes":
+        return None
+    ranges = []
+    for spec in specs.split(","):
+        match = RANGE_SPEC_PATTERN.match(spec)
+        if not match or not any(match.groups()):
+            return None
+        first, last = match.groups()
+        if not first:
+            # A suffix range selects the last N bytes of the file.
+            start, end = max(0, size - int(last)), size
+        elif last and int(last) < int(first):
+            return None
+        else:
+            start = int(first)
+            end = min(size, int(last) + 1) if last else size
+        if start < end:
+            ranges.append((start, end))
+    return ranges
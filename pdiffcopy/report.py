@@ -0,0 +1,198 @@
+# Fast large file synchronization inspired by rsync.
+#
+# Author: Peter Odding <peter@peterodding.com>
+# Last Change: October 18, 2026
+# URL: https://pdiffcopy.readthedocs.io
+
+"""Machine readable performance reports of synchronization runs."""
+
+# Standard library modules.
+import contextlib
+import json
+import math
+import random
+import sys
+
+# External dependencies.
+from humanfriendly import Timer
+from property_manager import PropertyManager, lazy_property, mutable_property
+
+# Public identifiers that require documentation.
+__all__ = ("PHASES", "PerformanceReport", "compute_percentiles")
+
+PHASES = ("metadata", "source_hashing", "target_hashing", "comparison", "resize", "transfer", "verification", "sync")
+"""The names of the phases that are timed by :class:`PerformanceReport` (a tuple of strings)."""
+
+
+class PerformanceReport(PropertyManager):
+
+    """
+    Timings and counters collected by :class:`~pdiffcopy.client.Client` during a synchronization run.
+
+    The report can be converted to a dictionary using :func:`as_dict()` and
+    saved as JSON using :func:`save()`, which makes it easy to aggregate and
+    compare the performance of synchronization runs over time.
+    """
+
+    @mutable_property
+    def blocks_changed(self):
+        """The number of blocks that differed (an integer)."""
+        return 0
+
+    @mutable_property
+    def blocks_total(self):
+        """The number of blocks in the source (an integer)."""
+        return 0
+
+    @mutable_property
+    def bytes_copied(self):
+        """The number of bytes copied within the target instead of being transferred (an integer)."""
+        return 0
+
+    @mutable_property
+    def bytes_transferred(self):
+        """The number of bytes copied from source to target (an integer)."""
+        return 0
+
+    @lazy_property
+    def bytes_hashed(self):
+        """A dictionary with the number of bytes hashed on the ``source`` and ``target`` sides."""
+        return dict(source=0, target=0)
+
+    @lazy_property
+    def latencies(self):
+        """A list with a uniform sample of block transfer latencies in seconds (see :func:`record_latency()`)."""
+        return []
+
+    @mutable_property
+    def max_samples(self):
+        """The maximum number of latency samples kept in memory (an integer, defaults to 100000)."""
+        return 100000
+
+    @lazy_property
+    def metadata(self):
+        """A dictionary with information about the run (source, target, block size, etc.)."""
+        return {}
+
+    @mutable_property
+    def num_latencies(self):
+        """The total number of latencies that were recorded (an integer)."""
+        return 0
+
+    @lazy_property
+    def phases(self):
+        """A dictionary with the time spent in each phase (see :data:`PHASES`) in seconds."""
+        return dict((name, 0.0) for name in PHASES)
+
+    @mutable_property
+    def similarity(self):
+        """The similarity between source and target as a percentage (a float or :data:`None`)."""
+
+    @lazy_property
+    def total_timer(self):
+        """A :class:`~humanfriendly.Timer` that measures the total runtime."""
+        return Timer()
+
+    @lazy_property
+    def utilization(self):
+        """A dictionary with worker utilization (ratios between 0 and 1) by phase."""
+        return {}
+
+    def add_time(self, phase, seconds):
+        """
+        Add to the time spent in a phase.
+
+        :param phase: The name of a phase (one of the strings in :data:`PHASES`).
+        :param seconds: The number of seconds to add (a number).
+        """
+        self.phases[phase] += seconds
+
+    @contextlib.contextmanager
+    def measure(self, phase):
+        """Context manager to measure the time spent in a phase (see :func:`add_time()`)."""
+        timer = Timer()
+        try:
+            yield
+        finally:
+            self.add_time(phase, timer.elapsed_time)
+
+    def record_latency(self, seconds):
+        """
+        Record the latency of a block transfer.
+
+        :param seconds: The latency in seconds (a number).
+
+        To keep memory usage bounded for very large files, reservoir sampling
+        is used to keep a uniform sample of at most :attr:`max_samples`
+        latencies (percentiles computed from such a sample are accurate
+        enough for the purpose of tracking performance over time).
+        """
+        self.num_latencies += 1
+        if len(self.latencies) < self.max_samples:
+            self.latencies.append(seconds)
+        else:
+            index = random.randint(0, self.num_latencies - 1)
+            if index < self.max_samples:
+                self.latencies[index] = seconds
+
+    def as_dict(self):
+        """
+        Convert the report to a dictionary.
+
+        :returns: A JSON serializable dictionary.
+        """
+        phases = dict(self.phases)
+        phases["total"] = self.total_timer.elapsed_time
+        block_latency = compute_percentiles(self.latencies)
+        block_latency["count"] = self.num_latencies
+        return dict(
+            metadata=self.metadata,
+            phases=phases,
+            bytes_copied=self.bytes_copied,
+            bytes_hashed=self.bytes_hashed,
+            bytes_transferred=self.bytes_transferred,
+            blocks=dict(total=self.blocks_total, changed=self.blocks_changed),
+            similarity=self.similarity,
+            block_latency=block_latency,
+            utilization=self.utilization,
+        )
+
+    def save(self, filename):
+        """
+        Save the report as JSON.
+
+        :param filename: The pathname of the JSON file (a string) or the
+                         string ``-`` to write to standard output.
+        """
+        encoded = json.dumps(self.as_dict(), indent=2, sort_keys=True)
+        if filename == "-":
+            sys.stdout.write(encoded + "\n")
+        else:
+            with open(filename, "w") as handle:
+                handle.write(encoded + "\n")
+
+
+def compute_percentiles(values, percentiles=(50, 90, 99)):
+    """
+    Summarize a list of numbers using percentiles.
+
+    :param values: A list of numbers.
+    :param percentiles: The percentiles to compute (a tuple of integers).
+    :returns: A dictionary with the keys ``p50``, ``p90``, ``p99`` (based on
+              `percentiles`), ``min``, ``max``, ``mean`` and ``count``. When
+              `values` is empty the statistics are :data:`None`.
+    """
+    result = dict(count=len(values))
+    ordered = sorted(values)
+    for p in percentiles:
+        key = "p%i" % p
+        if ordered:
+            # Nearest rank method.
+            rank = max(1, int(math.ceil(p / 100.0 * len(ordered))))
+            result[key] = ordered[rank - 1]
+        else:
+            result[key] = None
+    result["min"] = ordered[0] if ordered else None
+    result["max"] = ordered[-1] if ordered else None
+    result["mean"] = sum(ordered) / len(ordered) if ordered else None
+    return result
@@ -1,35 +1,80 @@
 # Fast large file synchronization inspired by rsync.
 #
 # Author: Peter Odding <peter@peterodding.com>
-# Last Change: March 6, 2020
+# Last Change: October 18, 2026
 # URL: https://pdiffcopy.readthedocs.io
 
 """Parallel, differential file copy server."""
 
 # Standard library modules.
+import hashlib
+import itertools
+import email.utils
+import json
 import logging
+import os
+import stat
+import uuid
 
 # External dependencies.
-from flask import Flask, Response, jsonify, request
+from flask import Flask, Response, g, jsonify, request
 from gunicorn.app.base import BaseApplication
+from humanfriendly import Timer, coerce_boolean, format_size
+from humanfriendly.text import pluralize
 from six import iteritems
 from six.moves.urllib.parse import urlparse
 
 # Modules included in our package.
 from pdiffcopy import BLOCK_SIZE, DEFAULT_CONCURRENCY, DEFAULT_PORT
-from pdiffcopy.hashing import compute_hashes
-from pdiffcopy.operations import get_file_info, read_block, resize_file, write_block
+from pdiffcopy.cache import BlockCache
+from pdiffcopy.client import Location, compare_hashes
+from pdiffcopy.digests import DigestArray, find_moves
+from pdiffcopy.hashing import compute_hashes, decode_hash, encode_hash, unpack_hashes
+from pdiffcopy.metrics import MetricsRegistry
+from pdiffcopy.mp import Promise
+from pdiffcopy.operations import (
+    DEFAULT_SYNC_INTERVAL,
+    copy_blocks,
+    get_file_info,
+    list_files,
+    read_block,
+    resize_file,
+    set_mtime,
+    sync_file,
+    write_block,
+)
+from pdiffcopy.profiling import save_profile, start_profiler
+from pdiffcopy.ranges import format_content_range, format_etag, parse_range_header
+from pdiffcopy.tracing import begin_span, end_span, set_process_name
 
 # Public identifiers that require documentation.
 __all__ = (
     "app",
+    "block_cache",
     "blocks_resource",
+    "collect_hashes",
+    "compare_action",
+    "copy_action",
+    "files_resource",
     "generate_hashes",
+    "generate_ranges",
+    "get_endpoint",
     "hashes_resource",
     "info_resource",
+    "initialize_worker",
+    "list_resource",
     "logger",
+    "metrics",
+    "metrics_resource",
+    "pull_action",
+    "pull_blocks",
+    "read_cached_block",
+    "record_request_metrics",
     "resize_action",
+    "start_request_timer",
     "start_server",
+    "sync_action",
+    "utime_action",
 )
 
 # Initialize a logger for this module.
@@ -38,9 +83,90 @@ logger = logging.getLogger(__name__)
 # Initialize a Flask application.
 app = Flask(__name__)
 
+# Initialize the metrics exposed by the server. This needs to happen before
+# gunicorn forks its worker processes, so that the metrics are aggregated
+# across all worker processes (see :mod:`pdiffcopy.metrics` for details).
+metrics = MetricsRegistry()
+ENDPOINTS = (
+    "blocks",
+    "compare",
+    "copy",
+    "files",
+    "hashes",
+    "info",
+    "list",
+    "metrics",
+    "pull",
+    "resize",
+    "sync",
+    "utime",
+)
+FILES_CHUNK_SIZE = 1024 * 1024
+HASH_METHODS = tuple(sorted(hashlib.algorithms_guaranteed))
+request_counter = metrics.counter(
+    "pdiffcopy_requests_total", "Number of HTTP requests handled.", label="endpoint", label_values=ENDPOINTS
+)
+request_latency = metrics.histogram(
+    "pdiffcopy_request_duration_seconds",
+    "Time spent handling HTTP requests (including streaming of responses).",
+    label="endpoint",
+    label_values=ENDPOINTS,
+)
+bytes_read = metrics.counter("pdiffcopy_read_bytes_total", "Number of bytes read from files for clients.")
+bytes_written = metrics.counter("pdiffcopy_written_bytes_total", "Number of bytes written to files for clients.")
+bytes_copied = metrics.counter("pdiffcopy_copied_bytes_total", "Number of bytes copied within files for clients.")
+bytes_pulled = metrics.counter(
+    "pdiffcopy_pulled_bytes_total", "Number of bytes pulled from other servers (included in the written bytes)."
+)
+hashed_bytes = metrics.counter(
+    "pdiffcopy_hashed_bytes_total", "Number of bytes hashed.", label="method", label_values=HASH_METHODS
+)
+hashing_seconds = metrics.counter(
+    "pdiffcopy_hashing_seconds_total",
+    "Wall clock time spent by hashing jobs (divide hashed bytes by this to get throughput).",
+    label="method",
+    label_values=HASH_METHODS,
+)
+active_hashing_jobs = metrics.gauge("pdiffcopy_active_hashing_jobs", "Number of hashing jobs in progress.")
+pool_workers = metrics.gauge("pdiffcopy_pool_workers", "Number of hashing worker processes.")
+busy_workers = metrics.gauge(
+    "pdiffcopy_pool_busy_workers", "Number of hashing worker processes that are hashing a block right now."
+)
+cache_hits = metrics.counter("pdiffcopy_block_cache_hits_total", "Number of blocks read from the block cache.")
+cache_misses = metrics.counter(
+    "pdiffcopy_block_cache_misses_total", "Number of cacheable blocks that weren't in the block cache."
+)
+cache_evictions = metrics.counter(
+    "pdiffcopy_block_cache_evictions_total", "Number of blocks evicted from the block cache to make room."
+)
+cache_capacity = metrics.gauge("pdiffcopy_block_cache_capacity_bytes", "Size of the block cache in bytes.")
+
+# The block cache shared by the worker processes (allocated by start_server()).
+block_cache = BlockCache()
+
+
+def start_server(address=None, concurrency=4, cache_size=0):
+    """
+    Start a multi threaded ``pdiffcopy`` HTTP server using :pypi:`gunicorn` and :pypi:`flask`.
 
-def start_server(address=None, concurrency=4):
-    """Start a multi threaded ``pdiffcopy`` HTTP server using :pypi:`gunicorn` and :pypi:`flask`."""
+    :param address: The IP address and/or port number to listen on (a string or :data:`None`).
+    :param concurrency: The number of worker processes (an integer).
+    :param cache_size: The size of the block cache in bytes (an integer,
+                       defaults to zero which disables the cache, see
+                       :mod:`pdiffcopy.cache`).
+    """
+    if cache_size:
+        # Allocate the shared memory before gunicorn forks its worker processes.
+        block_cache.capacity = cache_size
+        block_cache.allocate()
+        num_slots = block_cache.set_count * block_cache.set_size
+        cache_capacity.set(num_slots * block_cache.slot_size)
+        logger.info(
+            "Allocated block cache of %s (%s of %s).",
+            format_size(num_slots * block_cache.slot_size, binary=True),
+            pluralize(num_slots, "slot"),
+            format_size(block_cache.slot_size, binary=True),
+        )
     if address:
         if address.isdigit():
             # Only a port number was given.
@@ -60,35 +186,248 @@ def start_server(address=None, concurrency=4):
         listen_host = ""
         listen_port = DEFAULT_PORT
     StandaloneApplication(
-        app, {"bind": "%s:%s" % (listen_host, listen_port), "timeout": 0, "workers": concurrency}
+        app,
+        {
+            "bind": "%s:%s" % (listen_host, listen_port),
+            "post_fork": initialize_worker,
+            "timeout": 0,
+            "workers": concurrency,
+        },
     ).run()
 
 
+def initialize_worker(server, worker):
+    """Initialize a :pypi:`gunicorn` worker process (called after the worker is forked)."""
+    set_process_name("Server worker")
+
+
+@app.before_request
+def start_request_timer():
+    """
+    Start measuring the time spent on a request (see :func:`record_request_metrics()`).
+
+    When profiling is enabled (see :mod:`pdiffcopy.profiling`) each request
+    is profiled separately, including the streaming of the response. When
+    tracing is enabled (see :mod:`pdiffcopy.tracing`) a span is recorded for
+    each request.
+    """
+    g.profiler = start_profiler()
+    g.span = begin_span(get_endpoint(), "http", **request.args.to_dict())
+    g.timer = Timer()
+
+
+@app.after_request
+def record_request_metrics(response):
+    """Update the request metrics once a response has been sent."""
+    endpoint = get_endpoint()
+    profiler = g.profiler
+    event = g.span
+    timer = g.timer
+
+    def record():
+        request_counter.inc(label_value=endpoint)
+        request_latency.observe(timer.elapsed_time, label_value=endpoint)
+        save_profile(profiler, "request-%s" % (endpoint or "index"))
+        end_span(event)
+
+    response.call_on_close(record)
+    return response
+
+
 @app.route("/blocks", methods=["GET", "POST"])
 def blocks_resource():
     """Flask view to read or write a block of data."""
     filename = request.args["filename"]
     offset = int(request.args["offset"])
     if request.method == "GET":
-        data = read_block(filename, offset, int(request.args["size"]))
+        data = read_cached_block(filename, offset, int(request.args["size"]), request.args.get("io_mode", "buffered"))
+        bytes_read.inc(len(data))
         return Response(status=200, response=data, mimetype="application/octet-stream")
     elif request.method == "POST":
-        write_block(filename, offset, request.data)
+        write_block(
+            filename,
+            offset,
+            request.data,
+            durability=request.args.get("durability", "none"),
+            sync_interval=int(request.args.get("sync_interval", DEFAULT_SYNC_INTERVAL)),
+        )
+        block_cache.invalidate(filename)
+        bytes_written.inc(len(request.data))
         return Response(status=200)
     else:
         return Response(status=405)
 
 
-@app.route("/hashes")
+@app.route("/compare", methods=["POST"])
+def compare_action():
+    """
+    Flask view to compare the hashes of a file on the server with hashes uploaded by the client.
+
+    The query string parameters are the same as for :func:`hashes_resource()`
+    with the addition of ``side`` which tells the server whether its file is
+    the 'source' or the 'target' of the synchronization. The request body
+    starts with a line containing a JSON object (with an optional ``ranges``
+    key, like for :func:`hashes_resource()`) followed by the hashes of the
+    client's file encoded using :func:`~pdiffcopy.hashing.pack_hash()`.
+
+    The server hashes its own file while the client's hashes are being
+    received and then responds with the offsets and source hashes of the
+    blocks that need to be transferred (one per line, encoded using
+    :func:`~pdiffcopy.hashing.encode_hash()`) followed by a line with the
+    text ``similarity=`` and the similarity of the two files. This means the
+    client never needs to download or keep the complete list of hashes.
+
+    When the query string parameter ``moves`` is true the response also
+    contains a line with the text ``move=`` followed by two offsets
+    (separated by a tab) for each changed block whose contents can be copied
+    from another offset in the target (see :func:`~pdiffcopy.digests.find_moves()`).
+    """
+    side = request.args.get("side", "target")
+    if side not in ("source", "target"):
+        return Response(status=400, response="Invalid side! (expected 'source' or 'target')\n")
+    header = json.loads(request.stream.readline())
+    options = dict(
+        autotune=coerce_boolean(request.args.get("autotune", "false")),
+        block_size=int(request.args.get("block_size", BLOCK_SIZE)),
+        concurrency=int(request.args.get("concurrency", DEFAULT_CONCURRENCY)),
+        filename=request.args.get("filename"),
+        io_mode=request.args.get("io_mode", "buffered"),
+        method=request.args.get("method"),
+        ranges=header.get("ranges"),
+        schedule=request.args.get("schedule", "blocks"),
+    )
+    promise = Promise(target=collect_hashes, kwargs=options)
+    client_hashes = DigestArray(block_size=options["block_size"], method=options["method"])
+    client_hashes.update(unpack_hashes(request.stream, options["method"]))
+    server_hashes = promise.join()
+    source_hashes, target_hashes = (
+        (server_hashes, client_hashes) if side == "source" else (client_hashes, server_hashes)
+    )
+    todo, similarity = compare_hashes(source_hashes, target_hashes)
+    lines = (encode_hash(offset, source_hashes[offset]) for offset in todo)
+    moves = find_moves(source_hashes, target_hashes, todo) if coerce_boolean(request.args.get("moves", "false")) else []
+    return Response(
+        mimetype="text/plain",
+        response=itertools.chain(
+            lines,
+            ("move=%i\t%i\n" % move for move in moves),
+            ["similarity=%s\n" % similarity],
+        ),
+        status=200,
+    )
+
+
+@app.route("/copy", methods=["POST"])
+def copy_action():
+    """
+    Flask view to copy blocks to other offsets within a file on the server.
+
+    The request body is expected to contain a JSON object with a ``copies``
+    key whose value is a list of pairs of offsets (see
+    :func:`~pdiffcopy.operations.copy_blocks()`).
+    """
+    copied = copy_blocks(
+        request.args["filename"],
+        request.get_json()["copies"],
+        int(request.args["size"]),
+        durability=request.args.get("durability", "none"),
+        sync_interval=int(request.args.get("sync_interval", DEFAULT_SYNC_INTERVAL)),
+    )
+    block_cache.invalidate(request.args["filename"])
+    bytes_copied.inc(copied)
+    return Response(status=200)
+
+
+@app.route("/files/<path:filename>", methods=["GET", "HEAD"])
+def files_resource(filename):
+    """
+    Flask view to read a file using standard HTTP range requests (see :mod:`pdiffcopy.ranges`).
+
+    The URL path following ``/files`` is the absolute pathname of the file.
+    A ``Range`` header with one byte range results in a partial response with
+    a ``Content-Range`` header while multiple byte ranges result in a
+    ``multipart/byteranges`` response. The ``ETag`` and ``Last-Modified``
+    headers enable caching proxies to revalidate cached responses (using
+    ``If-None-Match``) and ``If-Range`` makes sure ranges of different
+    versions of the file are never combined.
+    """
+    filename = "/" + filename
+    try:
+        info = os.stat(filename)
+    except OSError:
+        return Response(status=404)
+    if not stat.S_ISREG(info.st_mode):
+        return Response(status=404)
+    etag = format_etag(info)
+    last_modified = email.utils.formatdate(info.st_mtime, usegmt=True)
+    headers = {
+        "Accept-Ranges": "bytes",
+        # Caches may store responses but need to revalidate them before
+        # reuse, because files are updated in place by synchronizations.
+        "Cache-Control": "public, no-cache",
+        "ETag": etag,
+        "Last-Modified": last_modified,
+    }
+    if_none_match = request.headers.get("If-None-Match")
+    if if_none_match and (if_none_match.strip() == "*" or etag in [t.strip() for t in if_none_match.split(",")]):
+        return Response(status=304, headers=headers)
+    ranges = parse_range_header(request.headers.get("Range"), info.st_size)
+    if ranges is not None and request.headers.get("If-Range", etag) not in (etag, last_modified):
+        # The client's copy of the file is outdated, so it needs the whole file.
+        ranges = None
+    if ranges is None:
+        headers["Content-Length"] = str(info.st_size)
+        return Response(
+            status=200,
+            headers=headers,
+            mimetype="application/octet-stream",
+            response=generate_ranges(filename, [(0, info.st_size)]),
+        )
+    if not ranges:
+        headers["Content-Range"] = "bytes */%i" % info.st_size
+        return Response(status=416, headers=headers)
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        headers["Content-Length"] = str(end - start)
+        headers["Content-Range"] = format_content_range(start, end, info.st_size)
+        return Response(
+            status=206,
+            headers=headers,
+            mimetype="application/octet-stream",
+            response=generate_ranges(filename, ranges),
+        )
+    boundary = uuid.uuid4().hex
+    parts = list(generate_ranges(filename, ranges, info.st_size, boundary, headers_only=True))
+    headers["Content-Length"] = str(sum(len(p) for p in parts) + sum(end - start for start, end in ranges))
+    return Response(
+        status=206,
+        headers=headers,
+        content_type="multipart/byteranges; boundary=%s" % boundary,
+        response=generate_ranges(filename, ranges, info.st_size, boundary),
+    )
+
+
+@app.route("/hashes", methods=["GET", "POST"])
 def hashes_resource():
-    """Flask view to get the hashes of a file."""
+    """
+    Flask view to get the hashes of a file.
+
+    When the request method is POST the request body is expected to contain a
+    JSON object with a ``ranges`` key, in which case only the blocks within
+    those byte ranges are hashed (see :func:`~pdiffcopy.hashing.compute_hashes()`).
+    """
+    ranges = request.get_json()["ranges"] if request.method == "POST" else None
     return Response(
         mimetype="text/plain",
         response=generate_hashes(
+            autotune=coerce_boolean(request.args.get("autotune", "false")),
             block_size=int(request.args.get("block_size", BLOCK_SIZE)),
             concurrency=int(request.args.get("concurrency", DEFAULT_CONCURRENCY)),
             filename=request.args.get("filename"),
+            io_mode=request.args.get("io_mode", "buffered"),
             method=request.args.get("method"),
+            ranges=ranges,
+            schedule=request.args.get("schedule", "blocks"),
         ),
         status=200,
     )
@@ -105,25 +444,186 @@ def info_resource():
         return Response(status=404)
 
 
+@app.route("/list")
+def list_resource():
+    """Flask view to list the files in a directory tree on the server."""
+    return jsonify(files=list_files(request.args.get("directory")))
+
+
+@app.route("/metrics")
+def metrics_resource():
+    """Flask view to expose server metrics in the Prometheus text format."""
+    return Response(status=200, response=metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/pull", methods=["POST"])
+def pull_action():
+    """
+    Flask view to copy blocks from another server directly into a file on this server.
+
+    The request body is expected to contain a JSON object with an ``offsets``
+    key whose value is a list of byte offsets. The ``source`` parameter is the
+    location expression of the file on the other server (see
+    :attr:`pdiffcopy.client.Location.expression`). The response contains the
+    offset of each block that was written (one per line).
+    """
+    return Response(
+        mimetype="text/plain",
+        response=pull_blocks(
+            block_size=int(request.args["block_size"]),
+            durability=request.args.get("durability", "none"),
+            filename=request.args["filename"],
+            io_mode=request.args.get("io_mode", "buffered"),
+            offsets=request.get_json()["offsets"],
+            source=request.args["source"],
+            sync_interval=int(request.args.get("sync_interval", DEFAULT_SYNC_INTERVAL)),
+        ),
+        status=200,
+    )
+
+
 @app.route("/resize", methods=["POST"])
 def resize_action():
     """Flask view to create or resize_action a file on the server."""
     fn = request.args.get("filename")
     size = int(request.args.get("size"))
     resize_file(fn, size)
+    block_cache.invalidate(fn)
+    return Response(status=200)
+
+
+@app.route("/sync", methods=["POST"])
+def sync_action():
+    """Flask view to make sure a file on the server has been written to disk."""
+    sync_file(request.args.get("filename"))
     return Response(status=200)
 
 
+@app.route("/utime", methods=["POST"])
+def utime_action():
+    """Flask view to change the last modification time of a file on the server."""
+    fn = request.args.get("filename")
+    mtime = float(request.args.get("mtime"))
+    set_mtime(fn, mtime)
+    return Response(status=200)
+
+
+def collect_hashes(**options):
+    """
+    Helper for :func:`compare_action()`.
+
+    :param options: See :func:`~pdiffcopy.hashing.compute_hashes()`.
+    :returns: A :class:`~pdiffcopy.digests.DigestArray` object.
+    """
+    hashes = DigestArray(block_size=options["block_size"], method=options["method"])
+    hashes.update(decode_hash(line) for line in generate_hashes(**options))
+    return hashes
+
+
+def generate_ranges(filename, ranges, size=None, boundary=None, headers_only=False):
+    """
+    Helper for :func:`files_resource()`.
+
+    :param filename: The pathname of the file to read (a string).
+    :param ranges: A list of tuples with two integers each (the start and end offset of a byte range).
+    :param size: The size of the file (an integer, only required when `boundary` is given).
+    :param boundary: The boundary of a ``multipart/byteranges`` response (a
+                     string or :data:`None` to generate the byte ranges
+                     without any framing).
+    :param headers_only: :data:`True` to generate the multipart framing
+                         without the data (used to compute the content length).
+    :returns: A generator of byte strings.
+    """
+    for start, end in ranges:
+        if boundary:
+            yield (
+                "--%s\r\nContent-Type: application/octet-stream\r\nContent-Range: %s\r\n\r\n"
+                % (boundary, format_content_range(start, end, size))
+            ).encode("ascii")
+        if not headers_only:
+            for offset in range(start, end, FILES_CHUNK_SIZE):
+                data = read_cached_block(filename, offset, min(FILES_CHUNK_SIZE, end - offset))
+                bytes_read.inc(len(data))
+                yield data
+        if boundary:
+            yield b"\r\n"
+    if boundary:
+        yield ("--%s--\r\n" % boundary).encode("ascii")
+
+
 def generate_hashes(**options):
     """
     Helper for :func:`hashes_resource()`.
 
     :param options: See :func:`~pdiffcopy.hashing.compute_hashes()`.
-    :returns: A generator of strings, one line each, with two fields per
-              line (offset and digest) delimited by a tab character.
+    :returns: A generator of strings, one line each (see :func:`~pdiffcopy.hashing.encode_hash()`).
+    """
+    timer = Timer()
+    num_bytes = 0
+    file_size = os.path.getsize(options["filename"])
+    active_hashing_jobs.inc()
+    pool_workers.inc(options["concurrency"])
+    try:
+        for offset, digest in compute_hashes(busy_counter=busy_workers, **options):
+            num_bytes += min(options["block_size"], file_size - offset)
+            yield encode_hash(offset, digest)
+    finally:
+        active_hashing_jobs.dec()
+        pool_workers.dec(options["concurrency"])
+        hashed_bytes.inc(num_bytes, label_value=options["method"])
+        hashing_seconds.inc(timer.elapsed_time, label_value=options["method"])
+
+
+def pull_blocks(source, filename, offsets, block_size, **options):
     """
-    for offset, digest in compute_hashes(**options):
-        yield "%i\t%s\n" % (offset, digest)
+    Helper for :func:`pull_action()`.
+
+    :param source: The location expression of the file to copy blocks from (a string).
+    :param filename: The pathname of the file to copy blocks to (a string).
+    :param offsets: A list of integers with the byte offsets of the blocks to copy.
+    :param block_size: The size of each block in bytes (an integer).
+    :param options: The keyword arguments `io_mode`, `durability` and
+                    `sync_interval` (see :func:`Location.write_block() <pdiffcopy.client.Location.write_block()>`).
+    :returns: A generator of strings, one line for each block that was copied.
+    """
+    source = Location(expression=source)
+    try:
+        for offset, data in source.read_blocks(offsets, block_size, options["io_mode"]):
+            write_block(filename, offset, data, options["durability"], options["sync_interval"])
+            bytes_pulled.inc(len(data))
+            bytes_written.inc(len(data))
+            yield "%i\n" % offset
+    finally:
+        block_cache.invalidate(filename)
+
+
+def read_cached_block(filename, offset, size, io_mode="buffered"):
+    """
+    Read a block of data using the :data:`block_cache` (when enabled).
+
+    :param filename: The pathname of the file (a string).
+    :param offset: The byte offset where reading starts (an integer).
+    :param size: The number of bytes to read (an integer).
+    :param io_mode: See :func:`~pdiffcopy.operations.read_block()`.
+    :returns: The data of the block (a byte string).
+    """
+    if not block_cache.enabled or size > block_cache.slot_size:
+        return read_block(filename, offset, size, io_mode)
+    key = block_cache.get_key(filename, offset, size)
+    data = block_cache.get(key)
+    if data is not None:
+        cache_hits.inc()
+        return data
+    cache_misses.inc()
+    data = read_block(filename, offset, size, io_mode)
+    if block_cache.put(key, data):
+        cache_evictions.inc()
+    return data
+
+
+def get_endpoint():
+    """Get the name of the endpoint of the current request (the first component of the URL path, a string)."""
+    return request.path.strip("/").partition("/")[0]
 
 
 class StandaloneApplication(BaseApplication):
@@ -1,7 +1,7 @@
 # Fast large file synchronization inspired by rsync.
 #
 # Author: Peter Odding <peter@peterodding.com>
-# Last Change: March 6, 2020
+# Last Change: October 18, 2026
 # URL: https://pdiffcopy.readthedocs.io
 
 
@@ -10,24 +10,59 @@
 # Standard library modules.
 import filecmp
 import functools
+import io
+import json
 import logging
 import os
+import pickle
 import random
 import sys
 import tempfile
+import threading
+import time
 
 # External dependencies.
+import requests
 from executor import execute
 from executor.tcp import EphemeralTCPServer
 from humanfriendly.text import format
 from humanfriendly.testing import TemporaryDirectory, TestCase, run_cli
-from property_manager import PropertyManager, lazy_property, required_property
+from property_manager import PropertyManager, lazy_property, required_property, set_property
+from six.moves.BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
 
 # Modules included in our package.
+from pdiffcopy import digests
+from pdiffcopy.benchmark import PATTERNS, BenchmarkSuite
+from pdiffcopy.cache import BlockCache
 from pdiffcopy.cli import main
-from pdiffcopy.client import Location
-from pdiffcopy.hashing import compute_hashes
-from pdiffcopy.mp import WorkerPool
+from pdiffcopy.client import (
+    Client,
+    Location,
+    compare_hashes,
+    generate_batches,
+    select_block_size,
+    select_samples,
+)
+from pdiffcopy.hashing import compute_hashes, decode_hash, encode_hash, generate_stripes, pack_hash, unpack_hashes
+from pdiffcopy.journal import Journal
+from pdiffcopy.microbench import compare_results, run_microbenchmarks
+from pdiffcopy.mp import ConcurrencyTuner, WorkerPool
+from pdiffcopy.operations import (
+    DURABILITY_POLICIES,
+    IO_MODES,
+    clone_file,
+    copy_block,
+    copy_blocks,
+    read_block,
+    unsynced_bytes,
+    write_block,
+)
+from pdiffcopy.profiling import PROFILE_DIRECTORY_VARIABLE
+from pdiffcopy.ranges import format_content_range, format_range_header, parse_multipart_byteranges, parse_range_header
+from pdiffcopy.report import PHASES
+from pdiffcopy.server import app
+from pdiffcopy.tracing import TRACE_DIRECTORY_VARIABLE, enable_tracing
+from pdiffcopy.watch import MODIFIED, REPLACED, FileWatcher
 
 # Initialize a logger for this module.
 logger = logging.getLogger(__name__)
@@ -123,6 +158,250 @@ class TestSuite(TestCase):
             )
             assert serial_hashes == parallel_hashes
 
+    def test_stripe_schedule(self):
+        """Test that stripe scheduling produces the same hashes as block scheduling."""
+        with tempfile.NamedTemporaryFile() as temporary_file:
+            execute("dd", "if=/dev/urandom", "of=%s" % temporary_file.name, "bs=100K", "count=10")
+            options = dict(filename=temporary_file.name, block_size=1024 * 64, concurrency=3, method="sha1")
+            block_hashes = dict(compute_hashes(**options))
+            stripe_hashes = dict(compute_hashes(schedule="stripes", **options))
+            assert block_hashes == stripe_hashes
+            assert dict(compute_hashes(io_mode="nocache", schedule="stripes", **options)) == block_hashes
+            ranges = [(0, 1024 * 128), (1024 * 320, 1024 * 2000)]
+            assert dict(compute_hashes(ranges=ranges, **options)) == dict(
+                compute_hashes(ranges=ranges, schedule="stripes", **options)
+            )
+            stripes = list(generate_stripes([(0, 1024 * 1000)], 1024 * 64, 1024 * 1000, 3))
+            # The stripes are contiguous, block aligned and shrink towards the end.
+            assert stripes[0][0] == 0 and stripes[-1][1] == 1024 * 1000
+            assert all(a[1] == b[0] for a, b in zip(stripes, stripes[1:]))
+            assert all(start % (1024 * 64) == 0 for start, end in stripes)
+            assert stripes[0][1] - stripes[0][0] > stripes[-1][1] - stripes[-1][0]
+            with self.assertRaises(ValueError):
+                list(compute_hashes(schedule="bogus", **options))
+
+    def test_digest_arrays(self):
+        """Test the compact storage and comparison of block hashes."""
+        block_size = 1024
+        random.seed(42)
+        source = dict((i * block_size, "%040x" % random.randint(0, 3)) for i in range(500))
+        target = dict((i * block_size, "%040x" % random.randint(0, 3)) for i in range(50, 700) if i % 7)
+        arrays = []
+        for hashes in (source, target):
+            array = digests.DigestArray(block_size=block_size, method="sha1")
+            array.update(hashes.items())
+            assert len(array) == len(hashes)
+            assert dict(array.items()) == hashes
+            assert block_size * 3 not in array or array.get(block_size * 3) == hashes[block_size * 3]
+            arrays.append(array)
+        assert 1 not in arrays[0] and arrays[0].get(1) is None
+        with self.assertRaises(ValueError):
+            arrays[0][1] = "%040x" % 1
+        # The arrays can be returned from child processes.
+        assert dict(pickle.loads(pickle.dumps(arrays[1])).items()) == target
+        expected_todo, expected_similarity = compare_hashes(source, target)
+        saved = digests.numpy, digests.CHUNK_SIZE
+        try:
+            for numpy in set([None, digests.numpy]):
+                for chunk_size in (64, 1024 * 64):
+                    digests.numpy, digests.CHUNK_SIZE = numpy, chunk_size
+                    todo, similarity = compare_hashes(*arrays)
+                    assert list(todo) == expected_todo
+                    assert similarity == expected_similarity
+        finally:
+            digests.numpy, digests.CHUNK_SIZE = saved
+        with self.assertRaises(ValueError):
+            digests.compare_digests(arrays[0], digests.DigestArray(block_size=block_size, method="md5"))
+        # Whole file digests depend on the digests of all blocks.
+        duplicate = arrays[0].copy()
+        assert digests.tree_digest(duplicate) == digests.tree_digest(arrays[0])
+        digest = duplicate[0]
+        del duplicate[0]
+        assert 0 not in duplicate and len(duplicate) == len(source) - 1
+        assert digests.tree_digest(duplicate) != digests.tree_digest(arrays[0])
+        duplicate[0] = digest
+        assert digests.tree_digest(duplicate) == digests.tree_digest(arrays[0])
+
+    def test_directory_sync(self):
+        """Test synchronizing a directory tree from the client to the server."""
+        with Context() as context:
+            source = os.path.join(context.directory.temporary_directory, "source")
+            target = os.path.join(context.directory.temporary_directory, "target")
+            for name, size in (("a.bin", 1024 * 1024 * 3), ("sub/b.bin", 12345), ("sub/deeper/c.bin", 0)):
+                pathname = os.path.join(source, name)
+                if not os.path.isdir(os.path.dirname(pathname)):
+                    os.makedirs(os.path.dirname(pathname))
+                with open(pathname, "wb") as handle:
+                    handle.write(os.urandom(size))
+            # Prepare a target file that partially matches its source file.
+            os.makedirs(target)
+            with open(os.path.join(source, "a.bin"), "rb") as handle:
+                partial_contents = handle.read(1024 * 1024 * 2)
+            with open(os.path.join(target, "a.bin"), "wb") as handle:
+                handle.write(partial_contents)
+            remote_target = format("http://localhost:%i/%s", context.server.port_number, target.lstrip("/"))
+            for i in range(2):
+                returncode, output = run_cli(main, "--recursive", source, remote_target, capture=False)
+                assert returncode == 0
+                comparison = filecmp.dircmp(source, target)
+                assert not comparison.left_only and not comparison.right_only
+                for name in ("a.bin", "sub/b.bin", "sub/deeper/c.bin"):
+                    assert filecmp.cmp(os.path.join(source, name), os.path.join(target, name), shallow=False)
+                    assert int(os.path.getmtime(os.path.join(source, name))) == int(
+                        os.path.getmtime(os.path.join(target, name))
+                    )
+
+    def test_durability(self):
+        """Test the durability policies for writes."""
+        with Context() as context:
+            filename = context.source.pathname
+            for policy in DURABILITY_POLICIES:
+                write_block(filename, 0, b"x" * 1024, durability=policy, sync_interval=1024 * 4)
+            # The periodic policy counts the bytes written since the last write-back.
+            write_block(filename, 0, b"x" * 1024, durability="periodic", sync_interval=1024 * 4)
+            assert unsynced_bytes[filename] == 1024 * 2
+            with self.assertRaises(ValueError):
+                write_block(filename, 0, b"x", durability="bogus")
+            # The target is synchronized to disk at the end (on the server as well).
+            context.target.generate()
+            report_file = os.path.join(context.directory.temporary_directory, "report.json")
+            for policy, target in (("end", context.target.location), ("periodic", context.target.pathname)):
+                returncode, output = run_cli(
+                    main,
+                    "--durability=%s" % policy,
+                    "--sync-interval=1M",
+                    "--report=%s" % report_file,
+                    context.source.pathname,
+                    target,
+                    capture=False,
+                )
+                assert returncode == 0
+                assert filecmp.cmp(context.source.pathname, context.target.pathname, shallow=False)
+                with open(report_file) as handle:
+                    assert json.load(handle)["phases"]["sync"] > 0
+                with open(context.source.pathname, "r+b") as handle:
+                    handle.write(b"changed")
+
+    def test_fanout(self):
+        """Test synchronizing one source file to several targets in a single run."""
+        with Context() as context:
+            context.target.copy(context.source)
+            with open(context.target.pathname, "r+b") as handle:
+                handle.seek(1024 * 1024 * 2)
+                handle.write(b"changed")
+            missing = DataFile(context=context, filename="missing.bin")
+            identical = DataFile(context=context, filename="identical.bin")
+            identical.copy(context.source)
+            report_file = os.path.join(context.directory.temporary_directory, "report.json")
+            targets = [context.target.location, missing.pathname, identical.pathname]
+            returncode, output = run_cli(
+                main, "--block-size=1MiB", "--report=%s" % report_file, context.source.pathname, *targets, capture=False
+            )
+            assert returncode == 0
+            for target in (context.target, missing, identical):
+                assert filecmp.cmp(context.source.pathname, target.pathname, shallow=False)
+            with open(report_file) as handle:
+                report = json.load(handle)
+            # Blocks needed by more than one target are only counted once.
+            assert report["blocks"]["changed"] == report["blocks"]["total"]
+            assert report["metadata"]["targets"] == targets
+            # Two level comparison narrows down the changes of each target.
+            with open(missing.pathname, "r+b") as handle:
+                handle.seek(1024 * 1024 * 5)
+                handle.write(b"changed")
+            client = Client(
+                block_size=1024 * 1024,
+                fine_block_size=1024 * 64,
+                source=context.source.pathname,
+                targets=targets,
+            )
+            assert client.target.expression == context.target.location
+            report = client.synchronize()
+            assert report.blocks_changed == 1
+            assert report.bytes_transferred == 1024 * 64
+            for target in (context.target, missing, identical):
+                assert filecmp.cmp(context.source.pathname, target.pathname, shallow=False)
+            # Targets that are only larger than the source are truncated.
+            for target in (context.target, identical):
+                with open(target.pathname, "ab") as handle:
+                    handle.write(b"extra" * 1000)
+            client = Client(block_size=1024 * 1024, source=context.source.pathname, targets=targets)
+            assert client.synchronize().blocks_changed == 0
+            for target in (context.target, missing, identical):
+                assert filecmp.cmp(context.source.pathname, target.pathname, shallow=False)
+            with self.assertRaises(ValueError):
+                Client(recursive=True, source=context.source.pathname, targets=targets).synchronize()
+            with self.assertRaises(ValueError):
+                Client(source=context.source.pathname, targets=targets, verify=True).synchronize()
+            with self.assertRaises(ValueError):
+                Client(append_only=True, source=context.source.pathname, targets=targets).synchronize()
+
+    def test_io_modes(self):
+        """Test reading of blocks with page cache hints and direct I/O."""
+        with Context() as context:
+            with open(context.source.pathname, "rb") as handle:
+                contents = handle.read()
+            for io_mode in IO_MODES:
+                for offset, size in ((0, 4096), (1000, 5000), (len(contents) - 100, 1000), (len(contents) + 1, 10)):
+                    assert read_block(context.source.pathname, offset, size, io_mode) == contents[offset:offset + size]
+            with self.assertRaises(ValueError):
+                read_block(context.source.pathname, 0, 1, "bogus")
+            # Hash and read using direct I/O (and stripe scheduling) on both sides.
+            context.target.generate()
+            returncode, output = run_cli(
+                main, "--io-mode=direct", "--hash-schedule=stripes", context.source.location, context.target.pathname
+            )
+            assert returncode == 0
+            assert filecmp.cmp(context.source.pathname, context.target.pathname, shallow=False)
+
+    def test_journal_resume(self):
+        """Test that an interrupted transfer is resumed based on its journal."""
+        with TemporaryDirectory() as directory:
+            source = os.path.join(directory, "source.bin")
+            target = os.path.join(directory, "target.bin")
+            journal_file = os.path.join(directory, "transfer.journal")
+            block_size = 1024 * 64
+            with open(source, "wb") as handle:
+                handle.write(os.urandom(block_size * 10))
+            with open(target, "wb") as handle:
+                handle.write(b"\0" * block_size * 10)
+            client = Client(source=source, target=target, block_size=block_size, journal_file=journal_file)
+            # Simulate a transfer that was interrupted after five blocks.
+            offsets = list(range(0, block_size * 10, block_size))
+            client.journal.start(client.journal_identity, offsets)
+            for offset in offsets[:5]:
+                client.journal.record(offset)
+            client.journal.close()
+            # Resume the transfer using a new client.
+            client = Client(source=source, target=target, block_size=block_size, journal_file=journal_file)
+            assert client.synchronize_once() == 5
+            # The blocks recorded in the journal weren't transferred again.
+            with open(source, "rb") as source_handle, open(target, "rb") as target_handle:
+                for offset in offsets:
+                    expected = source_handle.read(block_size)
+                    actual = target_handle.read(block_size)
+                    assert (actual == expected) == (offset in offsets[5:])
+            # The journal was removed after the transfer completed.
+            assert not os.path.exists(journal_file)
+            # Journals of modified source files are ignored.
+            journal = Journal(filename=journal_file)
+            journal.start(client.journal_identity, offsets)
+            assert journal.load(client.journal_identity) == offsets
+            assert journal.load(dict(client.journal_identity, source_size=42)) is None
+            # The target is synchronized to disk before the blocks are recorded.
+            lines = []
+
+            def sync_callback():
+                with open(journal_file) as handle:
+                    lines.append(len(handle.readlines()))
+
+            journal = Journal(filename=journal_file, sync_callback=sync_callback)
+            journal.start(client.journal_identity, offsets)
+            journal.record(offsets[0])
+            journal.close()
+            assert lines == [1]
+            assert len(journal.load(client.journal_identity)) == len(offsets) - 1
+
     def test_location_parsing(self):
         """Test parsing of location expressions."""
         # Check that locations default to local files.
@@ -137,6 +416,12 @@ class TestSuite(TestCase):
         assert obj.filename == "/foo/bar"
         assert obj.hostname == "server"
         assert obj.port_number == 12345
+        # Check that locations support files on generic HTTP servers.
+        obj = Location(expression="static+https://example.com/foo%20bar")
+        assert obj.expression == "static+https://example.com/foo%20bar"
+        assert obj.url == "https://example.com/foo%20bar"
+        assert obj.filename == "/foo bar"
+        assert obj.static and obj.range_requests
         # Check that unsupported URL schemes raise an exception.
         with self.assertRaises(ValueError):
             Location(expression="udp://server/filename")
@@ -191,6 +476,634 @@ class TestSuite(TestCase):
             # Check that the input and output file have the same content.
             assert filecmp.cmp(context.source.pathname, context.target.pathname)
 
+    def test_server_comparison(self):
+        """Test that comparing hashes on the server gives the same result as comparing them locally."""
+        digest = "%040x" % 42
+        packed = b"".join(pack_hash(offset, digest) for offset in (0, 1024 * 1024 * 1024 * 8))
+        assert len(packed) == 2 * (8 + 20)
+        assert list(unpack_hashes(io.BytesIO(packed), "sha1")) == [(0, digest), (1024 * 1024 * 1024 * 8, digest)]
+        with self.assertRaises(ValueError):
+            list(unpack_hashes(io.BytesIO(packed[:-1]), "sha1"))
+        with Context() as context:
+            context.target.copy(context.source)
+            with open(context.target.pathname, "r+b") as handle:
+                for offset in (1024 * 10, 1024 * 1024 * 3):
+                    handle.seek(offset)
+                    handle.write(b"changed")
+                # The target is larger than the source.
+                handle.seek(0, os.SEEK_END)
+                handle.write(b"extra")
+            for source, target in (
+                (context.source.location, context.target.pathname),
+                (context.source.pathname, context.target.location),
+            ):
+                results = []
+                for server_comparison in (True, False):
+                    client = Client(
+                        block_size=1024 * 1024,
+                        server_comparison=server_comparison,
+                        source=source,
+                        target=target,
+                    )
+                    client.start_report()
+                    coarse = client.compare_blocks(block_size=client.block_size)
+                    fine = client.compare_blocks(block_size=1024 * 64, ranges=[[0, 1024 * 1024 * 4]])
+                    changed = dict(client.changed_hashes.items())
+                    results.append(
+                        (list(coarse[0]), coarse[1], list(fine[0]), fine[1], client.report.bytes_hashed, changed)
+                    )
+                assert results[0] == results[1]
+                assert results[0][0] == [0, 1024 * 1024 * 3]
+                assert results[0][2] == [0, 1024 * 1024 * 3]
+
+    def test_server_comparison_fallback(self):
+        """Test that the client compares hashes itself when the server doesn't support comparing hashes."""
+        with Context() as context:
+            with open(context.source.pathname, "rb") as source, open(context.target.pathname, "wb") as target:
+                target.write(source.read(1024 * 1024 * 2))
+            client = Client(block_size=1024 * 1024, source=context.source.location, target=context.target.pathname)
+            set_property(client, "source", LegacyLocation(expression=context.source.location))
+            client.start_report()
+            todo, similarity = client.compare_blocks(block_size=client.block_size)
+            assert client.server_comparison is False
+            assert list(todo) == list(range(1024 * 1024 * 2, os.path.getsize(context.source.pathname), 1024 * 1024))
+
+    def test_shrinking_target(self):
+        """Test that a target which is larger than the source (but otherwise identical) is truncated."""
+        with Context() as context:
+            for target in (context.target.pathname, context.target.location):
+                context.target.copy(context.source)
+                with open(context.target.pathname, "ab") as handle:
+                    handle.write(os.urandom(2000000))
+                client = Client(concurrency=2, source=context.source.pathname, target=target)
+                assert client.synchronize_once() == 0
+                assert filecmp.cmp(context.source.pathname, context.target.pathname, shallow=False)
+
+    def test_server_to_server_transfer(self):
+        """Test copying a file between servers (the target server pulls blocks from the source server)."""
+        with Context() as context:
+            base_url = "http://localhost:%i" % context.server.port_number
+            for delta_transfer in (False, True):
+                if delta_transfer:
+                    with open(context.source.pathname, "r+b") as handle:
+                        handle.seek(1024 * 1024 * 3)
+                        handle.write(b"changed")
+                options = ["--block-size=1MiB"] if delta_transfer else ["--whole-file", "--block-size=64KiB"]
+                returncode, output = run_cli(
+                    main, *(options + [context.source.location, context.target.location]), capture=False
+                )
+                assert returncode == 0
+                assert filecmp.cmp(context.source.pathname, context.target.pathname, shallow=False)
+            # Both transfers were handled by the server (the second one only copied a single block).
+            samples = get_metrics(base_url)
+            file_size = os.path.getsize(context.source.pathname)
+            assert int(samples["pdiffcopy_pulled_bytes_total"]) == file_size + 1024 * 1024
+
+    def test_generate_batches(self):
+        """Test that blocks are divided into batches of the requested size."""
+        assert list(generate_batches(range(5), 2)) == [[0, 1], [2, 3], [4]]
+        assert list(generate_batches(range(4), 2)) == [[0, 1], [2, 3]]
+        assert list(generate_batches([], 2)) == []
+
+    def test_range_requests(self):
+        """Test the standard HTTP range requests supported by the server."""
+        assert format_range_header([(10, 20), (0, 10), (30, 40)]) == "bytes=0-19,30-39"
+        assert parse_range_header("bytes=0-9,-5,90-", 100) == [(0, 10), (95, 100), (90, 100)]
+        assert parse_range_header("bytes=200-300", 100) == []
+        assert parse_range_header("bytes=20-10", 100) is None
+        assert parse_range_header("lines=1-2", 100) is None
+        with Context() as context:
+            url = "http://localhost:%i/files%s" % (context.server.port_number, context.source.pathname)
+            with open(context.source.pathname, "rb") as handle:
+                data = handle.read()
+            response = requests.head(url)
+            assert response.status_code == 200
+            assert int(response.headers["Content-Length"]) == len(data)
+            assert response.headers["Accept-Ranges"] == "bytes"
+            etag = response.headers["ETag"]
+            # Check that a single range results in a partial response.
+            response = requests.get(url, headers=dict(Range="bytes=10-19"))
+            assert response.status_code == 206
+            assert response.headers["Content-Range"] == "bytes 10-19/%i" % len(data)
+            assert response.content == data[10:20]
+            # Check that multiple ranges result in a multipart response.
+            response = requests.get(url, headers=dict(Range="bytes=0-9,-5"))
+            assert response.status_code == 206
+            assert int(response.headers["Content-Length"]) == len(response.content)
+            parts = parse_multipart_byteranges(response.headers["Content-Type"], response.content)
+            assert parts == [(0, data[:10]), (len(data) - 5, data[-5:])]
+            # Check that unsatisfiable ranges are rejected.
+            response = requests.get(url, headers=dict(Range="bytes=%i-" % len(data)))
+            assert response.status_code == 416
+            # Check the support for conditional requests.
+            assert requests.get(url, headers={"If-None-Match": etag}).status_code == 304
+            response = requests.get(url, headers={"If-Range": '"outdated"', "Range": "bytes=0-9"})
+            assert response.status_code == 200
+            assert response.content == data
+            assert requests.get(url + ".missing").status_code == 404
+
+    def test_static_source(self):
+        """Test copying a file from a generic HTTP server (using range requests)."""
+        block_size = 1024 * 64
+        with Context() as context:
+            source = "static+http://localhost:%i/files%s" % (context.server.port_number, context.source.pathname)
+            source_size = os.path.getsize(context.source.pathname)
+            # Copy the file to a local target and to a target server (which pulls the blocks).
+            for target in (context.target.pathname, context.target.location):
+                if os.path.exists(context.target.pathname):
+                    os.unlink(context.target.pathname)
+                client = Client(block_size=block_size, source=source, target=target)
+                client.synchronize()
+                assert filecmp.cmp(context.source.pathname, context.target.pathname, shallow=False)
+                assert client.report.bytes_transferred == source_size
+            # Only the new data is downloaded in append only mode.
+            with open(context.source.pathname, "ab") as handle:
+                handle.write(os.urandom(block_size * 3))
+            client = Client(append_only=True, block_size=block_size, source=source, target=context.target.pathname)
+            client.synchronize()
+            assert filecmp.cmp(context.source.pathname, context.target.pathname, shallow=False)
+            assert client.report.bytes_transferred == block_size * 3
+            # Static locations can't be written to.
+            with self.assertRaises(ValueError):
+                Client(source=context.target.pathname, target=source).synchronize()
+            # Range requests can also be used for the blocks of a delta transfer from a pdiffcopy server.
+            with open(context.source.pathname, "r+b") as handle:
+                handle.seek(block_size * 2)
+                handle.write(b"changed")
+            client = Client(
+                block_size=block_size,
+                range_requests=True,
+                source=context.source.location,
+                target=context.target.pathname,
+            )
+            client.synchronize()
+            assert client.source.range_requests
+            assert filecmp.cmp(context.source.pathname, context.target.pathname, shallow=False)
+            assert client.report.bytes_transferred == block_size
+
+    def test_single_range_server(self):
+        """Test reading blocks from a generic HTTP server that doesn't support multi-range requests."""
+        block_size = 1024 * 64
+        with TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "data.bin")
+            with open(filename, "wb") as handle:
+                handle.write(os.urandom(block_size * 8))
+            server = HTTPServer(("127.0.0.1", 0), SingleRangeHandler)
+            server.requests = []
+            thread = threading.Thread(target=server.serve_forever)
+            thread.daemon = True
+            thread.start()
+            try:
+                location = Location(expression="static+http://127.0.0.1:%i%s" % (server.server_port, filename))
+                offsets = [0, block_size * 2, block_size * 5]
+                for offset, data in location.read_blocks(offsets, block_size):
+                    assert data == read_block(filename, offset, block_size)
+                # The ranges were requested separately after the server responded with the whole file.
+                assert not location.multi_range_requests
+                ranges = [(offset, offset + block_size) for offset in offsets]
+                assert [headers.get("Range") for headers in server.requests] == [
+                    None,
+                    format_range_header(ranges),
+                ] + [format_range_header([r]) for r in ranges]
+                # The weak entity tag wasn't used to make the requests conditional.
+                assert all(
+                    headers["If-Range"] == location.file_info["last_modified"] for headers in server.requests[1:]
+                )
+            finally:
+                server.shutdown()
+                server.server_close()
+
+    def test_deduplication(self):
+        """Test that identical changed blocks are transferred only once."""
+        block_size = 1024 * 1024
+        with Context() as context:
+            # Test copying blocks within a file.
+            with open(context.source.pathname, "rb") as handle:
+                first_block = handle.read(block_size)
+            context.target.copy(context.source)
+            assert copy_blocks(context.target.pathname, [(0, block_size), (0, block_size * 3)], block_size) == (
+                block_size * 2
+            )
+            with open(context.target.pathname, "rb") as handle:
+                for offset in (0, block_size, block_size * 3):
+                    handle.seek(offset)
+                    assert handle.read(block_size) == first_block
+            # Fill part of the source with identical blocks.
+            original = DataFile(context=context, filename="original.bin")
+            original.copy(context.source)
+            with open(context.source.pathname, "r+b") as handle:
+                for i in range(2, 7):
+                    handle.seek(block_size * i)
+                    handle.write(b"\0" * block_size)
+            for source, target in (
+                (context.source.pathname, context.target.pathname),
+                (context.source.location, context.target.pathname),
+                (context.source.pathname, context.target.location),
+                (context.source.location, context.target.location),
+            ):
+                context.target.copy(original)
+                client = Client(block_size=block_size, source=source, target=target)
+                client.synchronize()
+                assert filecmp.cmp(context.source.pathname, context.target.pathname, shallow=False)
+                assert client.report.blocks_changed == 5
+                assert client.report.bytes_transferred == block_size
+                assert client.report.bytes_copied == block_size * 4
+            # Deduplication can be disabled.
+            context.target.copy(original)
+            client = Client(block_size=block_size, deduplicate=False, source=source, target=target)
+            client.synchronize()
+            assert filecmp.cmp(context.source.pathname, context.target.pathname, shallow=False)
+            assert client.report.bytes_transferred == block_size * 5
+            assert client.report.bytes_copied == 0
+
+    def test_move_detection(self):
+        """Test that changed blocks which exist elsewhere in the target are copied within the target."""
+        assert digests.order_moves({0: 1, 1: 2, 3: 5}) == [(1, 0), (2, 1), (5, 3)]
+        # Blocks that traded places can't be copied within the target.
+        assert digests.order_moves({0: 1, 1: 0, 2: 0}) == [(0, 2)]
+        # The target is scanned the same way with and without NumPy.
+        source = digests.DigestArray(block_size=1, method="sha1")
+        target = digests.DigestArray(block_size=1, method="sha1")
+        source.update([(0, "%040x" % 3), (1, "%040x" % 4), (2, "%040x" % 5)])
+        target.update([(0, "%040x" % 1), (1, "%040x" % 2), (2, "%040x" % 3), (3, "%040x" % 4), (5, "%040x" % 6)])
+        saved = digests.numpy
+        try:
+            for numpy in set([None, digests.numpy]):
+                digests.numpy = numpy
+                assert digests.find_moves(source, target, [0, 1, 2]) == [(2, 0), (3, 1)]
+        finally:
+            digests.numpy = saved
+        block_size = 1024 * 1024
+        with Context() as context:
+            original = DataFile(context=context, filename="original.bin")
+            original.copy(context.source)
+            with open(original.pathname, "rb") as handle:
+                blocks = [handle.read(block_size) for i in range(8)]
+            # Shift the first blocks of the source, add a new block and swap two blocks.
+            with open(context.source.pathname, "r+b") as handle:
+                handle.write(b"".join(blocks[1:5]))
+                handle.write(os.urandom(block_size))
+                handle.seek(block_size * 6)
+                handle.write(blocks[7] + blocks[6])
+            for source, target, server_comparison in (
+                (context.source.pathname, context.target.pathname, True),
+                (context.source.location, context.target.pathname, True),
+                (context.source.pathname, context.target.location, True),
+                (context.source.pathname, context.target.location, False),
+                (context.source.location, context.target.location, True),
+            ):
+                context.target.copy(original)
+                client = Client(
+                    block_size=block_size, server_comparison=server_comparison, source=source, target=target
+                )
+                client.synchronize()
+                assert filecmp.cmp(context.source.pathname, context.target.pathname, shallow=False)
+                assert client.moved_blocks == [(block_size * (i + 1), block_size * i) for i in range(4)]
+                assert client.report.bytes_copied == block_size * 4
+                assert client.report.bytes_transferred == block_size * 3
+            # Move detection can be disabled.
+            context.target.copy(original)
+            client = Client(block_size=block_size, detect_moves=False, source=source, target=target)
+            client.synchronize()
+            assert filecmp.cmp(context.source.pathname, context.target.pathname, shallow=False)
+            assert client.report.bytes_transferred == block_size * 7
+
+    def test_append_only(self):
+        """Test the fast path for files that are only appended to."""
+        block_size = 1024 * 64
+        assert select_samples(block_size * 3 + 1, block_size, 32) == [0, block_size, block_size * 2]
+        samples = select_samples(block_size * 1000, block_size, 10)
+        assert len(samples) == 10
+        assert samples[0] == 0 and samples[-1] == block_size * 999
+        with Context() as context:
+            source_size = os.path.getsize(context.source.pathname)
+            for target_size in (0, block_size * 5 + 42, source_size - 1):
+                for location in (context.target.pathname, context.target.location):
+                    with open(context.source.pathname, "rb") as handle:
+                        with open(context.target.pathname, "wb") as target:
+                            target.write(handle.read(target_size))
+                    client = Client(
+                        append_only=True, block_size=block_size, source=context.source.pathname, target=location
+                    )
+                    client.synchronize()
+                    assert filecmp.cmp(context.source.pathname, context.target.pathname, shallow=False)
+                    offset = target_size - target_size % block_size
+                    assert client.report.bytes_transferred == source_size - offset
+                    assert client.report.bytes_hashed["source"] <= block_size * 32
+            # Fall back to a delta transfer when the target isn't a prefix of the source.
+            for target_size in (source_size // 2, source_size + 1):
+                with open(context.target.pathname, "wb") as handle:
+                    handle.write(os.urandom(target_size))
+                client = Client(
+                    append_only=True,
+                    block_size=block_size,
+                    source=context.source.pathname,
+                    target=context.target.location,
+                )
+                client.synchronize()
+                assert filecmp.cmp(context.source.pathname, context.target.pathname, shallow=False)
+                assert client.report.bytes_hashed["target"] > block_size * 32
+
+    def test_verification(self):
+        """Test the verification of the target after synchronizing changes."""
+        block_size = 1024 * 1024
+        with Context() as context:
+            original = DataFile(context=context, filename="original.bin")
+            original.copy(context.source)
+            with open(context.source.pathname, "r+b") as handle:
+                for offset in (block_size, block_size * 4 + 10):
+                    handle.seek(offset)
+                    handle.write(b"changed")
+            for source, target, server_comparison in (
+                (context.source.pathname, context.target.pathname, False),
+                (context.source.location, context.target.pathname, True),
+                (context.source.pathname, context.target.location, True),
+            ):
+                context.target.copy(original)
+                client = Client(
+                    block_size=block_size,
+                    server_comparison=server_comparison,
+                    source=source,
+                    target=target,
+                    verify=True,
+                )
+                client.synchronize()
+                assert filecmp.cmp(context.source.pathname, context.target.pathname, shallow=False)
+                # Only the transferred blocks of the target were hashed again.
+                file_size = os.path.getsize(context.source.pathname)
+                assert client.report.bytes_hashed["target"] == file_size + block_size * 2
+                assert client.report.phases["verification"] > 0
+            # Blocks that differ after the transfer are transferred again.
+            context.target.copy(original)
+            client = Client(block_size=block_size, source=context.source.pathname, target=context.target.location)
+            client.verify = True
+            transfer_changes = client.transfer_changes
+            corrupted = []
+
+            def corrupt_target(offsets):
+                transfer_changes(offsets)
+                if not corrupted:
+                    corrupted.append(block_size)
+                    with open(context.target.pathname, "r+b") as handle:
+                        handle.seek(block_size)
+                        handle.write(b"corrupt")
+
+            client.transfer_changes = corrupt_target
+            client.synchronize()
+            assert filecmp.cmp(context.source.pathname, context.target.pathname, shallow=False)
+            assert client.report.bytes_transferred == block_size * 3
+            # Whole file copies are verified by hashing both files.
+            os.unlink(context.target.pathname)
+            client = Client(source=context.source.pathname, target=context.target.location, verify=True)
+            client.synchronize()
+            assert filecmp.cmp(context.source.pathname, context.target.pathname, shallow=False)
+            assert client.report.bytes_hashed["source"] == os.path.getsize(context.source.pathname)
+
+    def test_file_watcher(self):
+        """Test the detection of changes to files (using inotify and polling)."""
+        with TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "watched.bin")
+            with open(filename, "wb") as handle:
+                handle.write(b"original")
+            for use_inotify in (True, False):
+                options = dict(filename=filename, poll_interval=0.05)
+                if not use_inotify:
+                    options.update(inotify_fd=None)
+                with FileWatcher(**options) as watcher:
+                    assert watcher.wait(0.1) is None
+                    # Make sure the modification time changes (for polling).
+                    time.sleep(0.05)
+                    with open(filename, "r+b") as handle:
+                        handle.write(b"modified")
+                    assert watcher.wait(1) == MODIFIED
+                    assert watcher.wait(0.1) is None
+                    # Replace the file, the way editors and rsync do.
+                    with open(filename + ".tmp", "wb") as handle:
+                        handle.write(b"replaced")
+                    os.rename(filename + ".tmp", filename)
+                    assert watcher.wait(1) == REPLACED
+                    assert watcher.wait(0.1) is None
+
+    def test_watch_mode(self):
+        """Test synchronizing changes to the source repeatedly (watch mode)."""
+        block_size = 1024 * 1024
+        with Context() as context:
+            client = Client(
+                block_size=block_size,
+                source=context.source.pathname,
+                target=context.target.location,
+                watch_interval=0.1,
+            )
+            client.synchronize_once()
+            assert filecmp.cmp(context.source.pathname, context.target.pathname, shallow=False)
+            # The hashes of the whole file copy aren't known.
+            assert client.source_hashes is None
+            client.delta_transfer = True
+            client.target.clear_cached_properties()
+            client.synchronize_once()
+            assert client.source_hashes is not None
+            # Only the source is hashed after a change.
+            with open(context.source.pathname, "r+b") as handle:
+                handle.seek(block_size * 2)
+                handle.write(b"changed")
+            client.source.clear_cached_properties()
+            client.target.clear_cached_properties()
+            assert client.synchronize_incremental() == 1
+            assert client.report.bytes_hashed["target"] == 0
+            assert client.report.bytes_transferred == block_size
+            assert filecmp.cmp(context.source.pathname, context.target.pathname, shallow=False)
+            # Truncating the source at a block boundary truncates the target.
+            with open(context.source.pathname, "r+b") as handle:
+                handle.truncate(block_size * 3)
+            client.source.clear_cached_properties()
+            client.target.clear_cached_properties()
+            assert client.synchronize_incremental() == 0
+            assert filecmp.cmp(context.source.pathname, context.target.pathname, shallow=False)
+
+            # Make sure a regression fails the test instead of hanging the test suite.
+            deadline = time.time() + 120
+            errors = []
+
+            def modify_source():
+                # Wait for the first synchronization, then modify and replace the source.
+                for i in range(2):
+                    while not filecmp.cmp(context.source.pathname, context.target.pathname, shallow=False):
+                        if time.time() > deadline:
+                            errors.append("Timeout while waiting for synchronization!")
+                            return
+                        time.sleep(0.1)
+                    time.sleep(0.5)
+                    if i == 0:
+                        with open(context.source.pathname, "ab") as handle:
+                            handle.write(b"appended")
+                    else:
+                        original = DataFile(context=context, filename="replacement.bin")
+                        original.generate()
+                        os.rename(original.pathname, context.source.pathname)
+
+            threads = [
+                threading.Thread(target=modify_source),
+                threading.Thread(target=client.synchronize_watch, kwargs=dict(limit=3)),
+            ]
+            for thread in threads:
+                thread.daemon = True
+                thread.start()
+            for thread in threads:
+                thread.join(max(0, deadline - time.time()))
+                assert not thread.is_alive(), "Watch mode didn't finish in time!"
+            assert not errors
+            assert filecmp.cmp(context.source.pathname, context.target.pathname, shallow=False)
+            # The last synchronization compared both files, because the source was replaced.
+            assert client.report.bytes_hashed["target"] > 0
+            # Watch mode can't be combined with multiple targets.
+            with self.assertRaises(ValueError):
+                Client(
+                    source=context.source.pathname,
+                    targets=[context.target.pathname, context.target.location],
+                    watch_interval=5,
+                ).synchronize()
+
+    def test_tracing(self):
+        """Test the Chrome trace event export."""
+        with Context() as context:
+            context.target.generate()
+            trace_file = os.path.join(context.directory.temporary_directory, "trace.json")
+            try:
+                returncode, output = run_cli(
+                    main,
+                    "--trace=%s" % trace_file,
+                    "--local-comparison",
+                    context.source.location,
+                    context.target.pathname,
+                )
+                assert returncode == 0
+                with open(trace_file) as handle:
+                    events = json.load(handle)["traceEvents"]
+                names = set(e["name"] for e in events)
+                assert set(["call", "generate", "enqueue", "dequeue", "work", "publish"]).issubset(names)
+                assert set(["read_block", "write_block"]).issubset(names)
+                process_names = set(e["args"]["name"] for e in events if e["ph"] == "M")
+                assert set(["Client", "Generator", "Worker #1"]).issubset(process_names)
+                assert all(e["dur"] >= 0 for e in events if e["ph"] == "X")
+                # The server records a span for each request.
+                directory = os.path.join(context.directory.temporary_directory, "events")
+                enable_tracing(directory)
+                response = app.test_client().get("/info", query_string=dict(filename=context.source.pathname))
+                response.close()
+                with open(os.path.join(directory, "events-%i.jsonl" % os.getpid())) as handle:
+                    event = json.loads(handle.readline())
+                assert event["name"] == "info"
+                assert event["args"]["filename"] == context.source.pathname
+            finally:
+                os.environ.pop(TRACE_DIRECTORY_VARIABLE, None)
+
+    def test_two_level_comparison(self):
+        """Test that two level comparison narrows down changed blocks (client to server)."""
+        with Context() as context:
+            block_size = 1024 * 1024
+            fine_block_size = 1024 * 64
+            context.target.copy(context.source)
+            # Change two bytes in different fine blocks of the same large block.
+            with open(context.target.pathname, "r+b") as handle:
+                for offset in (block_size + 10, block_size + fine_block_size * 3 + 10):
+                    handle.seek(offset)
+                    handle.write(b"\xff" if handle.read(1) != b"\xff" else b"\0")
+            client = Client(
+                source=context.source.pathname,
+                target=context.target.location,
+                block_size=block_size,
+                fine_block_size=fine_block_size,
+            )
+            assert client.find_changes() == [block_size, block_size + fine_block_size * 3]
+            assert client.synchronize_once() == 2
+            assert filecmp.cmp(context.source.pathname, context.target.pathname, shallow=False)
+            # Check that the block sizes must be compatible.
+            client = Client(source=context.source.pathname, target=context.target.pathname, fine_block_size=12345)
+            with self.assertRaises(ValueError):
+                client.refine_changes([0])
+
+    def test_performance_report(self):
+        """Test the machine readable performance report."""
+        with Context() as context:
+            context.target.generate()
+            report_file = os.path.join(context.directory.temporary_directory, "report.json")
+            returncode, output = run_cli(
+                main, "--report=%s" % report_file, context.source.location, context.target.pathname, capture=False
+            )
+            assert returncode == 0
+            with open(report_file) as handle:
+                report = json.load(handle)
+            source_size = os.path.getsize(context.source.pathname)
+            assert set(report["phases"]) == set(PHASES) | set(["total"])
+            assert report["phases"]["source_hashing"] > 0
+            assert report["phases"]["transfer"] > 0
+            assert report["bytes_hashed"]["source"] == source_size
+            assert report["bytes_transferred"] == source_size
+            assert report["blocks"]["changed"] == report["blocks"]["total"]
+            assert report["block_latency"]["count"] == report["blocks"]["changed"]
+            assert report["block_latency"]["p50"] <= report["block_latency"]["p99"] <= report["block_latency"]["max"]
+            assert 0 < report["utilization"]["transfer"] <= 1
+            assert report["metadata"]["source"] == context.source.location
+            # The report is also available through the Python API.
+            client = Client(source=context.source.location, target=context.target.pathname)
+            assert client.synchronize().as_dict()["blocks"]["changed"] == 0
+
+    def test_benchmark_suite(self):
+        """Test the synthetic benchmark suite."""
+        suite = BenchmarkSuite(file_size=1024 * 1024 * 2, client_options=dict(block_size=1024 * 64))
+        results = suite.run()
+        assert len(results["results"]) == len(PATTERNS) * 2
+        for result in results["results"]:
+            assert result["verified"]
+            assert 0 < result["report"]["bytes_transferred"] < result["source_size"] or result["pattern"] == "truncate"
+        # Make sure the results are JSON serializable.
+        json.dumps(results)
+
+    def test_microbenchmarks(self):
+        """Test the micro-benchmarks and regression detection."""
+        results = run_microbenchmarks(block_sizes=[1024 * 64], concurrencies=[2], number=10, repeat=1)
+        assert "hash_worker[sha1, 64 KiB]" in results
+        assert "WorkerPool[concurrency=2]" in results
+        assert all(seconds > 0 for seconds in results.values())
+        # Results never regress against themselves.
+        assert compare_results(results, results) == []
+        # Halving the baseline makes everything a regression.
+        baseline = dict((name, seconds / 2) for name, seconds in results.items())
+        assert len(compare_results(results, baseline)) == len(results)
+        # The /hashes encoding round trips.
+        assert decode_hash(encode_hash(42, "abc")) == (42, "abc")
+
+    def test_profiling(self):
+        """Test that child processes and server requests are profiled."""
+        with Context() as context:
+            context.target.generate()
+            directory = os.path.join(context.directory.temporary_directory, "profiles")
+            try:
+                returncode, output = run_cli(
+                    main, "--profile=%s" % directory, context.source.pathname, context.target.pathname
+                )
+                assert returncode == 0
+                labels = set(fn.split("-")[0] for fn in os.listdir(directory) if fn.endswith(".prof"))
+                assert labels == set(["client", "generator", "promise", "worker"])
+                assert os.path.isfile(os.path.join(directory, "merged.pstats"))
+                assert "cumulative" in output
+                # The server profiles each request separately.
+                response = app.test_client().get("/info", query_string=dict(filename=context.source.pathname))
+                response.close()
+                assert any(fn.startswith("request-info-") for fn in os.listdir(directory))
+            finally:
+                os.environ.pop(PROFILE_DIRECTORY_VARIABLE, None)
+
+    def test_select_block_size(self):
+        """Test automatic selection of block sizes."""
+        assert select_block_size(0) == 1024 * 128
+        assert select_block_size(1024 ** 3) == 1024 * 128
+        assert select_block_size(100 * 1024 ** 3) == 1024 * 1024 * 2
+        assert select_block_size(1024 ** 4) == 1024 * 1024 * 16
+        assert select_block_size(1024 ** 5) == 1024 * 1024 * 64
+        client = Client(source=__file__, target="/dev/null", adaptive_block_size=True)
+        assert client.block_size == 1024 * 128
+
     def test_usage_message(self):
         """Test the ``pdifcopy --help`` command."""
         for option in "-h", "--help":
@@ -198,6 +1111,102 @@ class TestSuite(TestCase):
             assert returncode == 0
             assert "Usage:" in output
 
+    def test_local_fast_path(self):
+        """Test synchronization between local files using in-kernel copies and reflinks."""
+        with Context() as context:
+            # Whole file copies try to clone the source (support depends on the filesystem).
+            returncode, output = run_cli(main, context.source.pathname, context.target.pathname)
+            assert returncode == 0
+            assert filecmp.cmp(context.source.pathname, context.target.pathname, shallow=False)
+            clone = os.path.join(context.directory.temporary_directory, "clone.bin")
+            if clone_file(context.source.pathname, clone):
+                assert filecmp.cmp(context.source.pathname, clone, shallow=False)
+            # Whole file copies onto a larger target remove the old data after the end of the source.
+            with open(context.source.pathname, "rb") as source, open(clone, "wb") as target:
+                target.write(source.read() + os.urandom(1024 * 1024 * 2))
+            client = Client(delta_transfer=False, source=context.source.pathname, target=clone)
+            client.synchronize_once()
+            assert filecmp.cmp(context.source.pathname, clone, shallow=False)
+            # Changed blocks are copied using copy_block().
+            with open(context.target.pathname, "r+b") as handle:
+                handle.seek(1024 * 1024 + 10)
+                handle.write(b"changed")
+            client = Client(source=context.source.pathname, target=context.target.pathname)
+            assert client.synchronize_once() == 1
+            assert filecmp.cmp(context.source.pathname, context.target.pathname, shallow=False)
+            # Copying the last (partial) block stops at the end of the source file.
+            size = os.path.getsize(context.source.pathname)
+            assert copy_block(context.source.pathname, context.target.pathname, size - 10, 1024) == 10
+
+    def test_metrics(self):
+        """Test the Prometheus metrics exposed by the server (aggregated across worker processes)."""
+        with Context() as context:
+            base_url = "http://localhost:%i" % context.server.port_number
+            for i in range(10):
+                requests.get(base_url + "/info", params=dict(filename=context.source.pathname))
+            response = requests.get(
+                base_url + "/hashes",
+                params=dict(block_size=1024 * 1024, concurrency=2, filename=context.source.pathname, method="sha1"),
+            )
+            num_blocks = len(response.text.splitlines())
+            samples = get_metrics(base_url)
+            assert samples['pdiffcopy_requests_total{endpoint="info"}'] == "10"
+            assert samples['pdiffcopy_requests_total{endpoint="hashes"}'] == "1"
+            assert samples['pdiffcopy_request_duration_seconds_count{endpoint="info"}'] == "10"
+            assert samples['pdiffcopy_request_duration_seconds_bucket{endpoint="info",le="+Inf"}'] == "10"
+            assert int(samples['pdiffcopy_hashed_bytes_total{method="sha1"}']) == os.path.getsize(
+                context.source.pathname
+            )
+            assert num_blocks > 0
+            assert samples["pdiffcopy_active_hashing_jobs"] == "0"
+            assert samples["pdiffcopy_pool_workers"] == "0"
+            assert samples["pdiffcopy_pool_busy_workers"] == "0"
+
+    def test_block_cache(self):
+        """Test the block cache shared by the worker processes of the server."""
+        cache = BlockCache(capacity=1024 * 4, slot_size=1024, ways=2)
+        cache.allocate()
+        assert cache.set_count == 2 and cache.set_size == 2
+        with TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "data.bin")
+            with open(filename, "wb") as handle:
+                handle.write(os.urandom(1024 * 16))
+            keys = [cache.get_key(filename, offset, 1024) for offset in range(0, 1024 * 16, 1024)]
+            for i, key in enumerate(keys):
+                cache.put(key, b"%i" % i)
+            # Each set holds the two most recently added blocks that map to it.
+            cached = [key for key in keys if cache.get(key) is not None]
+            assert keys[-1] in cached and len(cached) <= 4
+            for key in cached:
+                assert cache.get(key) == b"%i" % keys.index(key)
+            # Invalidation makes the cached blocks unreachable.
+            cache.invalidate(filename)
+            assert all(cache.get(cache.get_key(filename, key[-2], key[-1])) is None for key in keys)
+            # Blocks read before an invalidation aren't added to the cache.
+            key = cache.get_key(filename, 0, 1024)
+            cache.invalidate(filename)
+            assert not cache.put(key, b"stale") and cache.get(key) is None
+            assert cache.get(cache.get_key(filename, 0, 1024)) is None
+            # Blocks that don't fit in a slot aren't cached.
+            assert not cache.put(keys[0], b"x" * 1025) and cache.get(keys[0]) is None
+        with TemporaryDirectory() as directory, ProgramServer("--cache-size=8MiB") as server:
+            filename = os.path.join(directory, "data.bin")
+            with open(filename, "wb") as handle:
+                handle.write(os.urandom(1024 * 1024 * 2))
+            base_url = "http://localhost:%i" % server.port_number
+            params = dict(filename=filename, offset=1024 * 1024, size=1024 * 1024)
+            for i in range(10):
+                response = requests.get(base_url + "/blocks", params=params)
+                assert response.content == read_block(filename, 1024 * 1024, 1024 * 1024)
+            # Writes made by the server invalidate the cached blocks.
+            data = os.urandom(1024 * 1024)
+            requests.post(base_url + "/blocks", params=dict(filename=filename, offset=1024 * 1024), data=data)
+            assert requests.get(base_url + "/blocks", params=params).content == data
+            samples = get_metrics(base_url)
+            assert samples["pdiffcopy_block_cache_hits_total"] == "9"
+            assert samples["pdiffcopy_block_cache_misses_total"] == "2"
+            assert int(samples["pdiffcopy_block_cache_capacity_bytes"]) == 1024 * 1024 * 8
+
     def test_mp(self):
         """Test the multiprocessing abstractions."""
         options = dict(concurrency=3, generator_fn=functools.partial(range, 10), worker_fn=mp_worker)
@@ -206,6 +1215,61 @@ class TestSuite(TestCase):
             results = sorted([n for n in pool])
             assert results == expected
 
+    def test_mp_autotune(self):
+        """Test the multiprocessing abstractions with concurrency tuning enabled."""
+        options = dict(autotune=True, concurrency=4, generator_fn=functools.partial(range, 100), worker_fn=mp_worker)
+        pool = WorkerPool(**options)
+        pool.tuner.interval = 0.05
+        with pool:
+            expected = sorted(map(mp_worker, range(100)))
+            results = sorted([n for n in pool])
+            assert results == expected
+        assert 1 <= pool.tuner.value <= 4
+
+    def test_compare_hashes(self):
+        """Test that blocks beyond the end of the source aren't transferred."""
+        todo, similarity = compare_hashes({0: "a", 10: "b"}, {0: "a", 10: "c", 20: "d"})
+        assert todo == [10]
+        assert round(similarity) == 33
+
+    def test_concurrency_tuner(self):
+        """Test the AIMD logic of :class:`.ConcurrencyTuner`."""
+        tuner = ConcurrencyTuner(maximum=16)
+        assert tuner.value == 8
+        # Improving throughput leads to additive increases.
+        assert tuner.update(100)
+        assert tuner.value == 9
+        assert tuner.update(120)
+        assert tuner.value == 10
+        # When an increase doesn't help it's reverted and we hold.
+        assert tuner.update(121)
+        assert tuner.value == 9
+        assert not tuner.update(119)
+        assert tuner.value == 9
+        # A significant drop in throughput leads to a multiplicative decrease.
+        assert tuner.update(50)
+        assert tuner.value == 4
+        # The concurrency never exceeds the maximum or drops below the minimum.
+        tuner = ConcurrencyTuner(maximum=2, value=2)
+        assert not tuner.update(100)
+        assert tuner.value == 2
+        tuner = ConcurrencyTuner(maximum=2, value=1, last_action="increase", throughput=100)
+        assert not tuner.update(10)
+        assert tuner.value == 1
+
+
+def get_metrics(base_url):
+    """
+    Get the metrics exposed by a ``pdiffcopy`` server.
+
+    :param base_url: The base URL of the server (a string).
+    :returns: A dictionary with the names (including labels) and values (strings) of the samples.
+    """
+    # Metrics are updated when the response has been sent, so give the server a moment.
+    time.sleep(0.5)
+    text = requests.get(base_url + "/metrics").text
+    return dict(line.rsplit(" ", 1) for line in text.splitlines() if not line.startswith("#"))
+
 
 def mp_worker(n):
     """Simple worker function to test :class:`.WorkerPool`."""
@@ -283,13 +1347,62 @@ class DataFile(PropertyManager):
         execute("cp", other.pathname, self.pathname)
 
 
+class LegacyLocation(Location):
+
+    """:class:`~pdiffcopy.client.Location` that mimics a server without the ``/compare`` endpoint."""
+
+    def get_url(self, endpoint, **params):
+        """Get the URL of a nonexistent endpoint instead of ``/compare``."""
+        if endpoint == "compare":
+            endpoint = "nonexistent"
+        return super(LegacyLocation, self).get_url(endpoint, **params)
+
+
 class ProgramServer(EphemeralTCPServer):
 
     """Easy to use ``pdiffcopy --listen`` wrapper."""
 
-    def __init__(self):
+    def __init__(self, *options):
         """Initialize a :class:`ProgramServer` object."""
-        super(ProgramServer, self).__init__(sys.executable, "-m", "pdiffcopy", "--listen", str(self.port_number))
+        super(ProgramServer, self).__init__(
+            sys.executable, "-m", "pdiffcopy", "--listen", str(self.port_number), *options
+        )
+
+
+class SingleRangeHandler(BaseHTTPRequestHandler):
+
+    """HTTP request handler that supports single range requests only (like many generic HTTP servers)."""
+
+    def do_HEAD(self):
+        """Respond to a HEAD request."""
+        self.respond(head=True)
+
+    def do_GET(self):
+        """Respond to a GET request."""
+        self.respond()
+
+    def respond(self, head=False):
+        """Respond to a request (multi-range requests get the whole file)."""
+        self.server.requests.append(dict(self.headers.items()))
+        with open(self.path, "rb") as handle:
+            data = handle.read()
+        ranges = parse_range_header(self.headers.get("Range"), len(data))
+        if ranges and len(ranges) == 1:
+            start, end = ranges[0]
+            self.send_response(206)
+            self.send_header("Content-Range", format_content_range(start, end, len(data)))
+            data = data[start:end]
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("ETag", 'W/"weak"')
+        self.send_header("Last-Modified", "Sun, 18 Oct 2026 00:00:00 GMT")
+        self.end_headers()
+        if not head:
+            self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        """Don't log requests to standard error."""
 
 
 class RsyncDaemon(EphemeralTCPServer):
@@ -0,0 +1,166 @@
+# Fast large file synchronization inspired by rsync.
+#
+# Author: Peter Odding <peter@peterodding.com>
+# Last Change: October 18, 2026
+# URL: https://pdiffcopy.readthedocs.io
+
+"""
+Span tracing of the synchronization pipeline in the `Chrome trace event format`_.
+
+When a synchronization is slow it helps to see what each process was doing
+over time: Whether worker processes were starved by the generator process,
+blocked on the network or waiting for the disk. When tracing is enabled
+using :func:`enable_tracing()` the :mod:`pdiffcopy.mp` adapters, the block
+I/O methods of :class:`~pdiffcopy.client.Location` and the server endpoints
+record spans (named intervals of time). Each process appends its spans to a
+separate file in the trace directory (so that no coordination between
+processes is needed) and :func:`merge_traces()` combines those files into a
+single trace that can be loaded in ``chrome://tracing`` or Perfetto_.
+
+Like :mod:`pdiffcopy.profiling` the trace directory is passed to child
+processes using an environment variable.
+
+.. _Chrome trace event format: https://docs.google.com/document/d/1CvAClvFfyA5R-PhYUmn5OOQtYMH4h6I0nSsKchNAySU
+.. _Perfetto: https://ui.perfetto.dev/
+"""
+
+# Standard library modules.
+import contextlib
+import glob
+import json
+import logging
+import os
+import time
+
+# External dependencies.
+from humanfriendly.testing import make_dirs
+
+# Public identifiers that require documentation.
+__all__ = (
+    "TRACE_DIRECTORY_VARIABLE",
+    "begin_span",
+    "enable_tracing",
+    "end_span",
+    "get_trace_directory",
+    "logger",
+    "merge_traces",
+    "set_process_name",
+    "span",
+    "write_event",
+)
+
+# Initialize a logger for this module.
+logger = logging.getLogger(__name__)
+
+TRACE_DIRECTORY_VARIABLE = "PDIFFCOPY_TRACE_DIRECTORY"
+"""The name of the environment variable that enables tracing (a string)."""
+
+# Open trace files by process ID and trace directory (inherited by child processes).
+trace_files = {}
+
+
+def enable_tracing(directory):
+    """
+    Enable tracing of the current process and any child processes created afterwards.
+
+    :param directory: The pathname of the directory where the events of
+                      each process should be saved (a string, the
+                      directory is created if it doesn't exist yet).
+    """
+    directory = os.path.abspath(directory)
+    make_dirs(directory)
+    os.environ[TRACE_DIRECTORY_VARIABLE] = directory
+    logger.debug("Saving trace events to %s ..", directory)
+
+
+def get_trace_directory():
+    """Get the trace directory (a string or :data:`None` when tracing isn't enabled)."""
+    return os.environ.get(TRACE_DIRECTORY_VARIABLE) or None
+
+
+def set_process_name(name):
+    """
+    Set the name of the current process in the trace (if enabled).
+
+    :param name: A short description of the role of the process (a string).
+    """
+    if get_trace_directory():
+        write_event(dict(ph="M", name="process_name", pid=os.getpid(), tid=os.getpid(), args=dict(name=name)))
+
+
+def begin_span(name, category, **args):
+    """
+    Start a span (if enabled).
+
+    :param name: The name of the span (a string).
+    :param category: The category of the span (a string).
+    :param args: Additional information to include in the trace.
+    :returns: A dictionary that should be passed to :func:`end_span()` or
+              :data:`None` when tracing isn't enabled.
+    """
+    if get_trace_directory():
+        return dict(ph="X", name=name, cat=category, ts=time.time() * 1e6, args=args)
+
+
+def end_span(event):
+    """
+    Finish a span started by :func:`begin_span()`.
+
+    :param event: The return value of :func:`begin_span()`.
+    """
+    if event is not None:
+        event["dur"] = time.time() * 1e6 - event["ts"]
+        event["pid"] = os.getpid()
+        event["tid"] = os.getpid()
+        write_event(event)
+
+
+@contextlib.contextmanager
+def span(name, category, **args):
+    """Context manager to trace a block of code (see :func:`begin_span()`)."""
+    event = begin_span(name, category, **args)
+    try:
+        yield
+    finally:
+        end_span(event)
+
+
+def write_event(event):
+    """
+    Save an event to the file of the current process.
+
+    :param event: A JSON serializable dictionary.
+
+    The file is line buffered so each event is written immediately, because
+    processes created by :mod:`multiprocessing` exit using :func:`os._exit()`
+    (which means buffered data would be lost).
+    """
+    key = (os.getpid(), get_trace_directory())
+    if key not in trace_files:
+        filename = os.path.join(key[1], "events-%i.jsonl" % key[0])
+        trace_files[key] = open(filename, "a", 1)
+    trace_files[key].write(json.dumps(event) + "\n")
+
+
+def merge_traces(directory, filename):
+    """
+    Merge the events saved by the processes involved in a synchronization.
+
+    :param directory: The pathname of the trace directory (a string).
+    :param filename: The pathname of the trace file to create (a string).
+    :returns: The number of events in the trace (an integer).
+    """
+    events = []
+    for pathname in sorted(glob.glob(os.path.join(directory, "events-*.jsonl"))):
+        with open(pathname) as handle:
+            for line in handle:
+                # Ignore a truncated last line (left behind by a process that was killed).
+                try:
+                    events.append(json.loads(line))
+                except ValueError:
+                    pass
+    events.sort(key=lambda e: e.get("ts", 0))
+    with open(filename, "w") as handle:
+        json.dump(dict(traceEvents=events, displayTimeUnit="ms"), handle)
+    logger.info("Saved trace with %i events to %s.", len(events), filename)
+    return len(events)
@@ -0,0 +1,290 @@
+# Fast large file synchronization inspired by rsync.
+#
+# Author: Peter Odding <peter@peterodding.com>
+# Last Change: October 18, 2026
+# URL: https://pdiffcopy.readthedocs.io
+
+"""
+Change notifications for local files (used by the watch mode of the client).
+
+On Linux the inotify_ API is used (through :mod:`ctypes`, so no additional
+dependencies are required) which means a file that isn't being modified
+costs nothing to watch. On other platforms (or when inotify isn't available)
+the size, last modification time and inode number of the file are polled.
+
+Neither inotify nor fanotify report which byte ranges of a file were
+modified, so :class:`FileWatcher` only reports *whether* a file was modified
+(or replaced). The client figures out which blocks changed by hashing the
+source file and comparing the result with the hashes of the previous
+synchronization (see :func:`~pdiffcopy.client.Client.synchronize_watch()`).
+
+.. _inotify: https://man7.org/linux/man-pages/man7/inotify.7.html
+"""
+
+# Standard library modules.
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import time
+
+# External dependencies.
+from humanfriendly import Timer
+from property_manager import PropertyManager, lazy_property, mutable_property, required_property
+
+# Public identifiers that require documentation.
+__all__ = (
+    "EVENT_HEADER",
+    "FileWatcher",
+    "IN_ATTRIB",
+    "IN_CLOSE_WRITE",
+    "IN_DELETE_SELF",
+    "IN_IGNORED",
+    "IN_MODIFY",
+    "IN_MOVE_SELF",
+    "IN_Q_OVERFLOW",
+    "MODIFIED",
+    "REPLACED",
+    "WATCH_MASK",
+    "load_libc",
+    "logger",
+)
+
+# Initialize a logger for this module.
+logger = logging.getLogger(__name__)
+
+IN_MODIFY = 0x00000002
+"""File was modified (an integer, see ``<sys/inotify.h>``)."""
+
+IN_ATTRIB = 0x00000004
+"""Metadata changed (an integer, see ``<sys/inotify.h>``)."""
+
+IN_CLOSE_WRITE = 0x00000008
+"""File opened for writing was closed (an integer, see ``<sys/inotify.h>``)."""
+
+IN_DELETE_SELF = 0x00000400
+"""Watched file was deleted (an integer, see ``<sys/inotify.h>``)."""
+
+IN_MOVE_SELF = 0x00000800
+"""Watched file was moved (an integer, see ``<sys/inotify.h>``)."""
+
+IN_Q_OVERFLOW = 0x00004000
+"""Event queue overflowed (an integer, see ``<sys/inotify.h>``)."""
+
+IN_IGNORED = 0x00008000
+"""Watch was removed (an integer, see ``<sys/inotify.h>``)."""
+
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_DELETE_SELF | IN_MOVE_SELF
+"""The inotify events that :class:`FileWatcher` subscribes to (an integer)."""
+
+EVENT_HEADER = struct.Struct("iIII")
+"""The fixed size part of ``struct inotify_event`` (a :class:`struct.Struct` object)."""
+
+MODIFIED = "modified"
+"""Returned by :func:`FileWatcher.wait()` when the file was modified (a string)."""
+
+REPLACED = "replaced"
+"""
+Returned by :func:`FileWatcher.wait()` when the file was replaced (a string).
+
+This is also returned when events may have been lost (because the event
+queue overflowed) which means the caller can't rely on its knowledge of the
+contents of the file anymore.
+"""
+
+# The flags IN_NONBLOCK and IN_CLOEXEC have the same values as O_NONBLOCK and O_CLOEXEC.
+INIT_FLAGS = os.O_NONBLOCK | getattr(os, "O_CLOEXEC", 0)
+
+
+class FileWatcher(PropertyManager):
+
+    """
+    Watch a local file for changes.
+
+    Objects of this type can be used as context managers to make sure the
+    inotify file descriptor is closed.
+    """
+
+    @required_property
+    def filename(self):
+        """The absolute pathname of the file to watch (a string)."""
+
+    @lazy_property(writable=True)
+    def fingerprint(self):
+        """The size, last modification time and inode number of :attr:`filename` (a tuple or :data:`None`)."""
+        return self.get_fingerprint()
+
+    @lazy_property(writable=True)
+    def inotify_fd(self):
+        """
+        The inotify file descriptor (an integer or :data:`None` when inotify isn't available).
+
+        When this is :data:`None` :func:`wait()` falls back to polling.
+        """
+        if self.libc is not None:
+            fd = self.libc.inotify_init1(INIT_FLAGS)
+            if fd >= 0:
+                return fd
+            error = os.strerror(ctypes.get_errno())
+            logger.warning("Failed to initialize inotify (%s), falling back to polling ..", error)
+
+    @lazy_property
+    def libc(self):
+        """The result of :func:`load_libc()`."""
+        return load_libc()
+
+    @mutable_property
+    def poll_interval(self):
+        """The number of seconds between checks when inotify isn't available (a number, defaults to 1)."""
+        return 1
+
+    @mutable_property
+    def watch_descriptor(self):
+        """The inotify watch descriptor of :attr:`filename` (an integer or :data:`None`)."""
+
+    def close(self):
+        """Stop watching :attr:`filename`."""
+        if self.inotify_fd is not None:
+            os.close(self.inotify_fd)
+            self.inotify_fd = None
+            self.watch_descriptor = None
+
+    def start(self):
+        """
+        Start watching :attr:`filename`.
+
+        :returns: :data:`True` when the file is being watched, :data:`False`
+                  when it doesn't exist (in which case :func:`wait()` will
+                  try again).
+
+        Changes to the file are only reported after this has been called, so
+        this should be called before the file is read.
+        """
+        if self.inotify_fd is None:
+            self.fingerprint = self.get_fingerprint()
+            return self.fingerprint is not None
+        wd = self.libc.inotify_add_watch(self.inotify_fd, self.filename.encode("utf-8"), WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error == errno.ENOENT:
+                return False
+            raise OSError(error, os.strerror(error), self.filename)
+        self.watch_descriptor = wd
+        return True
+
+    def wait(self, timeout=None):
+        """
+        Wait for :attr:`filename` to change.
+
+        :param timeout: The maximum number of seconds to wait (a number or
+                        :data:`None` to wait indefinitely).
+        :returns: :data:`MODIFIED`, :data:`REPLACED` or :data:`None` when the
+                  timeout expired without any changes. All changes that are
+                  pending when this is called are combined into one result.
+        """
+        if self.inotify_fd is None:
+            return self.poll(timeout)
+        if self.watch_descriptor is None and not self.start():
+            # The file doesn't exist (yet).
+            time.sleep(self.poll_interval if timeout is None else min(timeout, self.poll_interval))
+            return REPLACED if self.start() else None
+        readable, _, _ = select.select([self.inotify_fd], [], [], timeout)
+        if not readable:
+            return None
+        result = None
+        for wd, mask in self.read_events():
+            if mask & IN_Q_OVERFLOW:
+                result = REPLACED
+            elif wd != self.watch_descriptor:
+                # Ignore events of a watch that was removed by restart().
+                continue
+            elif mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+                result = REPLACED
+            elif result is None:
+                result = MODIFIED
+        if result == REPLACED:
+            logger.info("Watched file %s was replaced (or events were lost).", self.filename)
+            self.restart()
+        return result
+
+    def read_events(self):
+        """
+        Read the pending events from :attr:`inotify_fd`.
+
+        :returns: A list of tuples with two integers each (a watch descriptor and an event mask).
+        """
+        events = []
+        while True:
+            try:
+                data = os.read(self.inotify_fd, 1024 * 64)
+            except OSError as e:
+                if e.errno == errno.EAGAIN:
+                    return events
+                raise
+            position = 0
+            while position + EVENT_HEADER.size <= len(data):
+                wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, position)
+                events.append((wd, mask))
+                position += EVENT_HEADER.size + length
+
+    def restart(self):
+        """Watch :attr:`filename` again (after it was replaced)."""
+        if self.watch_descriptor is not None:
+            # This fails when the kernel already removed the watch, that's fine.
+            self.libc.inotify_rm_watch(self.inotify_fd, self.watch_descriptor)
+            self.watch_descriptor = None
+        self.start()
+
+    def poll(self, timeout=None):
+        """Implementation of :func:`wait()` when inotify isn't available."""
+        timer = Timer()
+        while True:
+            fingerprint = self.get_fingerprint()
+            if fingerprint != self.fingerprint:
+                previous = self.fingerprint
+                self.fingerprint = fingerprint
+                if previous is None or fingerprint is None or previous[2] != fingerprint[2]:
+                    return REPLACED
+                return MODIFIED
+            if timeout is not None and timer.elapsed_time >= timeout:
+                return None
+            delay = self.poll_interval
+            if timeout is not None:
+                delay = max(0, min(delay, timeout - timer.elapsed_time))
+            time.sleep(delay)
+
+    def get_fingerprint(self):
+        """Get the size, last modification time and inode number of :attr:`filename` (a tuple or :data:`None`)."""
+        try:
+            info = os.stat(self.filename)
+            return info.st_size, info.st_mtime, info.st_ino
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    def __enter__(self):
+        """Start watching :attr:`filename`."""
+        self.start()
+        return self
+
+    def __exit__(self, exc_type=None, exc_value=None, traceback=None):
+        """Stop watching :attr:`filename`."""
+        self.close()
+
+
+def load_libc():
+    """
+    Load the C library using :mod:`ctypes`.
+
+    :returns: A :class:`ctypes.CDLL` object or :data:`None` when the C
+              library doesn't provide the inotify functions.
+    """
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    except OSError:
+        return None
+    if hasattr(libc, "inotify_init1"):
+        return libc